@@ -0,0 +1,368 @@
+import asyncio
+import html
+import logging
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot, types
+
+# Типы уведомлений, на которые админ может ответить пользователю
+REPLYABLE_KINDS = frozenset({
+    'application', 'rest', 'complaint', 'cant_join', 'user_reply'
+})
+
+# Медиа, которые можно отправить с подписью (одним сообщением)
+CAPTION_MEDIA = ('photo', 'video', 'animation', 'document', 'audio', 'voice')
+# Медиа без подписи: отправляются ответом на текст уведомления
+PLAIN_MEDIA = ('video_note', 'sticker')
+
+# Сколько последних отметок об обработке показывать в уведомлении
+MAX_STATUS_LINES = 5
+# Длина одной отметки (до экранирования) и доля лимита под отметки
+STATUS_LINE_LIMIT = 120
+STATUS_SHARE = 0.5
+CAPTION_LIMIT = 1024
+TEXT_LIMIT = 4096
+
+
+# Тег или HTML-сущность: внутри них текст резать нельзя
+_HTML_TOKEN = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*>|&(?:#\d+|#x[0-9a-fA-F]+|\w+);')
+
+
+def truncate_html(text: str, limit: int) -> str:
+    """Обрезка HTML до limit символов только между тегами и сущностями.
+
+    Обрезанный текст заканчивается многоточием, незакрытые теги
+    закрываются (их длина входит в limit).
+    """
+    if len(text) <= limit:
+        return text
+    stack: List[str] = []
+    cut, cut_stack = 0, ()
+    i = 0
+    while i < len(text):
+        closing = sum(len(tag) + 3 for tag in stack)
+        if i + 1 + closing > limit:
+            break
+        cut, cut_stack = i, tuple(stack)
+        match = _HTML_TOKEN.match(text, i)
+        if match is None:
+            i += 1
+            continue
+        closing_tag, tag = match.group(1), match.group(2)
+        if tag:
+            tag = tag.lower()
+            if not closing_tag:
+                stack.append(tag)
+            elif tag in stack:
+                del stack[len(stack) - 1 - stack[::-1].index(tag)]
+        i = match.end()
+    return text[:cut] + "…" + "".join(f"</{tag}>" for tag in reversed(cut_stack))
+
+
+class NoticeRef:
+    """Привязка сообщения у админа к пользователю"""
+    __slots__ = ('user_id', 'kind', 'notice_id')
+
+    def __init__(self, user_id: int, kind: str, notice_id: Optional[int]):
+        self.user_id = user_id
+        self.kind = kind
+        self.notice_id = notice_id
+
+
+class Notice:
+    """Уведомление админам и его копии (chat_id, message_id, edit_mode)"""
+    __slots__ = ('notice_id', 'user_id', 'kind', 'text', 'status', 'copies')
+
+    def __init__(self, notice_id: int, user_id: int, kind: str, text: str,
+                 status: List[str] = None,
+                 copies: List[Tuple[int, int, Optional[str]]] = None):
+        self.notice_id = notice_id
+        self.user_id = user_id
+        self.kind = kind
+        self.text = text
+        self.status = status or []
+        self.copies = copies or []
+
+    def render(self, limit: int) -> str:
+        """Текст уведомления (HTML) с отметками об обработке (обычный текст)"""
+        lines = []
+        budget = int(limit * STATUS_SHARE)
+        size = 2
+        # Новые отметки важнее: не поместившиеся старые не показываются
+        for status in reversed(self.status[-MAX_STATUS_LINES:]):
+            if len(status) > STATUS_LINE_LIMIT:
+                status = status[:STATUS_LINE_LIMIT - 1] + "…"
+            line = f"✅ {html.escape(status)}"
+            if size + len(line) + 1 > budget:
+                break
+            lines.append(line)
+            size += len(line) + 1
+        if not lines:
+            return truncate_html(self.text, limit)
+        footer = "\n\n" + "\n".join(reversed(lines))
+        return truncate_html(self.text, limit - len(footer)) + footer
+
+
+class LRUCache:
+    """Простой LRU-кэш на OrderedDict"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        return self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class AdminNoticeIndex:
+    """Индекс (чат админа, сообщение) -> (пользователь, тип уведомления).
+
+    Записи хранятся в Postgres, недавние - в LRU-кэше процесса.
+    """
+
+    def __init__(self, database, maxsize: int = 4096):
+        self.db = database
+        self.cache = LRUCache(maxsize)
+
+    async def record(self, notice_id: Optional[int], copies: Iterable[Tuple[int, int, Optional[str]]],
+                     user_id: int, kind: str):
+        """Сохраняет копии уведомления у админов"""
+        copies = list(copies)
+        if not copies:
+            return
+        try:
+            await self.db.save_admin_notice_copies(notice_id, copies, user_id, kind)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения индекса уведомления: {e}")
+        ref = NoticeRef(user_id, kind, notice_id)
+        for admin_chat_id, message_id, _ in copies:
+            self.cache.put((admin_chat_id, message_id), ref)
+
+    async def resolve(self, admin_chat_id: int, message_id: int) -> Optional[NoticeRef]:
+        """Поиск пользователя по сообщению, на которое ответил админ"""
+        key = (admin_chat_id, message_id)
+        ref = self.cache.get(key)
+        if ref is not None:
+            return ref
+        row = await self.db.find_admin_notice_message(admin_chat_id, message_id)
+        if not row:
+            return None
+        ref = NoticeRef(row['user_id'], row['kind'], row['notice_id'])
+        self.cache.put(key, ref)
+        return ref
+
+
+def extract_media(message: types.Message) -> Optional[Tuple[str, str]]:
+    """Тип и file_id медиа из сообщения (файл повторно не загружается)"""
+    if message.photo:
+        return 'photo', message.photo[-1].file_id
+    for media_type in CAPTION_MEDIA[1:] + PLAIN_MEDIA:
+        media = getattr(message, media_type, None)
+        if media is not None:
+            return media_type, media.file_id
+    return None
+
+
+class AdminNotifier:
+    """Рассылка уведомлений админам и синхронизация их состояния.
+
+    Уведомление создается один раз и рассылается всем админам параллельно.
+    Когда один админ обрабатывает уведомление, копии у всех админов
+    обновляются одним отложенным редактированием. При закрытии отложенные
+    редактирования выполняются сразу, но не дольше flush_timeout.
+    """
+
+    def __init__(self, bot: Bot, database, admin_ids: Iterable[int],
+                 edit_delay: float = 1.5, maxsize: int = 1024,
+                 flush_timeout: float = 5.0):
+        self.bot = bot
+        self.db = database
+        self.admin_ids = tuple(admin_ids)
+        self.edit_delay = edit_delay
+        self.flush_timeout = flush_timeout
+        self.index = AdminNoticeIndex(database)
+        self.notices = LRUCache(maxsize)
+        self._pending_edits: Dict[int, asyncio.Task] = {}
+        self._closing = asyncio.Event()
+
+    async def publish(self, text: str, user_id: int, kind: str,
+                      media_from: types.Message = None,
+                      exclude_admin: int = None,
+                      admin_ids: Iterable[int] = None) -> Optional[int]:
+        """Рассылает уведомление админам (по умолчанию - self.admin_ids), возвращает notice_id"""
+        media = extract_media(media_from) if media_from is not None else None
+        admins = [a for a in (self.admin_ids if admin_ids is None else admin_ids)
+                  if a != exclude_admin]
+
+        results = await asyncio.gather(
+            self.db.create_admin_notice(user_id, kind, text),
+            *(self._send_copy(admin_id, text, media, media_from)
+              for admin_id in admins),
+            return_exceptions=True)
+
+        copies = []
+        for admin_id, result in zip(admins, results[1:]):
+            if isinstance(result, BaseException):
+                logging.error(f"Ошибка отправки уведомления админу {admin_id}: {result}")
+                continue
+            copies.extend(result)
+
+        notice_id = results[0]
+        if isinstance(notice_id, BaseException):
+            logging.error(f"Ошибка создания уведомления: {notice_id}")
+            # Копии уже отправлены: ответы на них должны находить пользователя,
+            # хотя отметки об обработке для них не синхронизируются
+            await self.index.record(None, copies, user_id, kind)
+            return None
+
+        self.notices.put(notice_id, Notice(notice_id, user_id, kind, text,
+                                           copies=copies))
+        await self.index.record(notice_id, copies, user_id, kind)
+        return notice_id
+
+    async def _send_copy(self, admin_id: int, text: str,
+                         media: Optional[Tuple[str, str]],
+                         media_from: Optional[types.Message]):
+        if media is None:
+            if media_from is not None:
+                # Неподдерживаемый тип медиа - копируем сообщение целиком
+                sent = await self.bot.send_message(admin_id, text)
+                copied = await self.bot.copy_message(
+                    admin_id, media_from.chat.id, media_from.message_id,
+                    reply_to_message_id=sent.message_id)
+                return [(admin_id, sent.message_id, 'text'),
+                        (admin_id, copied.message_id, None)]
+            sent = await self.bot.send_message(admin_id, text)
+            return [(admin_id, sent.message_id, 'text')]
+
+        media_type, file_id = media
+        send = getattr(self.bot, f"send_{media_type}")
+        if media_type in CAPTION_MEDIA and len(text) <= CAPTION_LIMIT:
+            sent = await send(admin_id, file_id, caption=text)
+            return [(admin_id, sent.message_id, 'caption')]
+
+        sent = await self.bot.send_message(admin_id, text)
+        attached = await send(admin_id, file_id,
+                              reply_to_message_id=sent.message_id)
+        return [(admin_id, sent.message_id, 'text'),
+                (admin_id, attached.message_id, None)]
+
+    async def resolve(self, admin_chat_id: int, message_id: int) -> Optional[NoticeRef]:
+        return await self.index.resolve(admin_chat_id, message_id)
+
+    async def get_notice(self, notice_id: int) -> Optional[Notice]:
+        notice = self.notices.get(notice_id)
+        if notice is not None:
+            return notice
+        row = await self.db.get_admin_notice(notice_id)
+        if not row:
+            return None
+        notice = Notice(notice_id, row['user_id'], row['kind'], row['text'],
+                        status=row['status'].split('\n') if row['status'] else [],
+                        copies=row['copies'])
+        self.notices.put(notice_id, notice)
+        return notice
+
+    async def mark_handled(self, notice_id: int, status: str):
+        """Добавляет отметку об обработке и планирует обновление копий у админов"""
+        notice = await self.get_notice(notice_id)
+        if notice is None:
+            return
+        notice.status.append(status)
+        try:
+            await self.db.update_admin_notice_status(notice_id,
+                                                     '\n'.join(notice.status))
+        except Exception as e:
+            logging.error(f"Ошибка сохранения статуса уведомления {notice_id}: {e}")
+
+        # Несколько отметок подряд объединяются в одно редактирование
+        if notice_id not in self._pending_edits:
+            self._pending_edits[notice_id] = asyncio.create_task(
+                self._flush_edits(notice))
+
+    async def _flush_edits(self, notice: Notice):
+        try:
+            # close() не ждет окончания задержки
+            await asyncio.wait_for(self._closing.wait(), self.edit_delay)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._pending_edits.pop(notice.notice_id, None)
+        await asyncio.gather(*(self._edit_copy(notice, chat_id, message_id, mode)
+                               for chat_id, message_id, mode in notice.copies
+                               if mode is not None))
+
+    async def _edit_copy(self, notice: Notice, chat_id: int, message_id: int,
+                         mode: str):
+        try:
+            if mode == 'caption':
+                await self.bot.edit_message_caption(
+                    chat_id=chat_id, message_id=message_id,
+                    caption=notice.render(CAPTION_LIMIT))
+            else:
+                await self.bot.edit_message_text(
+                    chat_id=chat_id, message_id=message_id,
+                    text=notice.render(TEXT_LIMIT))
+        except Exception as e:
+            logging.error(
+                f"Ошибка обновления уведомления {notice.notice_id} у админа {chat_id}: {e}")
+
+    async def close(self):
+        """Выполняет отложенные редактирования; не успевшие за flush_timeout отменяются"""
+        self._closing.set()
+        tasks = list(self._pending_edits.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=self.flush_timeout)
+        if pending:
+            logging.warning(f"Не обновлены копии уведомлений при закрытии: {len(pending)}")
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # После перезапуска бота отметки снова объединяются с задержкой
+        self._closing.clear()
+
+
+def parse_legacy_notice_user_id(reply_text: str) -> Optional[int]:
+    """Поиск ID пользователя в тексте уведомления, отправленного до появления индекса.
+
+    None - текст не похож на уведомление, 0 - уведомление, но ID в нем не найден.
+    """
+    if not any(keyword in reply_text for keyword in [
+            "Заявка на вступление!", "Заявка на рест", "Не может влиться!",
+            "ответил:", "Ответ от пользователя", "ID для ответа:"
+    ]):
+        return None
+
+    for line in reply_text.split('\n'):
+        if "ID для ответа:" in line or line.startswith("#️⃣ ID:"):
+            user_id_str = line.split(":")[1].strip().replace(
+                "<code>", "").replace("</code>", "")
+            if user_id_str.isdigit():
+                return int(user_id_str)
+
+    if "tg://user?id=" in reply_text:
+        user_id_str = reply_text.split("tg://user?id=")[1].split("'")[0]
+        if user_id_str.isdigit():
+            return int(user_id_str)
+    return 0
@@ -0,0 +1,451 @@
+"""Микробенчмарки горячих путей бота против фейкового Bot API.
+
+Каждый бенчмарк (в стиле asv) один раз готовит данные в setup, затем
+вызывает хендлер number раз; подготовка перед вызовом (prepare) в замер не
+входит. Сиды фиксированы, поэтому число запросов к API на вызов
+детерминировано. По умолчанию используется хранилище в памяти; для
+локального Postgres задайте STORAGE_BACKEND=postgres и DATABASE_URL.
+
+Пример:
+    python benchmarks.py --save baseline.json
+    python benchmarks.py --compare baseline.json --filter participant
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+# Хранилище задается до импорта main (db создается при импорте)
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+# loadtest задает окружение по умолчанию до импорта main
+from loadtest import USER_ID_BASE, LoadDriver, percentile  # noqa: E402
+import main  # noqa: E402
+from fake_telegram import FAKE_BOT_ID, FakeTelegramServer  # noqa: E402
+
+# Пользователи бенчмарков не пересекаются с пользователями нагрузочного теста
+BENCH_USER_BASE = USER_ID_BASE + 1_000_000
+# Квиз-ID бенчмарков, чтобы не задеть настоящие викторины в тестовой базе
+BENCH_QUIZ_BASE = 9_000_000
+
+
+class Suite:
+    """Общее окружение бенчмарков: фейковый API, генератор апдейтов, ID"""
+
+    def __init__(self, server: FakeTelegramServer, seed: int):
+        self.server = server
+        self.driver = LoadDriver(server, 0, 1, seed)
+        self.bot = main.bot
+        self.admin_id = main.ADMIN_IDS[0]
+        self.group_id = main.GROUP_ID
+        self._next_user = BENCH_USER_BASE
+        self._next_quiz = BENCH_QUIZ_BASE
+
+    def new_user(self, status: str = 'member') -> int:
+        self._next_user += 1
+        user_id = self._next_user
+        self.server.state.add_user(user_id, f"Bench{user_id % 100000}", f"bench{user_id}")
+        self.server.state.set_member(self.group_id, user_id, status)
+        return user_id
+
+    def new_quiz_id(self) -> int:
+        self._next_quiz += 1
+        return self._next_quiz
+
+    async def start_game(self, players: List[int]) -> Dict:
+        """Запущенная игра "Жених": первый игрок - жених, раунд 1 с вопросом"""
+        db = main.db
+        game_id = await db.create_bride_game(self.group_id, self.admin_id)
+        bride_id, others = players[0], players[1:]
+        await db.add_bride_game_participant(game_id, bride_id, None, True)
+        for number, user_id in enumerate(others, start=1):
+            await db.add_bride_game_participant(game_id, user_id, number, False)
+        await db.start_bride_game(game_id, bride_id)
+        round_id = await db.create_bride_round(game_id, 1, "Вопрос бенчмарка?")
+        status = await self.bot.send_message(self.admin_id, "Статус ответов")
+        await db.save_round_status_message(round_id, self.admin_id, status.message_id)
+        return await db.get_bride_game(game_id)
+
+    async def finish_game(self, game: Dict):
+        await main.db.finish_bride_game(game['game_id'])
+        main.bride_status_messages.clear()
+
+
+class Benchmark:
+    """Замер одного пути кода: setup(param) один раз, prepare(i) и call(i) на каждый вызов"""
+    name = ''
+    params = (None,)
+    number = 200
+    warmup = 10
+
+    def __init__(self, suite: Suite):
+        self.suite = suite
+
+    async def setup(self, param):
+        pass
+
+    async def prepare(self, i: int):
+        pass
+
+    async def call(self, i: int):
+        raise NotImplementedError
+
+    async def teardown(self):
+        pass
+
+
+class RouteUpdate(Benchmark):
+    """Маршрутизация сообщения участника в группе через dp.feed_update"""
+    name = 'dp.feed_update'
+
+    async def setup(self, param):
+        self.user_id = self.suite.new_user()
+
+    async def prepare(self, i):
+        self.update = self.suite.driver.message(self.user_id, f"Сообщение {i}",
+                                                chat_id=self.suite.group_id)
+
+    async def call(self, i):
+        await main.dp.feed_update(self.suite.bot, self.update)
+
+
+class AdminResponseNonPlayer(Benchmark):
+    """Личное сообщение участника группы, который не играет в "Жениха" """
+    name = 'handle_admin_response'
+    params = ('no_game', 'game')
+
+    async def setup(self, param):
+        self.user_id = self.suite.new_user()
+        self.game = None
+        if param == 'game':
+            self.game = await self.suite.start_game([self.suite.new_user() for _ in range(5)])
+
+    async def prepare(self, i):
+        self.message = self.suite.driver.message(self.user_id, f"Привет {i}").message
+        self.state = main.dp.fsm.get_context(self.suite.bot, self.user_id, self.user_id)
+
+    async def call(self, i):
+        await main.handle_admin_response(self.message, self.state, main.tenants.default)
+
+    async def teardown(self):
+        if self.game:
+            await self.suite.finish_game(self.game)
+
+
+class QuizCallback(Benchmark):
+    """Ответ на викторину кнопкой"""
+    name = 'quiz_callback_handler'
+
+    async def setup(self, param):
+        self.quiz_id = self.suite.new_quiz_id()
+        self.users = [self.suite.new_user() for _ in range(50)]
+        await main.db.save_quiz(self.quiz_id, self.suite.group_id, "Вопрос бенчмарка?",
+                                ["Да", "Нет", "Не знаю"], [0], self.suite.admin_id)
+
+    async def prepare(self, i):
+        user_id = self.users[i % len(self.users)]
+        self.callback = self.suite.driver.callback(
+            user_id, f"quiz_{self.quiz_id}_{i % 3}").callback_query
+
+    async def call(self, i):
+        await main.quiz_callback_handler(self.callback)
+
+    async def teardown(self):
+        await main.db.delete_quiz(self.quiz_id)
+
+
+class ParticipantAnswer(Benchmark):
+    """Ответ игрока в раунде "Жениха" (статус для ведущего обновляется каждый раз)"""
+    name = 'handle_participant_answer'
+    params = (10, 50, 200)
+    number = 50
+    warmup = 3
+
+    async def setup(self, players):
+        self.game = await self.suite.start_game([self.suite.new_user() for _ in range(players + 1)])
+        self.participants = await main.db.get_bride_participants(self.game['game_id'])
+        # Последний игрок не отвечает, чтобы раунд не завершился
+        self.answering = [p for p in self.participants if not p['is_bride']][:-1]
+
+    async def prepare(self, i):
+        self.participant = self.answering[i % len(self.answering)]
+        self.message = self.suite.driver.message(self.participant['user_id'], f"Ответ {i}").message
+
+    async def call(self, i):
+        await main.handle_participant_answer(self.message, self.game, self.participants,
+                                             self.participant)
+
+    async def teardown(self):
+        await self.suite.finish_game(self.game)
+
+
+class EndQuiz(Benchmark):
+    """Завершение викторины с подсчетом результатов"""
+    name = 'end_quiz_command'
+    params = (1000,)
+    number = 3
+    warmup = 1
+
+    async def setup(self, voters):
+        self.voters = [BENCH_USER_BASE + 500_000 + i for i in range(voters)]
+        self.quiz_ids = []
+
+    async def prepare(self, i):
+        quiz_id = self.suite.new_quiz_id()
+        self.quiz_ids.append(quiz_id)
+        await main.db.save_quiz(quiz_id, self.suite.group_id, "Вопрос бенчмарка?",
+                                ["Да", "Нет", "Не знаю"], [0], self.suite.admin_id)
+        for index, user_id in enumerate(self.voters):
+            await main.db.save_quiz_answer(quiz_id, user_id, index % 3)
+        self.message = self.suite.driver.message(
+            self.suite.admin_id, f"завершить викторину {quiz_id}").message
+
+    async def call(self, i):
+        await main.end_quiz_command(self.message)
+
+    async def teardown(self):
+        for quiz_id in self.quiz_ids:
+            await main.db.delete_quiz(quiz_id)
+
+
+class AssignEmoji(Benchmark):
+    """Назначение эмодзи новому админу при занятых used эмодзи"""
+    name = 'assign_emoji_to_user'
+    params = (0, 50)
+
+    async def setup(self, used):
+        self.prefilled = [self.suite.new_user() for _ in range(used)]
+        for user_id in self.prefilled:
+            await main.assign_emoji_to_user(self.suite.group_id, user_id)
+        self.user_id = None
+
+    async def prepare(self, i):
+        # Число занятых эмодзи не растет от вызова к вызову
+        if self.user_id is not None:
+            await main.db.remove_emoji(self.suite.group_id, self.user_id)
+        self.user_id = BENCH_USER_BASE + 800_000 + i
+
+    async def call(self, i):
+        await main.assign_emoji_to_user(self.suite.group_id, self.user_id)
+
+    async def teardown(self):
+        for user_id in self.prefilled + [self.user_id]:
+            await main.db.remove_emoji(self.suite.group_id, user_id)
+
+
+class ChatMemberUpdate(Benchmark):
+    """Вступление по заявке (повышение, подпись, приветствие) и выход участника с ролью"""
+    name = 'chat_member_handler'
+    params = ('join', 'leave')
+
+    async def setup(self, kind):
+        self.kind = kind
+        state = self.suite.server.state
+        # Бот может назначать админов. Создатель группы на время замера -
+        # обычный участник: теги админов рассылаются с паузой 1 с после
+        # каждого сообщения, и пауза заслонила бы остальную работу хендлера
+        state.set_member(self.suite.group_id, FAKE_BOT_ID, 'administrator',
+                         rights={'can_promote_members': True})
+        state.set_member(self.suite.group_id, self.suite.admin_id, 'member')
+
+    async def prepare(self, i):
+        user_id = self.suite.new_user('left' if self.kind == 'join' else 'member')
+        if self.kind == 'join':
+            await main.member_directory.save_user_data(self.suite.group_id, user_id,
+                                                       role=f"Роль {user_id}")
+            update = self.suite.driver.chat_member(user_id, 'left', 'member')
+        else:
+            await main.db.record_user_join(self.suite.group_id, user_id)
+            await main.member_directory.save_user_data(self.suite.group_id, user_id,
+                                                       role="Роль", custom_title="Роль")
+            update = self.suite.driver.chat_member(user_id, 'member', 'left')
+        self.event = update.chat_member
+
+    async def call(self, i):
+        await main.chat_member_handler(self.event, main.tenants.default)
+
+    async def teardown(self):
+        state = self.suite.server.state
+        state.set_member(self.suite.group_id, FAKE_BOT_ID, 'left')
+        state.set_member(self.suite.group_id, self.suite.admin_id, 'creator')
+
+
+BENCHMARKS = (RouteUpdate, AdminResponseNonPlayer, QuizCallback, ParticipantAnswer,
+              EndQuiz, AssignEmoji, ChatMemberUpdate)
+
+
+async def measure(benchmark: Benchmark, param, seed: int) -> Dict:
+    server = benchmark.suite.server
+    random.seed(seed)
+    await benchmark.setup(param)
+    durations = []
+    api_calls = 0
+    try:
+        for i in range(benchmark.warmup + benchmark.number):
+            await benchmark.prepare(i)
+            calls_before = server.total_calls
+            started = time.perf_counter()
+            await benchmark.call(i)
+            elapsed = time.perf_counter() - started
+            if i >= benchmark.warmup:
+                durations.append(elapsed)
+                api_calls += server.total_calls - calls_before
+    finally:
+        await benchmark.teardown()
+    return {
+        'calls': len(durations),
+        'median_us': percentile(durations, 50) * 1e6,
+        'p25_us': percentile(durations, 25) * 1e6,
+        'p75_us': percentile(durations, 75) * 1e6,
+        'p90_us': percentile(durations, 90) * 1e6,
+        'min_us': min(durations) * 1e6,
+        'mean_us': sum(durations) / len(durations) * 1e6,
+        'api_calls': api_calls / len(durations),
+    }
+
+
+async def run(args) -> Dict:
+    server = FakeTelegramServer(latency=args.latency, seed=args.seed)
+    await server.start()
+    main.bot.session.api = server.api_server()
+    if not await main.db.connect():
+        await server.stop()
+        raise SystemExit("Нет подключения к тестовой базе (DATABASE_URL)")
+    await main.tenants.load()
+    await main.load_data_from_db()
+
+    suite = Suite(server, args.seed)
+    results = {}
+    try:
+        for benchmark_class in BENCHMARKS:
+            for param in benchmark_class.params:
+                key = benchmark_class.name if param is None else f"{benchmark_class.name}[{param}]"
+                if args.filter and args.filter not in key:
+                    continue
+                results[key] = await measure(benchmark_class(suite), param, args.seed)
+                if not args.json:
+                    print(f"{key}: {results[key]['median_us']:.0f} мкс", file=sys.stderr)
+    finally:
+        await main.notifier.close()
+        await main.bot.session.close()
+        await main.db.close()
+        await server.stop()
+
+    return {
+        'backend': os.environ['STORAGE_BACKEND'],
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'latency': args.latency,
+        'results': results,
+    }
+
+
+def is_noisy(row: Dict, threshold: float) -> bool:
+    """Разброс замеров (межквартильный размах) больше threshold процентов медианы:
+    по такому прогону изменение медианы не отличить от шума"""
+    if 'p25_us' not in row or not row['median_us']:
+        return False
+    return (row['p75_us'] - row['p25_us']) / row['median_us'] * 100 > threshold
+
+
+def is_slower(row: Dict, base: Dict, threshold: float) -> bool:
+    """Медиана выросла больше чем на threshold процентов, и межквартильные
+    интервалы прогонов не пересекаются. Для эталонов без квартилей
+    сравниваются минимумы - они шумят меньше медиан"""
+    if not base['median_us']:
+        return False
+    if 'p25_us' not in base:
+        return base['min_us'] and \
+            (row['min_us'] - base['min_us']) / base['min_us'] * 100 > threshold
+    grew = (row['median_us'] - base['median_us']) / base['median_us'] * 100 > threshold
+    return grew and row['p25_us'] > base['p75_us']
+
+
+def compare(report: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Бенчмарки, которые стали медленнее (is_slower; шумные не учитываются)
+    или стали делать больше запросов к API (это число не шумит)"""
+    regressions = []
+    for key, row in report['results'].items():
+        base = baseline['results'].get(key)
+        if not base:
+            continue
+        slower = not (is_noisy(row, threshold) or is_noisy(base, threshold)) and \
+            is_slower(row, base, threshold)
+        if slower or row['api_calls'] > base['api_calls']:
+            regressions.append(key)
+    return regressions
+
+
+def format_report(report: Dict, baseline: Optional[Dict] = None,
+                  regressions: List[str] = (), threshold: float = 25.0) -> str:
+    lines = [f"Хранилище: {report['backend']}, Python {report['python']}, "
+             f"seed {report['seed']}, задержка API {report['latency']} с"]
+    if baseline:
+        lines.append(f"{'бенчмарк':<40}{'было мкс':>11}{'стало мкс':>11}{'изм.':>9}"
+                     f"{'API было':>10}{'API стало':>11}")
+    else:
+        lines.append(f"{'бенчмарк':<40}{'медиана мкс':>13}{'p90 мкс':>11}"
+                     f"{'мин мкс':>11}{'API/вызов':>11}")
+    for key, row in report['results'].items():
+        base = (baseline or {}).get('results', {}).get(key)
+        if baseline and base:
+            change = (row['median_us'] - base['median_us']) / base['median_us'] * 100 \
+                if base['median_us'] else 0.0
+            mark = ' !' if key in regressions else ''
+            if not mark and (is_noisy(row, threshold) or is_noisy(base, threshold)):
+                mark = ' ~'
+            lines.append(f"{key:<40}{base['median_us']:>11.0f}{row['median_us']:>11.0f}"
+                         f"{change:>+8.1f}%{base['api_calls']:>10.1f}{row['api_calls']:>11.1f}{mark}")
+        elif baseline:
+            lines.append(f"{key:<40}{'-':>11}{row['median_us']:>11.0f}{'новый':>9}"
+                         f"{'-':>10}{row['api_calls']:>11.1f}")
+        else:
+            lines.append(f"{key:<40}{row['median_us']:>13.0f}{row['p90_us']:>11.0f}"
+                         f"{row['min_us']:>11.0f}{row['api_calls']:>11.1f}")
+    if baseline:
+        lines.append("")
+        lines.append(f"~ - разброс замеров больше {threshold:.0f}% медианы, "
+                     f"время не сравнивается")
+    if regressions:
+        lines.append("")
+        lines.append(f"Регрессии: {', '.join(regressions)}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--filter', help="запускать только бенчмарки, содержащие строку")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="задержка ответа фейкового API, с")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="сохранить результаты как эталон (JSON)")
+    parser.add_argument('--compare', help="эталон для сравнения")
+    parser.add_argument('--threshold', type=float, default=25.0,
+                        help="рост медианы в процентах, который считается регрессией "
+                             "(если межквартильные интервалы не пересекаются)")
+    parser.add_argument('--json', action='store_true', help="отчет в JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    baseline = None
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json
+          else format_report(report, baseline, regressions, args.threshold))
+    sys.exit(1 if regressions else 0)
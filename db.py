@@ -1,12 +1,203 @@
+import asyncio
 import asyncpg
 import json
 import logging
 import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
 from typing import Dict, Optional, List, Tuple
 
-class Database:
+from roles import similar_roles
+from storage import Storage
+
+# Канал NOTIFY об изменениях таблиц, которые процессы бота кэшируют в памяти
+CACHE_CHANNEL = 'bot_cache'
+# Канал NOTIFY о новых апдейтах в updates_queue (режим BOT_MODE=ingest/worker)
+QUEUE_CHANNEL = 'updates_queue'
+# Кэшируемые таблицы и столбец-ключ, который попадает в уведомление
+CACHE_TABLES = {
+    'groups': 'group_id',
+    'active_quizzes': 'quiz_id',
+    'admin_notices': 'notice_id',
+    'user_data': 'user_id',
+    'user_emojis': 'user_id',
+    'roles': 'role_id',
+}
+
+
+def _affected(status: str) -> int:
+    """Количество строк из статуса команды asyncpg (например, 'DELETE 5')"""
+    try:
+        return int(status.split()[-1])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+# Сообщество, к которому относятся строки, записанные до поддержки нескольких
+# сообществ (см. _migrate_group_keys)
+LEGACY_GROUP_ID = int(os.environ.get('GROUP_ID', '0'))
+
+STATS_BUMP_SQL = """
+    INSERT INTO stats_daily (group_id, day, metric, key, value)
+    VALUES ($1, CURRENT_DATE, $2, $3, $4)
+    ON CONFLICT (group_id, day, metric, key)
+    DO UPDATE SET value = stats_daily.value + EXCLUDED.value
+"""
+
+
+class UnitOfWork:
+    """Несколько изменений в одной транзакции на одном соединении.
+
+    Записи ставятся в очередь (execute) и отправляются при flush: одинаковые
+    запросы - одним пакетом executemany (asyncpg передает его конвейером за
+    один обмен с сервером) в позиции первого из них. Поэтому в очередь
+    ставятся независимые друг от друга записи; если порядок важен, между
+    ними нужен flush(). Чтения (fetch*, run) сначала отправляют очередь.
+
+    Транзакция открывается при первой отправке записей или первом запросе
+    метода хранилища через соединение единицы работы. Если к концу блока
+    в очереди один пакет и транзакция еще не открыта, BEGIN/COMMIT не
+    нужны: отдельный запрос и executemany атомарны сами по себе.
+    """
+    __slots__ = ('connection', 'owner', '_queue', '_transaction')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.owner = asyncio.current_task()
+        self._queue: Dict[str, List[tuple]] = {}
+        self._transaction = None
+
+    def execute(self, query: str, *args):
+        """Запись в очередь (без результата)"""
+        self._queue.setdefault(query, []).append(args)
+
+    async def flush(self, final: bool = False):
+        if not self._queue:
+            return
+        queue, self._queue = self._queue, {}
+        if self._transaction is None and not (final and len(queue) == 1):
+            await self._begin()
+        for query, batch in queue.items():
+            if len(batch) == 1:
+                await self.connection.execute(query, *batch[0])
+            else:
+                await self.connection.executemany(query, batch)
+
+    async def run(self, query: str, *args) -> str:
+        """Запись, результат которой нужен сразу (статус команды)"""
+        await self.flush()
+        await self._begin()
+        return await self.connection.execute(query, *args)
+
+    async def run_returning(self, query: str, *args):
+        """Запись с RETURNING: первая строка результата"""
+        await self.flush()
+        await self._begin()
+        return await self.connection.fetchrow(query, *args)
+
+    async def fetch(self, query: str, *args):
+        await self.flush()
+        return await self.connection.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args):
+        await self.flush()
+        return await self.connection.fetchrow(query, *args)
+
+    async def fetchval(self, query: str, *args):
+        await self.flush()
+        return await self.connection.fetchval(query, *args)
+
+    async def _begin(self):
+        if self._transaction is None:
+            self._transaction = self.connection.transaction()
+            await self._transaction.start()
+
+    async def _finish(self, failed: bool):
+        try:
+            if not failed:
+                await self.flush(final=True)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._queue.clear()
+            if self._transaction is not None:
+                if failed:
+                    await self._transaction.rollback()
+                else:
+                    await self._transaction.commit()
+
+
+class _Borrowed:
+    """Соединение текущей единицы работы для методов, вызванных внутри нее"""
+    __slots__ = ('uow',)
+
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+
+    async def __aenter__(self):
+        # Метод может писать напрямую: дальше все идет внутри транзакции
+        await self.uow.flush()
+        await self.uow._begin()
+        return self.uow.connection
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _Held:
+    """Соединение выполняемой задачи планировщика для методов, вызванных в ней"""
+    __slots__ = ('connection',)
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def __aenter__(self):
+        return self.connection
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar('current_uow', default=None)
+# Соединение задачи планировщика (job_lock): на нем держится ее advisory lock
+_job_connection: ContextVar = ContextVar('job_connection', default=None)
+
+
+class Database(Storage):
+    """Хранилище в Postgres (asyncpg)"""
+
     def __init__(self):
         self.pool = None
+        # Функции, вызываемые для каждого нового соединения пула (например, логгер запросов)
+        self.connection_hooks = []
+        # PID серверных процессов соединений пула: свои уведомления об изменениях
+        # шина инвалидации пропускает
+        self.server_pids = set()
+        # Расширение pg_trgm доступно: похожие роли ищутся по индексу
+        self.has_trgm = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self.pool is not None
+
+    async def ping(self, timeout: float) -> bool:
+        """Проверка базы запросом SELECT 1 (ожидание соединения из пула
+        входит в timeout)"""
+        if self.pool is None:
+            return False
+        try:
+            return await asyncio.wait_for(self.pool.fetchval("SELECT 1"), timeout) == 1
+        except Exception as e:
+            logging.warning(f"База данных не отвечает: {e!r}")
+            return False
+
+    async def _init_connection(self, conn):
+        pid = conn.get_server_pid()
+        self.server_pids.add(pid)
+        conn.add_termination_listener(lambda _: self.server_pids.discard(pid))
+        for hook in self.connection_hooks:
+            hook(conn)
 
     async def connect(self):
         """Подключение к базе данных"""
@@ -22,6 +213,7 @@ class Database:
                 min_size=1, 
                 max_size=10,
                 command_timeout=30,
+                init=self._init_connection,
                 server_settings={
                     'application_name': 'telegram_bot',
                 }
@@ -53,24 +245,30 @@ class Database:
     async def create_tables(self):
         """Создание необходимых таблиц"""
         async with self.pool.acquire() as conn:
-            # Таблица для эмодзи пользователей
+            # Таблица для эмодзи пользователей (свои в каждом сообществе)
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS user_emojis (
-                    user_id BIGINT PRIMARY KEY,
+                    group_id BIGINT NOT NULL,
+                    user_id BIGINT NOT NULL,
                     emoji TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (group_id, user_id)
                 );
+                ALTER TABLE user_emojis ADD COLUMN IF NOT EXISTS group_id BIGINT;
             """)
 
-            # Таблица для данных пользователей (роли, титулы)
+            # Таблица для данных пользователей (роли, титулы) в сообществах
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS user_data (
-                    user_id BIGINT PRIMARY KEY,
+                    group_id BIGINT NOT NULL,
+                    user_id BIGINT NOT NULL,
                     role TEXT,
                     custom_title TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (group_id, user_id)
                 );
+                ALTER TABLE user_data ADD COLUMN IF NOT EXISTS group_id BIGINT;
             """)
 
             # Таблица для активных викторин
@@ -98,14 +296,33 @@ class Database:
                 );
             """)
 
-            # Таблица для истории пребывания в группе
+            # Таблица интервалов пребывания в группе (joined_at IS NULL - вход не зафиксирован)
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_group_history (
-                    user_id BIGINT,
-                    join_time TIMESTAMP NOT NULL,
-                    leave_time TIMESTAMP,
-                    PRIMARY KEY (user_id, join_time)
+                CREATE TABLE IF NOT EXISTS user_membership (
+                    id BIGSERIAL PRIMARY KEY,
+                    group_id BIGINT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    joined_at TIMESTAMP,
+                    left_at TIMESTAMP
                 );
+                ALTER TABLE user_membership ADD COLUMN IF NOT EXISTS group_id BIGINT;
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_membership_user
+                ON user_membership (user_id, joined_at);
+            """)
+            # Не больше одного открытого интервала на пользователя в сообществе
+            await conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_user_membership_group_open
+                ON user_membership (group_id, user_id) WHERE left_at IS NULL;
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_membership_joined
+                ON user_membership (joined_at);
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_user_membership_left
+                ON user_membership (left_at);
             """)
 
             # Таблица для активных заявок
@@ -116,15 +333,7 @@ class Database:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     expires_at TIMESTAMP DEFAULT (CURRENT_TIMESTAMP + INTERVAL '5 days')
                 );
-            """)
-
-            # Таблица для истории входов/выходов пользователей
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS user_join_history (
-                    user_id BIGINT,
-                    joined_at TIMESTAMP,
-                    left_at TIMESTAMP
-                );
+                ALTER TABLE active_applications ADD COLUMN IF NOT EXISTS group_id BIGINT;
             """)
 
             # Таблица для ожидающих заявок
@@ -134,6 +343,15 @@ class Database:
                     role TEXT,
                     submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
+                -- Очередь ожидания места в группе: заявки, поданные в заполненную группу
+                ALTER TABLE pending_applications ADD COLUMN IF NOT EXISTS waitlisted_at TIMESTAMP;
+                -- Сообщество, в которое подана заявка (и очередь которого она ждет)
+                ALTER TABLE pending_applications ADD COLUMN IF NOT EXISTS group_id BIGINT;
+                DROP INDEX IF EXISTS idx_pending_applications_queue;
+                DROP INDEX IF EXISTS idx_pending_applications_waitlist;
+                CREATE INDEX IF NOT EXISTS idx_pending_applications_group_waitlist
+                ON pending_applications (group_id, waitlisted_at, user_id)
+                WHERE waitlisted_at IS NOT NULL;
             """)
 
             # Таблица для сессий игры Жених
@@ -144,6 +362,11 @@ class Database:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     started BOOLEAN DEFAULT FALSE
                 );
+                ALTER TABLE bride_game_sessions ADD COLUMN IF NOT EXISTS group_id BIGINT;
+                ALTER TABLE bride_game_sessions
+                    ADD COLUMN IF NOT EXISTS participant_count INT NOT NULL DEFAULT 0;
+                -- Порядок вступления в набор (номер участника сессии)
+                CREATE SEQUENCE IF NOT EXISTS bride_join_seq;
             """)
 
             # Таблица для участников сессий игры Жених
@@ -157,6 +380,14 @@ class Database:
                     PRIMARY KEY (session_id, user_id)
                 );
             """)
+            # Счетчик для наборов, открытых до его появления
+            await conn.execute("""
+                UPDATE bride_game_sessions s SET participant_count = p.count
+                FROM (SELECT session_id, count(*) AS count
+                      FROM bride_game_participants GROUP BY session_id) p
+                WHERE s.session_id = p.session_id
+                  AND s.participant_count = 0 AND NOT s.started
+            """)
 
             # Таблица для игр "Жених"
             await conn.execute("""
@@ -258,6 +489,49 @@ class Database:
                 );
             """)
 
+            # Таблица снимков статусов ответов участников
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS bride_participant_status (
+                    round_id BIGINT,
+                    user_id BIGINT,
+                    has_answered BOOLEAN DEFAULT FALSE,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (round_id, user_id)
+                );
+            """)
+
+            # Время завершения игры (для политики хранения истории)
+            await conn.execute("""
+                ALTER TABLE bride_games ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP
+            """)
+
+            # Индексы горячих запросов игры "Жених"
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_bride_games_active
+                ON bride_games (group_id, created_at DESC)
+                WHERE status IN ('waiting', 'started')
+            """)
+            await conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_bride_rounds_game
+                ON bride_rounds (game_id, round_number)
+            """)
+
+            # Архив завершенных игр "Жених" (компактная запись на игру)
+            partitioned = os.environ.get('RETENTION_PARTITIONED', '').lower() in ('1', 'true', 'yes')
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS bride_games_archive (
+                    game_id BIGINT NOT NULL,
+                    group_id BIGINT NOT NULL,
+                    creator_id BIGINT NOT NULL,
+                    bride_id BIGINT,
+                    created_at TIMESTAMP NOT NULL,
+                    finished_at TIMESTAMP NOT NULL,
+                    participants JSONB NOT NULL,
+                    rounds JSONB NOT NULL,
+                    PRIMARY KEY (game_id, finished_at)
+                ){' PARTITION BY RANGE (finished_at)' if partitioned else ''};
+            """)
+
             # Обновляем существующие таблицы для совместимости
             try:
                 await conn.execute("ALTER TABLE active_quizzes ALTER COLUMN quiz_id TYPE BIGINT")
@@ -271,97 +545,512 @@ class Database:
                 # Игнорируем ошибки если типы уже правильные
                 pass
 
+            # Дневные агрегаты статистики сообществ (обновляются инкрементально)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS stats_daily (
+                    group_id BIGINT NOT NULL,
+                    day DATE NOT NULL,
+                    metric TEXT NOT NULL,
+                    key TEXT NOT NULL DEFAULT '',
+                    value BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (group_id, day, metric, key)
+                );
+                ALTER TABLE stats_daily ADD COLUMN IF NOT EXISTS group_id BIGINT;
+            """)
+
+            # Индекс уведомлений админам: сообщение у админа -> пользователь
+            await conn.execute("""
+                CREATE SEQUENCE IF NOT EXISTS admin_notice_seq;
+                CREATE TABLE IF NOT EXISTS admin_notice_messages (
+                    admin_chat_id BIGINT NOT NULL,
+                    message_id BIGINT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    kind TEXT NOT NULL,
+                    notice_id BIGINT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (admin_chat_id, message_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_admin_notice_messages_notice
+                ON admin_notice_messages (notice_id);
+                ALTER TABLE admin_notice_messages ADD COLUMN IF NOT EXISTS edit_mode TEXT;
+                -- NULL: уведомление не записано, копии индексируются только для ответов
+                ALTER TABLE admin_notice_messages ALTER COLUMN notice_id DROP NOT NULL;
+            """)
+
+            # Уведомления админам (общая запись для всех копий)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS admin_notices (
+                    notice_id BIGINT PRIMARY KEY DEFAULT nextval('admin_notice_seq'),
+                    user_id BIGINT NOT NULL,
+                    kind TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    status TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            # Сообщества, которые обслуживает бот
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS groups (
+                    group_id BIGINT PRIMARY KEY,
+                    group_link TEXT NOT NULL,
+                    admin_ids BIGINT[] NOT NULL DEFAULT '{}',
+                    list_admin_ids BIGINT[] NOT NULL DEFAULT '{}',
+                    title TEXT,
+                    active BOOLEAN NOT NULL DEFAULT TRUE,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            # Очередь апдейтов между приемом и воркерами и состояния FSM воркеров
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS updates_queue (
+                    update_id BIGINT PRIMARY KEY,
+                    partition_key BIGINT NOT NULL,
+                    payload TEXT NOT NULL,
+                    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    claimed_by TEXT,
+                    claimed_at TIMESTAMP,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_updates_queue_partition
+                ON updates_queue (partition_key, update_id);
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            # Последний успешный запуск задач планировщика (общий для экземпляров)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_runs (
+                    name TEXT PRIMARY KEY,
+                    last_run_at TIMESTAMPTZ NOT NULL
+                );
+            """)
+
+            # Реестр ролей сообществ: role_key - роль без учета регистра и пробелов
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS roles (
+                    role_id BIGSERIAL PRIMARY KEY,
+                    group_id BIGINT NOT NULL,
+                    role_key TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    user_id BIGINT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                ALTER TABLE roles ADD COLUMN IF NOT EXISTS group_id BIGINT;
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_roles_group_key ON roles (group_id, role_key);
+                DROP INDEX IF EXISTS idx_roles_user;
+                CREATE INDEX IF NOT EXISTS idx_roles_group_user ON roles (group_id, user_id)
+                WHERE user_id IS NOT NULL;
+            """)
+            try:
+                await conn.execute("""
+                    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                    CREATE INDEX IF NOT EXISTS idx_roles_key_trgm
+                    ON roles USING gin (role_key gin_trgm_ops);
+                """)
+                self.has_trgm = True
+            except asyncpg.PostgresError as e:
+                logging.warning(f"pg_trgm недоступен, похожие роли ищутся без индекса: {e}")
+
+            # Уведомления об изменениях кэшируемых таблиц (см. invalidation.py).
+            # Номер из sequence позволяет оценить, сколько уведомлений пропущено
+            await conn.execute(f"""
+                CREATE SEQUENCE IF NOT EXISTS cache_invalidation_seq;
+                CREATE OR REPLACE FUNCTION notify_cache_invalidation() RETURNS trigger AS $$
+                DECLARE
+                    row_data JSONB;
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        row_data := to_jsonb(OLD);
+                    ELSE
+                        row_data := to_jsonb(NEW);
+                    END IF;
+                    PERFORM pg_notify('{CACHE_CHANNEL}',
+                        nextval('cache_invalidation_seq') || ':' || TG_TABLE_NAME || ':'
+                        || COALESCE(row_data ->> TG_ARGV[0], ''));
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+            """)
+            for table, key_column in CACHE_TABLES.items():
+                await conn.execute(f"""
+                    DO $$
+                    BEGIN
+                        IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                                       WHERE tgname = '{table}_cache_notify') THEN
+                            CREATE TRIGGER {table}_cache_notify
+                            AFTER INSERT OR UPDATE OR DELETE ON {table}
+                            FOR EACH ROW EXECUTE FUNCTION notify_cache_invalidation('{key_column}');
+                        END IF;
+                    END;
+                    $$;
+                """)
+
+            # Разовые миграции данных
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            await self._migrate_group_keys(conn)
+            await self._migrate_membership_history(conn)
+
+            # Первое заполнение: роли участников, уже вступивших в группу
+            await conn.execute("""
+                INSERT INTO roles (group_id, role_key, role, user_id)
+                SELECT group_id, lower(regexp_replace(btrim(custom_title), '\\s+', ' ', 'g')),
+                       btrim(custom_title), user_id
+                FROM user_data
+                WHERE btrim(COALESCE(custom_title, '')) <> ''
+                  AND NOT EXISTS (SELECT 1 FROM roles)
+                ON CONFLICT (group_id, role_key) DO NOTHING
+            """)
+
             logging.info("Таблицы созданы успешно")
 
+    async def _bump_stat(self, conn, group_id: int, metric: str, key: str = '', delta: int = 1):
+        """Инкремент дневного агрегата статистики сообщества"""
+        await conn.execute(STATS_BUMP_SQL, group_id, metric, key or '', delta)
+
+    async def _migrate_group_keys(self, conn):
+        """Привязка участников, ролей и статистики к сообществу.
+
+        Строки, записанные до поддержки нескольких сообществ, относятся к
+        LEGACY_GROUP_ID (GROUP_ID из окружения).
+        """
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('group_keys'))")
+            applied = await conn.fetchval(
+                "SELECT 1 FROM schema_migrations WHERE name = 'group_keys'")
+            if applied:
+                return
+
+            for table in ('user_emojis', 'user_data', 'roles', 'stats_daily', 'user_membership',
+                          'active_applications', 'pending_applications'):
+                await conn.execute(
+                    f"UPDATE {table} SET group_id = $1 WHERE group_id IS NULL", LEGACY_GROUP_ID)
+            # Заявки без сообщества допустимы (сохранены до выбора группы)
+            for table in ('user_emojis', 'user_data', 'roles', 'stats_daily', 'user_membership'):
+                await conn.execute(f"ALTER TABLE {table} ALTER COLUMN group_id SET NOT NULL")
+            for table, columns in (('user_emojis', 'group_id, user_id'),
+                                   ('user_data', 'group_id, user_id'),
+                                   ('stats_daily', 'group_id, day, metric, key')):
+                await conn.execute(f"""
+                    ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey;
+                    ALTER TABLE {table} ADD PRIMARY KEY ({columns});
+                """)
+            await conn.execute("""
+                DROP INDEX IF EXISTS idx_roles_key;
+                DROP INDEX IF EXISTS idx_user_membership_open;
+            """)
+
+            await conn.execute("INSERT INTO schema_migrations (name) VALUES ('group_keys')")
+            logging.info(f"Участники, роли и статистика привязаны к сообществу {LEGACY_GROUP_ID}")
+
+    async def _migrate_membership_history(self, conn):
+        """Перенос user_group_history и user_join_history в user_membership"""
+        async with conn.transaction():
+            # Сериализуем миграцию между экземплярами бота
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('membership_timeline'))")
+            applied = await conn.fetchval(
+                "SELECT 1 FROM schema_migrations WHERE name = 'membership_timeline'")
+            if applied:
+                return
+
+            moved = 0
+            if await conn.fetchval("SELECT to_regclass('user_group_history') IS NOT NULL"):
+                # Закрытые интервалы переносим как есть
+                moved += _affected(await conn.execute("""
+                    INSERT INTO user_membership (group_id, user_id, joined_at, left_at)
+                    SELECT $1, user_id, join_time, leave_time FROM user_group_history
+                    WHERE leave_time IS NOT NULL
+                """, LEGACY_GROUP_ID))
+                # Из открытых - только последний вход пользователя
+                moved += _affected(await conn.execute("""
+                    INSERT INTO user_membership (group_id, user_id, joined_at)
+                    SELECT DISTINCT ON (user_id) $1, user_id, join_time FROM user_group_history
+                    WHERE leave_time IS NULL
+                    ORDER BY user_id, join_time DESC
+                    ON CONFLICT (group_id, user_id) WHERE left_at IS NULL DO NOTHING
+                """, LEGACY_GROUP_ID))
+                await conn.execute("DROP TABLE user_group_history")
+
+            if await conn.fetchval("SELECT to_regclass('user_join_history') IS NOT NULL"):
+                moved += _affected(await conn.execute("""
+                    INSERT INTO user_membership (group_id, user_id, joined_at, left_at)
+                    SELECT $1, user_id, joined_at, left_at FROM user_join_history
+                    WHERE left_at IS NOT NULL
+                """, LEGACY_GROUP_ID))
+                await conn.execute("DROP TABLE user_join_history")
+
+            await conn.execute(
+                "INSERT INTO schema_migrations (name) VALUES ('membership_timeline')")
+            logging.info(f"История участников перенесена в user_membership: {moved} записей")
+
     async def close(self):
         """Закрытие соединения с базой данных"""
         if self.pool:
             await self.pool.close()
 
+    async def connect_dedicated(self, purpose: str):
+        """Отдельное долгоживущее соединение вне пула (LISTEN, аренда лидера).
+
+        TCP keepalive на стороне сервера нужен, чтобы Postgres быстро закрыл
+        сессию пропавшего процесса и отпустил его блокировки.
+        """
+        return await asyncpg.connect(
+            os.environ['DATABASE_URL'],
+            server_settings={
+                'application_name': f'telegram_bot_{purpose}',
+                'tcp_keepalives_idle': '5',
+                'tcp_keepalives_interval': '1',
+                'tcp_keepalives_count': '3',
+            })
+
+    @asynccontextmanager
+    async def job_lock(self, namespace: int, key: int, name: str,
+                       min_interval: float, force: bool = False):
+        """Запуск периодической задачи на одном экземпляре бота (yield True/False).
+
+        Неблокирующий advisory lock не дает запускам наложиться, а job_runs -
+        повторить задачу в том же периоде на другом экземпляре: True, если с
+        последнего успешного запуска (record_job_run) прошло не меньше
+        min_interval секунд или force. Блокировка берется на соединении, через
+        которое внутри блока работают методы хранилища, вызванные задачей.
+        """
+        async with self.pool.acquire() as conn:
+            acquired = await conn.fetchval(
+                "SELECT pg_try_advisory_lock($1::INT, $2::INT)", namespace, key)
+            if not acquired:
+                yield False
+                return
+            try:
+                due = force or await conn.fetchval("""
+                    SELECT NOT EXISTS (
+                        SELECT 1 FROM job_runs
+                        WHERE name = $1
+                        AND last_run_at > now() - make_interval(secs => $2)
+                    )
+                """, name, float(min_interval))
+                token = _job_connection.set(conn)
+                try:
+                    yield due
+                finally:
+                    _job_connection.reset(token)
+            finally:
+                await conn.fetchval(
+                    "SELECT pg_advisory_unlock($1::INT, $2::INT)", namespace, key)
+
+    async def record_job_run(self, name: str):
+        """Отметка успешного запуска задачи (см. job_lock)"""
+        async with self._acquire() as conn:
+            await conn.execute("""
+                INSERT INTO job_runs (name, last_run_at) VALUES ($1, now())
+                ON CONFLICT (name) DO UPDATE SET last_run_at = EXCLUDED.last_run_at
+            """, name)
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Единица работы: изменения методов, вызванных внутри блока в этой же
+        задаче, идут одной транзакцией на одном соединении. Вложенный блок
+        присоединяется к внешнему. Задачи, запущенные внутри блока, работают
+        через пул и незафиксированных изменений не видят."""
+        current = _current_uow.get()
+        if current is not None and current.owner is asyncio.current_task():
+            yield current
+            return
+        async with self._connection() as conn:
+            uow = UnitOfWork(conn)
+            token = _current_uow.set(uow)
+            try:
+                try:
+                    yield uow
+                except BaseException:
+                    await uow._finish(failed=True)
+                    raise
+                await uow._finish(failed=False)
+            finally:
+                _current_uow.reset(token)
+
+    def _acquire(self):
+        """Соединение для запроса: текущей единицы работы или из пула"""
+        uow = _current_uow.get()
+        if uow is not None and uow.owner is asyncio.current_task():
+            return _Borrowed(uow)
+        return self._connection()
+
+    def _connection(self):
+        """Соединение выполняемой задачи планировщика или из пула"""
+        conn = _job_connection.get()
+        if conn is not None:
+            return _Held(conn)
+        return self.pool.acquire()
+
     # Методы для работы с эмодзи
-    async def save_emoji(self, user_id: int, emoji: str):
-        """Сохранение эмодзи пользователя"""
-        async with self.pool.acquire() as conn:
+    async def save_emoji(self, group_id: int, user_id: int, emoji: str):
+        """Сохранение эмодзи пользователя в сообществе"""
+        async with self._acquire() as conn:
             await conn.execute("""
-                INSERT INTO user_emojis (user_id, emoji)
-                VALUES ($1, $2)
-                ON CONFLICT (user_id) 
+                INSERT INTO user_emojis (group_id, user_id, emoji)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (group_id, user_id) 
                 DO UPDATE SET emoji = EXCLUDED.emoji;
-            """, user_id, emoji)
+            """, group_id, user_id, emoji)
 
-    async def get_emoji(self, user_id: int) -> Optional[str]:
-        """Получение эмодзи пользователя"""
-        async with self.pool.acquire() as conn:
+    async def get_emoji(self, group_id: int, user_id: int) -> Optional[str]:
+        """Получение эмодзи пользователя в сообществе"""
+        async with self._acquire() as conn:
             result = await conn.fetchval(
-                "SELECT emoji FROM user_emojis WHERE user_id = $1", 
-                user_id
+                "SELECT emoji FROM user_emojis WHERE group_id = $1 AND user_id = $2", 
+                group_id, user_id
             )
             return result
 
-    async def get_all_emojis(self) -> Dict[int, str]:
-        """Получение всех эмодзи"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT user_id, emoji FROM user_emojis")
-            return {row['user_id']: row['emoji'] for row in rows}
+    async def get_all_emojis(self, user_id: int = None) -> Dict[Tuple[int, int], str]:
+        """Эмодзи по (сообщество, пользователь): все или одного пользователя"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT group_id, user_id, emoji FROM user_emojis
+                WHERE $1::BIGINT IS NULL OR user_id = $1::BIGINT
+            """, user_id)
+            return {(row['group_id'], row['user_id']): row['emoji'] for row in rows}
 
-    async def remove_emoji(self, user_id: int):
-        """Удаление эмодзи пользователя"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("DELETE FROM user_emojis WHERE user_id = $1", user_id)
+    async def remove_emoji(self, group_id: int, user_id: int):
+        """Удаление эмодзи пользователя в сообществе"""
+        async with self._acquire() as conn:
+            await conn.execute(
+                "DELETE FROM user_emojis WHERE group_id = $1 AND user_id = $2", group_id, user_id)
 
-    async def get_used_emojis(self) -> List[str]:
-        """Получение списка уже используемых эмодзи"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT emoji FROM user_emojis")
+    async def get_used_emojis(self, group_id: int) -> List[str]:
+        """Получение списка эмодзи, уже используемых в сообществе"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT emoji FROM user_emojis WHERE group_id = $1", group_id)
             return [row['emoji'] for row in rows]
 
     # Методы для работы с данными пользователей
-    async def save_user_data(self, user_id: int, role: str = None, custom_title: str = None):
-        """Сохранение данных пользователя"""
-        async with self.pool.acquire() as conn:
+    async def save_user_data(self, group_id: int, user_id: int, role: str = None,
+                             custom_title: str = None):
+        """Сохранение данных пользователя в сообществе"""
+        async with self._acquire() as conn:
             await conn.execute("""
-                INSERT INTO user_data (user_id, role, custom_title, updated_at)
-                VALUES ($1, $2, $3, CURRENT_TIMESTAMP)
-                ON CONFLICT (user_id) 
+                INSERT INTO user_data (group_id, user_id, role, custom_title, updated_at)
+                VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+                ON CONFLICT (group_id, user_id) 
                 DO UPDATE SET 
                     role = COALESCE(EXCLUDED.role, user_data.role),
                     custom_title = COALESCE(EXCLUDED.custom_title, user_data.custom_title),
                     updated_at = CURRENT_TIMESTAMP;
-            """, user_id, role, custom_title)
+            """, group_id, user_id, role, custom_title)
 
-    async def get_user_data(self, user_id: int) -> Dict:
-        """Получение данных пользователя"""
-        async with self.pool.acquire() as conn:
+    async def get_user_data(self, group_id: int, user_id: int) -> Dict:
+        """Получение данных пользователя в сообществе"""
+        async with self._acquire() as conn:
             row = await conn.fetchrow(
-                "SELECT role, custom_title FROM user_data WHERE user_id = $1", 
-                user_id
+                "SELECT role, custom_title FROM user_data WHERE group_id = $1 AND user_id = $2", 
+                group_id, user_id
             )
             if row:
                 return {'role': row['role'], 'custom_title': row['custom_title']}
             return {}
 
-    async def get_all_user_data(self) -> Dict[int, Dict]:
-        """Получение всех данных пользователей"""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT user_id, role, custom_title FROM user_data")
+    async def get_all_user_data(self, user_id: int = None) -> Dict[Tuple[int, int], Dict]:
+        """Данные по (сообщество, пользователь): все или одного пользователя"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT group_id, user_id, role, custom_title FROM user_data
+                WHERE $1::BIGINT IS NULL OR user_id = $1::BIGINT
+            """, user_id)
             return {
-                row['user_id']: {
+                (row['group_id'], row['user_id']): {
                     'role': row['role'], 
                     'custom_title': row['custom_title']
                 } 
                 for row in rows
             }
 
-    async def remove_user_data(self, user_id: int):
-        """Удаление данных пользователя"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("DELETE FROM user_data WHERE user_id = $1", user_id)
+    async def remove_user_data(self, group_id: int, user_id: int):
+        """Удаление данных пользователя в сообществе"""
+        async with self._acquire() as conn:
+            await conn.execute(
+                "DELETE FROM user_data WHERE group_id = $1 AND user_id = $2", group_id, user_id)
+
+    # Реестр ролей
+    async def get_roles(self) -> List[Dict]:
+        """Все роли реестра всех сообществ (занятые и освободившиеся)"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT role_id, group_id, role_key, role, user_id FROM roles")
+            return [dict(row) for row in rows]
+
+    async def get_role(self, role_id: int) -> Optional[Dict]:
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT role_id, group_id, role_key, role, user_id FROM roles WHERE role_id = $1
+            """, role_id)
+            return dict(row) if row else None
+
+    async def take_role(self, group_id: int, role_key: str, role: str,
+                        user_id: int) -> Optional[Dict]:
+        """Занимает роль в сообществе за пользователем и освобождает его прежнюю
+        роль там же. None - роль уже занята другим пользователем"""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                WITH claimed AS (
+                    INSERT INTO roles (group_id, role_key, role, user_id)
+                    VALUES ($1, $2, $3, $4::BIGINT)
+                    ON CONFLICT (group_id, role_key) DO UPDATE
+                    SET role = EXCLUDED.role, user_id = EXCLUDED.user_id,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE roles.user_id IS NULL OR roles.user_id = EXCLUDED.user_id
+                    RETURNING role_id, group_id, role_key, role, user_id
+                ), released AS (
+                    UPDATE roles SET user_id = NULL, updated_at = CURRENT_TIMESTAMP
+                    WHERE group_id = $1 AND user_id = $4::BIGINT AND role_key <> $2
+                      AND EXISTS (SELECT 1 FROM claimed)
+                )
+                SELECT * FROM claimed
+            """, group_id, role_key, role, user_id)
+            return dict(row) if row else None
+
+    async def release_roles(self, group_id: int, user_id: int) -> List[Dict]:
+        """Освобождает роли пользователя в сообществе (возвращает освобожденные)"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                UPDATE roles SET user_id = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE group_id = $1 AND user_id = $2::BIGINT
+                RETURNING role_id, group_id, role_key, role, user_id
+            """, group_id, user_id)
+            return [dict(row) for row in rows]
+
+    async def find_similar_roles(self, group_id: int, role_key: str, limit: int) -> List[Dict]:
+        """Похожие роли сообщества по триграммам (порог - pg_trgm.similarity_threshold)"""
+        async with self._acquire() as conn:
+            if not self.has_trgm:
+                rows = await conn.fetch("""
+                    SELECT role_id, group_id, role_key, role, user_id FROM roles
+                    WHERE group_id = $1
+                """, group_id)
+                return similar_roles(role_key, [dict(row) for row in rows], limit)
+            rows = await conn.fetch("""
+                SELECT role_id, group_id, role_key, role, user_id,
+                       similarity(role_key, $2) AS similarity
+                FROM roles
+                WHERE group_id = $1 AND role_key % $2 AND role_key <> $2
+                ORDER BY similarity DESC
+                LIMIT $3
+            """, group_id, role_key, limit)
+            return [dict(row) for row in rows]
 
     # Методы для работы с викторинами
     async def save_quiz(self, quiz_id: int, chat_id: int, question: str, answers: List[str], 
                        correct_indices: List[int], creator_id: int):
         """Сохранение викторины"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 INSERT INTO active_quizzes (quiz_id, chat_id, question, answers, correct_indices, creator_id)
                 VALUES ($1::BIGINT, $2::BIGINT, $3, $4, $5, $6::BIGINT)
@@ -375,7 +1064,7 @@ class Database:
 
     async def get_quiz(self, quiz_id: int) -> Optional[Dict]:
         """Получение данных викторины"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow(
                 "SELECT * FROM active_quizzes WHERE quiz_id = $1", 
                 quiz_id
@@ -394,7 +1083,7 @@ class Database:
 
     async def get_all_active_quizzes(self) -> Dict[int, Dict]:
         """Получение всех активных викторин"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("SELECT * FROM active_quizzes WHERE active = TRUE")
             return {
                 row['quiz_id']: {
@@ -411,7 +1100,7 @@ class Database:
 
     async def deactivate_quiz(self, quiz_id: int):
         """Деактивация викторины"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute(
                 "UPDATE active_quizzes SET active = FALSE WHERE quiz_id = $1", 
                 quiz_id
@@ -419,63 +1108,118 @@ class Database:
 
     async def delete_quiz(self, quiz_id: int):
         """Полное удаление викторины"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("DELETE FROM quiz_participants WHERE quiz_id = $1", quiz_id)
-            await conn.execute("DELETE FROM active_quizzes WHERE quiz_id = $1", quiz_id)
+        async with self.unit_of_work() as uow:
+            uow.execute("DELETE FROM quiz_participants WHERE quiz_id = $1", quiz_id)
+            uow.execute("DELETE FROM active_quizzes WHERE quiz_id = $1", quiz_id)
 
     # Методы для работы с участниками викторин
     async def save_quiz_answer(self, quiz_id: int, user_id: int, answer_index: int):
         """Сохранение ответа участника викторины"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO quiz_participants (quiz_id, user_id, answer_index)
-                VALUES ($1::BIGINT, $2::BIGINT, $3)
-                ON CONFLICT (quiz_id, user_id) 
-                DO UPDATE SET answer_index = EXCLUDED.answer_index;
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                WITH answer AS (
+                    INSERT INTO quiz_participants (quiz_id, user_id, answer_index)
+                    VALUES ($1::BIGINT, $2::BIGINT, $3)
+                    ON CONFLICT (quiz_id, user_id) 
+                    DO UPDATE SET answer_index = EXCLUDED.answer_index
+                    RETURNING quiz_id, (xmax = 0) AS inserted
+                )
+                SELECT answer.inserted, q.chat_id
+                FROM answer LEFT JOIN active_quizzes q ON q.quiz_id = answer.quiz_id;
             """, quiz_id, user_id, answer_index)
+            # Считаем участие один раз, повторный выбор ответа не учитываем
+            if row['inserted'] and row['chat_id'] is not None:
+                await self._bump_stat(conn, row['chat_id'], 'quiz_answers')
 
     async def get_quiz_participants(self, quiz_id: int) -> Dict[int, int]:
         """Получение всех участников викторины и их ответов"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch(
                 "SELECT user_id, answer_index FROM quiz_participants WHERE quiz_id = $1", 
                 quiz_id
             )
             return {row['user_id']: row['answer_index'] for row in rows}
 
-    # Методы для работы с историей пользователей
-    async def record_user_join(self, user_id: int):
-        """Запись вступления пользователя"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO user_group_history (user_id, join_time)
-                VALUES ($1, CURRENT_TIMESTAMP)
-            """, user_id)
-
-    async def record_user_leave(self, user_id: int):
-        """Запись выхода пользователя"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                UPDATE user_group_history
-                SET leave_time = CURRENT_TIMESTAMP
-                WHERE user_id = $1 AND leave_time IS NULL
-            """, user_id)
+    # Методы для работы с историей пребывания в группе
+    async def record_user_join(self, group_id: int, user_id: int, joined_at: datetime = None):
+        """Запись вступления пользователя в сообщество (открывает интервал, если он еще не открыт)"""
+        async with self._acquire() as conn:
+            status = await conn.execute("""
+                INSERT INTO user_membership (group_id, user_id, joined_at)
+                VALUES ($1, $2, COALESCE($3, CURRENT_TIMESTAMP))
+                ON CONFLICT (group_id, user_id) WHERE left_at IS NULL DO NOTHING
+            """, group_id, user_id, joined_at)
+            if _affected(status):
+                await self._bump_stat(conn, group_id, 'joins')
+
+    async def record_user_leave(self, group_id: int, user_id: int, left_at: datetime = None):
+        """Запись выхода пользователя из сообщества (закрывает открытый интервал)"""
+        async with self._acquire() as conn:
+            status = await conn.execute("""
+                UPDATE user_membership
+                SET left_at = COALESCE($3, CURRENT_TIMESTAMP)
+                WHERE group_id = $1 AND user_id = $2 AND left_at IS NULL
+            """, group_id, user_id, left_at)
+            if not _affected(status):
+                # Вход пользователя не был зафиксирован (например, до запуска бота)
+                await conn.execute("""
+                    INSERT INTO user_membership (group_id, user_id, joined_at, left_at)
+                    VALUES ($1, $2, NULL, COALESCE($3, CURRENT_TIMESTAMP))
+                """, group_id, user_id, left_at)
+            await self._bump_stat(conn, group_id, 'leaves')
 
     async def get_user_history(self, user_id: int) -> List[Dict]:
         """Получение истории пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
-                SELECT join_time, leave_time
-                FROM user_group_history
+                SELECT joined_at, left_at
+                FROM user_membership
                 WHERE user_id = $1
-                ORDER BY join_time
+                ORDER BY joined_at NULLS FIRST
+            """, user_id)
+            return [dict(row) for row in rows]
+
+    async def get_user_join_periods(self, user_id: int) -> List[Tuple[str, str]]:
+        """Получение периодов пребывания пользователя в группе"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT joined_at, left_at FROM user_membership
+                WHERE user_id = $1 AND joined_at IS NOT NULL AND left_at IS NOT NULL
+                ORDER BY joined_at ASC
             """, user_id)
+            return [(r['joined_at'].strftime('%d.%m.%y'), r['left_at'].strftime('%d.%m.%y'))
+                    for r in rows]
+
+    async def get_members_at(self, moment: datetime) -> List[int]:
+        """Пользователи, состоявшие в группе в указанный момент"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT DISTINCT user_id FROM user_membership
+                WHERE joined_at <= $1 AND (left_at IS NULL OR left_at > $1)
+            """, moment)
+            return [row['user_id'] for row in rows]
+
+    async def get_membership_churn(self, start: datetime, end: datetime) -> List[Dict]:
+        """Количество входов и выходов по дням в интервале [start, end)"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT day, SUM(joins)::INT AS joins, SUM(leaves)::INT AS leaves
+                FROM (
+                    SELECT joined_at::DATE AS day, 1 AS joins, 0 AS leaves
+                    FROM user_membership WHERE joined_at >= $1 AND joined_at < $2
+                    UNION ALL
+                    SELECT left_at::DATE, 0, 1
+                    FROM user_membership WHERE left_at >= $1 AND left_at < $2
+                ) events
+                GROUP BY day
+                ORDER BY day
+            """, start, end)
             return [dict(row) for row in rows]
 
     # Методы для работы с игрой "Жених"
     async def create_bride_game(self, group_id: int, creator_id: int) -> int:
         """Создание новой игры Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             game_id = await conn.fetchval("""
                 INSERT INTO bride_games (group_id, creator_id, status)
                 VALUES ($1::BIGINT, $2::BIGINT, 'waiting')
@@ -485,7 +1229,7 @@ class Database:
 
     async def join_bride_game(self, game_id: int, user_id: int) -> bool:
         """Присоединение к игре Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             try:
                 await conn.execute("""
                     INSERT INTO bride_participants (game_id, user_id)
@@ -497,7 +1241,7 @@ class Database:
 
     async def get_bride_game(self, game_id: int) -> Optional[Dict]:
         """Получение данных игры Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM bride_games WHERE game_id = $1
             """, game_id)
@@ -508,7 +1252,7 @@ class Database:
         if not self.pool:
             logging.error("Нет подключения к базе данных")
             return None
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM bride_games 
                 WHERE group_id = $1 AND status IN ('waiting', 'started')
@@ -518,15 +1262,15 @@ class Database:
 
     async def add_bride_game_participant(self, game_id: int, user_id: int, number: int = None, is_bride: bool = False):
         """Добавление участника в игру Жених"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
+        async with self.unit_of_work() as uow:
+            uow.execute("""
                 INSERT INTO bride_participants (game_id, user_id, number, is_bride)
                 VALUES ($1::BIGINT, $2::BIGINT, $3, $4)
             """, game_id, user_id, number, is_bride)
 
             # Увеличиваем счетчик игр для всех участников (кроме жениха)
             if not is_bride:
-                await conn.execute("""
+                uow.execute("""
                     INSERT INTO bride_history (user_id, was_bride_count, games_since_bride)
                     VALUES ($1::BIGINT, 0, 1)
                     ON CONFLICT (user_id)
@@ -535,7 +1279,7 @@ class Database:
 
     async def get_bride_rounds(self, game_id: int) -> List[Dict]:
         """Получение всех раундов игры"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
                 SELECT * FROM bride_rounds 
                 WHERE game_id = $1
@@ -545,7 +1289,7 @@ class Database:
 
     async def get_bride_participants(self, game_id: int) -> List[Dict]:
         """Получение участников игры Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
                 SELECT * FROM bride_participants 
                 WHERE game_id = $1
@@ -555,14 +1299,19 @@ class Database:
 
     async def start_bride_game(self, game_id: int, bride_id: int):
         """Запуск игры Жених"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                UPDATE bride_games 
+        async with self.unit_of_work() as uow:
+            # Счетчик - только при переходе из набора, повторный запуск не считается
+            old = await uow.run_returning("""
+                UPDATE bride_games g
                 SET status = 'started', bride_id = $2::BIGINT
-                WHERE game_id = $1
+                FROM (SELECT status FROM bride_games WHERE game_id = $1 FOR UPDATE) AS old
+                WHERE g.game_id = $1
+                RETURNING old.status, g.group_id
             """, game_id, bride_id)
+            if old and old['status'] == 'waiting':
+                uow.execute(STATS_BUMP_SQL, old['group_id'], 'bride_games_started', '', 1)
 
-            await conn.execute("""
+            uow.execute("""
                 UPDATE bride_participants 
                 SET is_bride = TRUE
                 WHERE game_id = $1 AND user_id = $2::BIGINT
@@ -570,7 +1319,7 @@ class Database:
 
     async def create_bride_round(self, game_id: int, round_number: int, question: str) -> int:
         """Создание раунда игры Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             round_id = await conn.fetchval("""
                 INSERT INTO bride_rounds (game_id, round_number, question)
                 VALUES ($1::BIGINT, $2, $3)
@@ -580,7 +1329,7 @@ class Database:
 
     async def save_bride_answer(self, round_id: int, user_id: int, answer: str):
         """Сохранение ответа в игре Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 INSERT INTO bride_answers (round_id, user_id, answer)
                 VALUES ($1::BIGINT, $2::BIGINT, $3)
@@ -590,7 +1339,7 @@ class Database:
 
     async def get_bride_answers(self, round_id: int) -> List[Dict]:
         """Получение ответов раунда"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
                 SELECT ba.*, bp.number
                 FROM bride_answers ba
@@ -602,17 +1351,17 @@ class Database:
 
     async def vote_out_participant(self, game_id: int, user_id: int, round_id: int):
         """Исключение участника из игры"""
-        async with self.pool.acquire() as conn:
+        async with self.unit_of_work() as uow:
             # Преобразуем user_id в int, если он передается как строка
             user_id = int(user_id) if isinstance(user_id, str) else user_id
 
-            await conn.execute("""
+            uow.execute("""
                 UPDATE bride_participants 
                 SET is_out = TRUE
                 WHERE game_id = $1::BIGINT AND user_id = $2::BIGINT
             """, game_id, user_id)
 
-            await conn.execute("""
+            uow.execute("""
                 UPDATE bride_rounds 
                 SET voted_out = $2::BIGINT
                 WHERE round_id = $1::BIGINT
@@ -620,16 +1369,20 @@ class Database:
 
     async def finish_bride_game(self, game_id: int):
         """Завершение игры Жених"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                UPDATE bride_games 
-                SET status = 'finished'
-                WHERE game_id = $1
+        async with self.unit_of_work() as uow:
+            old = await uow.run_returning("""
+                UPDATE bride_games g
+                SET status = 'finished', finished_at = CURRENT_TIMESTAMP
+                FROM (SELECT status FROM bride_games WHERE game_id = $1 FOR UPDATE) AS old
+                WHERE g.game_id = $1
+                RETURNING old.status, g.group_id
             """, game_id)
+            if old is not None and old['status'] != 'finished':
+                uow.execute(STATS_BUMP_SQL, old['group_id'], 'bride_games_finished', '', 1)
 
     async def get_current_bride_round(self, game_id: int) -> Optional[Dict]:
         """Получение текущего раунда игры"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM bride_rounds 
                 WHERE game_id = $1
@@ -637,89 +1390,140 @@ class Database:
             """, game_id)
             return dict(row) if row else None
 
-    # Методы для работы с историей входов/выходов
-    async def save_join_history(self, user_id: int, joined_at, left_at):
-        """Сохранение истории входов/выходов пользователя"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO user_join_history (user_id, joined_at, left_at)
-                VALUES ($1, $2, $3)
-            """, user_id, joined_at, left_at)
-
-    async def get_user_join_periods(self, user_id: int) -> List[Tuple[str, str]]:
-        """Получение периодов пребывания пользователя в группе"""
-        async with self.pool.acquire() as conn:
+    async def get_recent_bride_questions(self, limit: int = 500) -> List[str]:
+        """Последние вопросы женихов (для отсева повторов в подсказках)"""
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
-                SELECT joined_at, left_at FROM user_join_history
-                WHERE user_id = $1
-                ORDER BY joined_at ASC
-            """, user_id)
-            result = []
-            for r in rows:
-                if r['joined_at'] and r['left_at']:
-                    start = r['joined_at'].strftime('%d.%m.%y')
-                    end = r['left_at'].strftime('%d.%m.%y')
-                    result.append((start, end))
-            return result
+                SELECT question FROM bride_rounds
+                WHERE question IS NOT NULL
+                ORDER BY round_id DESC LIMIT $1
+            """, limit)
+            return [row['question'] for row in rows]
 
     # Методы для работы с ожидающими заявками
-    async def save_pending_application(self, user_id: int, role: str):
-        """Сохранение ожидающей заявки"""
-        async with self.pool.acquire() as conn:
+    async def save_pending_application(self, user_id: int, role: str, group_id: int):
+        """Сохранение ожидающей заявки в сообщество (заявка в другое сообщество
+        выводит пользователя из очереди ожидания прежнего)"""
+        async with self._acquire() as conn:
             await conn.execute("""
-                INSERT INTO pending_applications (user_id, role)
-                VALUES ($1, $2)
-                ON CONFLICT (user_id) DO UPDATE SET role = EXCLUDED.role, submitted_at = CURRENT_TIMESTAMP
-            """, user_id, role)
+                INSERT INTO pending_applications (user_id, role, group_id)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE
+                SET role = EXCLUDED.role, submitted_at = CURRENT_TIMESTAMP,
+                    waitlisted_at = CASE
+                        WHEN pending_applications.group_id = EXCLUDED.group_id
+                        THEN pending_applications.waitlisted_at
+                    END,
+                    group_id = EXCLUDED.group_id
+            """, user_id, role, group_id)
+            await self._bump_stat(conn, group_id, 'applications', role)
+
+    async def delete_old_applications(self) -> int:
+        """Удаление старых заявок (старше 5 дней, в очереди ожидания - старше 30)"""
+        async with self._acquire() as conn:
+            status = await conn.execute("""
+                DELETE FROM pending_applications
+                WHERE (waitlisted_at IS NULL AND submitted_at < NOW() - INTERVAL '5 days')
+                   OR waitlisted_at < NOW() - INTERVAL '30 days'
+            """)
+            return _affected(status)
 
-    async def delete_old_applications(self):
-        """Удаление старых заявок (старше 5 дней)"""
-        async with self.pool.acquire() as conn:
+    async def join_waitlist(self, user_id: int, role: str, group_id: int):
+        """Постановка заявки в очередь ожидания группы (повторная постановка в
+        ту же группу не меняет место в очереди)"""
+        async with self._acquire() as conn:
             await conn.execute("""
-                DELETE FROM pending_applications WHERE submitted_at < NOW() - INTERVAL '5 days'
-            """)
+                INSERT INTO pending_applications (user_id, role, waitlisted_at, group_id)
+                VALUES ($1, $2, CURRENT_TIMESTAMP, $3)
+                ON CONFLICT (user_id) DO UPDATE
+                SET role = EXCLUDED.role,
+                    waitlisted_at = CASE
+                        WHEN pending_applications.group_id = EXCLUDED.group_id
+                        THEN COALESCE(pending_applications.waitlisted_at, EXCLUDED.waitlisted_at)
+                        ELSE EXCLUDED.waitlisted_at
+                    END,
+                    group_id = EXCLUDED.group_id
+            """, user_id, role, group_id)
+
+    async def leave_waitlist(self, user_id: int, group_id: int):
+        async with self._acquire() as conn:
+            await conn.execute("""
+                UPDATE pending_applications SET waitlisted_at = NULL
+                WHERE user_id = $1 AND group_id = $2 AND waitlisted_at IS NOT NULL
+            """, user_id, group_id)
+
+    async def pop_waitlist(self, group_id: int) -> Optional[Dict]:
+        """Извлечение самой ранней заявки из очереди ожидания группы (сама заявка остается)"""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                UPDATE pending_applications SET waitlisted_at = NULL
+                WHERE user_id = (
+                    SELECT user_id FROM pending_applications
+                    WHERE group_id = $1 AND waitlisted_at IS NOT NULL
+                    ORDER BY waitlisted_at, user_id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING user_id, role, submitted_at
+            """, group_id)
+            return dict(row) if row else None
 
     async def get_application_role(self, user_id: int) -> Optional[str]:
         """Получение роли из ожидающей заявки"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetchval("SELECT role FROM pending_applications WHERE user_id = $1", user_id)
 
-    async def update_user_role(self, user_id: int, new_role: str):
-        """Обновление роли пользователя"""
-        async with self.pool.acquire() as conn:
+    async def update_user_role(self, group_id: int, user_id: int, new_role: str):
+        """Обновление роли пользователя в сообществе"""
+        async with self._acquire() as conn:
             await conn.execute("""
-                UPDATE user_data SET role = $2, updated_at = CURRENT_TIMESTAMP
-                WHERE user_id = $1
-            """, user_id, new_role)
+                UPDATE user_data SET role = $3, updated_at = CURRENT_TIMESTAMP
+                WHERE group_id = $1 AND user_id = $2
+            """, group_id, user_id, new_role)
 
     # Методы для работы с сессиями игры Жених
-    async def create_bride_session(self, creator_id: int) -> int:
+    async def create_bride_session(self, creator_id: int, group_id: int) -> int:
         """Создание новой сессии игры Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetchval("""
-                INSERT INTO bride_game_sessions (creator_id) VALUES ($1) RETURNING session_id
-            """, creator_id)
-
-    async def add_bride_participant(self, session_id: int, user_id: int, number: int, is_bride: bool = False):
-        """Добавление участника в сессию игры Жених"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
-                INSERT INTO bride_game_participants (session_id, user_id, user_number, is_bride)
-                VALUES ($1, $2::BIGINT, $3, $4)
-            """, session_id, user_id, number, is_bride)
+                INSERT INTO bride_game_sessions (creator_id, group_id) VALUES ($1, $2)
+                RETURNING session_id
+            """, creator_id, group_id)
+
+    async def join_bride_session(self, session_id: int, user_id: int) -> Optional[int]:
+        """Вступление в набор одним запросом: число участников после вступления
+        или None, если пользователь уже в наборе или набор закрыт"""
+        async with self._acquire() as conn:
+            # Номер берется из sequence, а счетчик сессии обновляется в том же
+            # запросе: одновременные нажатия не получают одинаковых номеров
+            return await conn.fetchval("""
+                WITH joined AS (
+                    INSERT INTO bride_game_participants (session_id, user_id, user_number)
+                    SELECT session_id, $2::BIGINT, nextval('bride_join_seq')
+                    FROM bride_game_sessions
+                    WHERE session_id = $1 AND started = FALSE
+                    ON CONFLICT (session_id, user_id) DO NOTHING
+                    RETURNING session_id
+                )
+                UPDATE bride_game_sessions s
+                SET participant_count = s.participant_count + 1
+                FROM joined WHERE s.session_id = joined.session_id
+                RETURNING s.participant_count
+            """, session_id, user_id)
 
     async def get_bride_session_participants(self, session_id: int) -> List[Dict]:
         """Получение участников сессии игры Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
                 SELECT user_id, user_number, eliminated, is_bride
                 FROM bride_game_participants WHERE session_id = $1
+                ORDER BY user_number
             """, session_id)
             return [dict(row) for row in rows]
 
     async def eliminate_bride_participant(self, session_id: int, user_number: int):
         """Исключение участника из игры Жених"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 UPDATE bride_game_participants
                 SET eliminated = TRUE
@@ -728,14 +1532,14 @@ class Database:
 
     async def delete_bride_session(self, session_id: int):
         """Удаление сессии игры Жених"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("DELETE FROM bride_game_participants WHERE session_id = $1", session_id)
-            await conn.execute("DELETE FROM bride_game_sessions WHERE session_id = $1", session_id)
+        async with self.unit_of_work() as uow:
+            uow.execute("DELETE FROM bride_game_participants WHERE session_id = $1", session_id)
+            uow.execute("DELETE FROM bride_game_sessions WHERE session_id = $1", session_id)
 
     async def start_bride_session(self, session_id: int):
         """Запускает сессию игры жених"""
         try:
-            async with self.pool.acquire() as conn:
+            async with self._acquire() as conn:
                 await conn.execute("""
                     UPDATE bride_game_sessions 
                     SET started = TRUE
@@ -745,28 +1549,35 @@ class Database:
         except Exception as e:
             logging.error(f"Ошибка при запуске сессии {session_id}: {e}")
             raise
-    async def get_active_bride_session(self) -> Optional[Dict]:
-        """Получение активной сессии игры Жених"""
-        async with self.pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT * FROM bride_game_sessions WHERE started = FALSE LIMIT 1")
+    async def get_active_bride_session(self, group_id: int) -> Optional[Dict]:
+        """Получение активной сессии игры Жених в группе"""
+        async with self._acquire() as conn:
+            # group_id IS NULL - сессии, начатые до появления нескольких сообществ
+            row = await conn.fetchrow("""
+                SELECT * FROM bride_game_sessions
+                WHERE started = FALSE AND (group_id = $1 OR group_id IS NULL)
+                LIMIT 1
+            """, group_id)
             return dict(row) if row else None
 
     # Методы для работы с заявками
-    async def save_application(self, user_id: int, role: str):
-        """Сохранение заявки пользователя"""
-        async with self.pool.acquire() as conn:
+    async def save_application(self, user_id: int, role: str, group_id: int):
+        """Сохранение заявки пользователя в сообщество"""
+        async with self._acquire() as conn:
             await conn.execute("""
-                INSERT INTO active_applications (user_id, role)
-                VALUES ($1::BIGINT, $2)
+                INSERT INTO active_applications (user_id, role, group_id)
+                VALUES ($1::BIGINT, $2, $3)
                 ON CONFLICT (user_id) 
                 DO UPDATE SET role = EXCLUDED.role, 
+                             group_id = EXCLUDED.group_id,
                              created_at = CURRENT_TIMESTAMP,
                              expires_at = CURRENT_TIMESTAMP + INTERVAL '5 days'
-            """, user_id, role)
+            """, user_id, role, group_id)
+            await self._bump_stat(conn, group_id, 'applications', role)
 
     async def get_application(self, user_id: int) -> Optional[Dict]:
         """Получение заявки пользователя"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM active_applications 
                 WHERE user_id = $1::BIGINT AND expires_at > CURRENT_TIMESTAMP
@@ -775,7 +1586,7 @@ class Database:
 
     async def update_application_role(self, user_id: int, new_role: str):
         """Обновление роли в заявке"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 UPDATE active_applications 
                 SET role = $2
@@ -784,21 +1595,57 @@ class Database:
 
     async def delete_application(self, user_id: int):
         """Удаление заявки"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 DELETE FROM active_applications WHERE user_id = $1::BIGINT
             """, user_id)
 
-    async def cleanup_expired_applications(self):
+    async def cleanup_expired_applications(self) -> int:
         """Очистка истекших заявок"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
+        async with self._acquire() as conn:
+            status = await conn.execute("""
                 DELETE FROM active_applications 
                 WHERE expires_at <= CURRENT_TIMESTAMP            """)
+            return _affected(status)
+
+    async def cleanup_finished_game_state(self) -> Dict[str, int]:
+        """Очистка служебных записей раундов завершенных (или удаленных) игр"""
+        async with self._acquire() as conn:
+            participant_status = await conn.execute("""
+                DELETE FROM bride_participant_status ps
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM bride_rounds br
+                    JOIN bride_games bg ON bg.game_id = br.game_id
+                    WHERE br.round_id = ps.round_id
+                      AND bg.status IN ('waiting', 'started')
+                )
+            """)
+            round_status = await conn.execute("""
+                DELETE FROM bride_round_status rs
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM bride_rounds br
+                    JOIN bride_games bg ON bg.game_id = br.game_id
+                    WHERE br.round_id = rs.round_id
+                      AND bg.status IN ('waiting', 'started')
+                )
+            """)
+            pinned = await conn.execute("""
+                DELETE FROM bride_pinned_messages pm
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM bride_games bg
+                    WHERE bg.game_id = pm.game_id
+                      AND bg.status IN ('waiting', 'started')
+                )
+            """)
+            return {
+                'bride_participant_status': _affected(participant_status),
+                'bride_round_status': _affected(round_status),
+                'bride_pinned_messages': _affected(pinned),
+            }
 
     async def save_application_internal(self, user_id: int, role: str):
         """Внутренний метод сохранения заявки"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 INSERT INTO active_applications (user_id, role)
                 VALUES ($1::BIGINT, $2)
@@ -810,7 +1657,7 @@ class Database:
 
     async def get_bride_history(self, user_id: int) -> Optional[Dict]:
         """Получение истории пользователя как жениха"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM bride_history WHERE user_id = $1::BIGINT
             """, user_id)
@@ -818,7 +1665,7 @@ class Database:
 
     async def update_bride_history(self, user_id: int):
         """Обновление информации о том, что пользователь был женихом"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             existing_history = await self.get_bride_history(user_id)
             if existing_history:
                 await conn.execute("""
@@ -834,47 +1681,10 @@ class Database:
                     VALUES ($1::BIGINT, 1, CURRENT_TIMESTAMP, 0)
                 """, user_id)
 
-    async def can_be_bride(self, user_id: int) -> bool:
-        """Проверка, может ли пользователь быть женихом"""
-        history = await self.get_bride_history(user_id)
-        if history:
-            # Получаем значения с проверкой на None
-            was_bride_count = history.get('was_bride_count', 0) or 0
-            games_since_bride = history.get('games_since_bride', 0) or 0
-            
-            # Если пользователь был женихом и прошло меньше 2 игр - не может быть женихом
-            if was_bride_count > 0 and games_since_bride < 2:
-                return False
-            # Если прошло 2 или больше игр - может быть женихом
-            return True
-        else:
-            # Пользователь еще не был женихом
-            return True
-
-    async def get_eligible_bride_candidates(self, participants_ids: list) -> list:
-        """Получение списка подходящих кандидатов в женихи (абсолютно случайно, но с учетом истории)"""
-        eligible = []
-        for user_id in participants_ids:
-            if await self.can_be_bride(user_id):
-                eligible.append(user_id)
-
-        # Если все уже были женихами недавно, сбрасываем счетчики и возвращаем всех
-        if not eligible:
-            # Сбрасываем счетчики для всех участников
-            for user_id in participants_ids:
-                await self.reset_bride_status(user_id)
-            eligible = participants_ids
-
-        return eligible
-
-    async def mark_as_bride(self, user_id: int):
-        """Отмечает пользователя как бывшего жениха"""
-        await self.update_bride_history(user_id)
-
     async def reset_bride_status(self, user_id: int):
         """Сбрасывает статус жениха для пользователя"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
+        async with self.unit_of_work() as uow:
+            uow.execute("""
                 UPDATE bride_history
                 SET was_bride_count = 0, games_since_bride = 0
                 WHERE user_id = $1::BIGINT
@@ -882,7 +1692,7 @@ class Database:
 
     async def save_pinned_message(self, game_id: int, round_id: int, message_id: int, message_type: str):
         """Сохранение информации о закрепленном сообщении"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 INSERT INTO bride_pinned_messages (game_id, round_id, message_id, message_type)
                 VALUES ($1::BIGINT, $2::BIGINT, $3::BIGINT, $4)
@@ -892,37 +1702,31 @@ class Database:
 
     async def get_pinned_message(self, round_id: int, message_type: str) -> int:
         """Получение ID закрепленного сообщения"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.fetchval("""
                 SELECT message_id FROM bride_pinned_messages
                 WHERE round_id = $1::BIGINT AND message_type = $2
             """, round_id, message_type)
 
-    async def unpin_all_game_messages(self, game_id: int):
-        """Открепление всех сообщений игры"""
-        async with self.pool.acquire() as conn:
-            message_ids = await conn.fetch("""
+    async def get_game_pinned_messages(self, game_id: int) -> List[int]:
+        """ID закрепленных сообщений игры"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
                 SELECT message_id FROM bride_pinned_messages
                 WHERE game_id = $1::BIGINT
             """, game_id)
+            return [row['message_id'] for row in rows]
 
-            # Импортируем bot из main.py для открепления
-            from main import bot, GROUP_ID
-
-            for row in message_ids:
-                try:
-                    await bot.unpin_chat_message(GROUP_ID, row['message_id'])
-                except Exception as e:
-                    logging.error(f"Ошибка открепления сообщения {row['message_id']}: {e}")
-
-            # Удаляем записи о закрепленных сообщениях
-            await conn.execute("""
+    async def delete_game_pinned_messages(self, game_id: int):
+        """Удаление записей о закрепленных сообщениях игры"""
+        async with self.unit_of_work() as uow:
+            uow.execute("""
                 DELETE FROM bride_pinned_messages WHERE game_id = $1::BIGINT
             """, game_id)
 
     async def save_round_status_message(self, round_id: int, creator_id: int, message_id: int):
         """Сохранение ID сообщения со статусом ответов"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
                 INSERT INTO bride_round_status (round_id, creator_id, message_id)
                 VALUES ($1::BIGINT, $2::BIGINT, $3::BIGINT)
@@ -932,7 +1736,7 @@ class Database:
 
     async def get_round_status_message(self, round_id: int) -> Optional[Dict]:
         """Получение информации о сообщении со статусом ответов"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
                 SELECT * FROM bride_round_status WHERE round_id = $1::BIGINT
             """, round_id)
@@ -940,14 +1744,14 @@ class Database:
 
     async def delete_round_status_message(self, round_id: int):
         """Удаление записи о сообщении со статусом ответов"""
-        async with self.pool.acquire() as conn:
-            await conn.execute("""
+        async with self.unit_of_work() as uow:
+            uow.execute("""
                 DELETE FROM bride_round_status WHERE round_id = $1::BIGINT
             """, round_id)
 
     async def get_participant_answer_status(self, round_id: int, user_id: int) -> bool:
         """Проверка, ответил ли участник в данном раунде"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             result = await conn.fetchval("""
                 SELECT EXISTS(SELECT 1 FROM bride_answers 
                               WHERE round_id = $1::BIGINT AND user_id = $2::BIGINT)
@@ -956,7 +1760,7 @@ class Database:
 
     async def get_all_participants_status(self, game_id: int, round_id: int) -> Dict[int, bool]:
         """Получение статуса ответов всех участников"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             # Получаем всех активных участников (не жениха и не выбывших)
             participants = await conn.fetch("""
                 SELECT user_id FROM bride_participants 
@@ -978,20 +1782,441 @@ class Database:
 
             return status_dict
 
-    async def save_participant_status_snapshot(self, round_id: int, participant_statuses: Dict[int, bool]):
-        """Сохранение снимка статусов участников для восстановления после перезапуска"""
-        async with self.pool.acquire() as conn:
-            # Создаем таблицу если её нет
+    # Сообщества
+    async def get_groups(self) -> List[Dict]:
+        """Все подключенные сообщества"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM groups WHERE active = TRUE")
+            return [dict(row) for row in rows]
+
+    async def get_group(self, group_id: int) -> Optional[Dict]:
+        """Настройки подключенного сообщества или None"""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT * FROM groups WHERE group_id = $1 AND active = TRUE", group_id)
+            return dict(row) if row else None
+
+    async def save_group(self, group_id: int, group_link: str, admin_ids: List[int],
+                         list_admin_ids: List[int] = (), title: str = None):
+        """Подключение сообщества или обновление его настроек"""
+        async with self._acquire() as conn:
             await conn.execute("""
-                CREATE TABLE IF NOT EXISTS bride_participant_status (
-                    round_id BIGINT,
-                    user_id BIGINT,
-                    has_answered BOOLEAN DEFAULT FALSE,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (round_id, user_id)
+                INSERT INTO groups (group_id, group_link, admin_ids, list_admin_ids, title)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (group_id)
+                DO UPDATE SET group_link = EXCLUDED.group_link,
+                    admin_ids = EXCLUDED.admin_ids,
+                    list_admin_ids = EXCLUDED.list_admin_ids,
+                    title = EXCLUDED.title,
+                    active = TRUE,
+                    updated_at = CURRENT_TIMESTAMP
+            """, group_id, group_link, list(admin_ids), list(list_admin_ids), title)
+
+    async def deactivate_group(self, group_id: int):
+        """Отключение сообщества (данные игр и участников сохраняются)"""
+        async with self._acquire() as conn:
+            await conn.execute("""
+                UPDATE groups SET active = FALSE, updated_at = CURRENT_TIMESTAMP
+                WHERE group_id = $1
+            """, group_id)
+
+    # Очередь апдейтов (режим с отдельными приемом и воркерами)
+    async def enqueue_updates(self, updates: List[Tuple[int, int, str]]) -> int:
+        """Запись пачки апдейтов (update_id, partition_key, payload); повторы пропускаются"""
+        async with self._acquire() as conn:
+            # Воркеры просыпаются по NOTIFY, не дожидаясь опроса очереди
+            row = await conn.fetchrow(f"""
+                WITH inserted AS (
+                    INSERT INTO updates_queue (update_id, partition_key, payload)
+                    SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::TEXT[])
+                    ON CONFLICT (update_id) DO NOTHING
+                    RETURNING 1
+                )
+                SELECT count(*) AS inserted, pg_notify('{QUEUE_CHANNEL}', '') FROM inserted
+            """, [u[0] for u in updates], [u[1] for u in updates], [u[2] for u in updates])
+            return row['inserted']
+
+    async def claim_updates(self, worker_id: str, limit: int,
+                            claim_timeout: float) -> List[Dict]:
+        """Захват первых необработанных апдейтов разных чатов.
+
+        Следующий апдейт чата не выдается, пока предыдущий не удален
+        (complete_updates) или не истек claim_timeout.
+        """
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                WITH heads AS (
+                    SELECT DISTINCT ON (partition_key) update_id
+                    FROM updates_queue
+                    ORDER BY partition_key, update_id
+                ), picked AS (
+                    SELECT q.update_id FROM updates_queue q
+                    JOIN heads h ON h.update_id = q.update_id
+                    WHERE q.claimed_at IS NULL
+                       OR q.claimed_at < CURRENT_TIMESTAMP - make_interval(secs => $3)
+                    ORDER BY q.update_id
+                    LIMIT $2
+                    FOR UPDATE OF q SKIP LOCKED
                 )
+                UPDATE updates_queue q
+                SET claimed_by = $1, claimed_at = CURRENT_TIMESTAMP, attempts = q.attempts + 1
+                FROM picked
+                WHERE q.update_id = picked.update_id
+                RETURNING q.update_id, q.payload, q.attempts,
+                          EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - q.received_at)::FLOAT AS wait
+            """, worker_id, limit, claim_timeout)
+            return sorted((dict(row) for row in rows), key=lambda row: row['update_id'])
+
+    async def complete_updates(self, update_ids: List[int]):
+        """Удаление обработанных апдейтов"""
+        async with self._acquire() as conn:
+            await conn.execute("DELETE FROM updates_queue WHERE update_id = ANY($1::BIGINT[])",
+                               update_ids)
+
+    # Состояния FSM (общие для всех воркеров)
+    async def get_fsm(self, key: str) -> Optional[Dict]:
+        """Состояние и данные диалога или None"""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("SELECT state, data FROM fsm_states WHERE key = $1", key)
+            return {'state': row['state'], 'data': json.loads(row['data'])} if row else None
+
+    async def set_fsm_state(self, key: str, state: Optional[str]):
+        async with self._acquire() as conn:
+            await conn.execute("""
+                INSERT INTO fsm_states (key, state) VALUES ($1, $2)
+                ON CONFLICT (key) DO UPDATE
+                SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP
+            """, key, state)
+
+    async def set_fsm_data(self, key: str, data: Dict):
+        async with self._acquire() as conn:
+            if not data:
+                # Завершенный диалог (state.clear()) не хранится
+                await conn.execute(
+                    "DELETE FROM fsm_states WHERE key = $1 AND state IS NULL", key)
+            await conn.execute("""
+                INSERT INTO fsm_states (key, data) VALUES ($1, $2)
+                ON CONFLICT (key) DO UPDATE
+                SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+            """ if data else """
+                UPDATE fsm_states SET data = $2, updated_at = CURRENT_TIMESTAMP
+                WHERE key = $1
+            """, key, json.dumps(data, ensure_ascii=False))
+
+    # Восстановление состояния при запуске
+    async def get_recovery_state(self, group_id: int) -> Dict:
+        """Все, что бот держит в памяти о группе, одним согласованным снимком.
+
+        Активные викторины с ответами, активная игра Жених с раундами (и их
+        статусными сообщениями), участники, ответы текущего раунда и
+        закрепленные сообщения - несколько запросов в одной транзакции
+        вместо отдельных запросов на каждую викторину и раунд.
+        """
+        state = {'quizzes': {}, 'quiz_participants': {}, 'game': None, 'rounds': [],
+                 'participants': [], 'answers': [], 'pinned_messages': []}
+        async with self._acquire() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                rows = await conn.fetch("""
+                    SELECT * FROM active_quizzes WHERE active = TRUE AND chat_id = $1
+                """, group_id)
+                for row in rows:
+                    state['quizzes'][row['quiz_id']] = {
+                        'quiz_id': row['quiz_id'],
+                        'chat_id': row['chat_id'],
+                        'question': row['question'],
+                        'answers': json.loads(row['answers']),
+                        'correct_indices': json.loads(row['correct_indices']),
+                        'creator_id': row['creator_id'],
+                        'active': row['active']
+                    }
+                    state['quiz_participants'][row['quiz_id']] = {}
+
+                rows = await conn.fetch("""
+                    SELECT qp.quiz_id, qp.user_id, qp.answer_index
+                    FROM quiz_participants qp
+                    JOIN active_quizzes aq ON aq.quiz_id = qp.quiz_id
+                    WHERE aq.active = TRUE AND aq.chat_id = $1
+                """, group_id)
+                for row in rows:
+                    state['quiz_participants'][row['quiz_id']][row['user_id']] = row['answer_index']
+
+                game = await conn.fetchrow("""
+                    SELECT * FROM bride_games
+                    WHERE group_id = $1 AND status IN ('waiting', 'started')
+                    ORDER BY created_at DESC LIMIT 1
+                """, group_id)
+                if not game:
+                    return state
+                game_id = game['game_id']
+                state['game'] = dict(game)
+
+                rows = await conn.fetch("""
+                    SELECT br.*, rs.creator_id AS status_creator_id,
+                           rs.message_id AS status_message_id
+                    FROM bride_rounds br
+                    LEFT JOIN bride_round_status rs ON rs.round_id = br.round_id
+                    WHERE br.game_id = $1
+                    ORDER BY br.round_number
+                """, game_id)
+                state['rounds'] = [dict(row) for row in rows]
+
+                rows = await conn.fetch("""
+                    SELECT * FROM bride_participants
+                    WHERE game_id = $1
+                    ORDER BY user_id
+                """, game_id)
+                state['participants'] = [dict(row) for row in rows]
+
+                if state['rounds']:
+                    rows = await conn.fetch("""
+                        SELECT ba.*, bp.number
+                        FROM bride_answers ba
+                        JOIN bride_participants bp
+                          ON bp.user_id = ba.user_id AND bp.game_id = $2
+                        WHERE ba.round_id = $1
+                    """, state['rounds'][-1]['round_id'], game_id)
+                    state['answers'] = [dict(row) for row in rows]
+
+                rows = await conn.fetch("""
+                    SELECT message_id FROM bride_pinned_messages
+                    WHERE game_id = $1::BIGINT
+                """, game_id)
+                state['pinned_messages'] = [row['message_id'] for row in rows]
+        return state
+
+    # Методы политики хранения истории игр
+    async def archive_finished_games(self, older_than_days: int, batch_size: int = 100,
+                                     exporter=None) -> int:
+        """Перенос завершенных игр старше N дней из рабочих таблиц.
+
+        Без exporter игры сохраняются в bride_games_archive, иначе передаются
+        в exporter(records) до удаления. Возвращает количество перенесенных игр.
+        """
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                game_ids = await conn.fetch("""
+                    SELECT game_id FROM bride_games
+                    WHERE status = 'finished'
+                      AND COALESCE(finished_at, created_at) < CURRENT_TIMESTAMP - make_interval(days => $1)
+                    ORDER BY game_id
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                """, older_than_days, batch_size)
+                if not game_ids:
+                    return 0
+                game_ids = [row['game_id'] for row in game_ids]
+
+                records = await conn.fetch("""
+                    SELECT g.game_id, g.group_id, g.creator_id, g.bride_id, g.created_at,
+                           COALESCE(g.finished_at, g.created_at) AS finished_at,
+                           (SELECT COALESCE(json_agg(json_build_array(
+                                       p.user_id, p.number, p.is_out, p.is_bride)
+                                       ORDER BY p.number NULLS FIRST), '[]')
+                            FROM bride_participants p
+                            WHERE p.game_id = g.game_id) AS participants,
+                           (SELECT COALESCE(json_agg(json_build_array(
+                                       r.round_number, r.question, r.voted_out,
+                                       (SELECT COALESCE(json_agg(json_build_array(a.user_id, a.answer)), '[]')
+                                        FROM bride_answers a WHERE a.round_id = r.round_id))
+                                       ORDER BY r.round_number), '[]')
+                            FROM bride_rounds r
+                            WHERE r.game_id = g.game_id) AS rounds
+                    FROM bride_games g
+                    WHERE g.game_id = ANY($1::BIGINT[])
+                """, game_ids)
+
+                if exporter is not None:
+                    await exporter([dict(row) for row in records])
+                else:
+                    await self._ensure_archive_partitions(
+                        conn, {row['finished_at'] for row in records})
+                    await conn.executemany("""
+                        INSERT INTO bride_games_archive
+                            (game_id, group_id, creator_id, bride_id, created_at,
+                             finished_at, participants, rounds)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7::JSONB, $8::JSONB)
+                        ON CONFLICT DO NOTHING
+                    """, [(row['game_id'], row['group_id'], row['creator_id'], row['bride_id'],
+                          row['created_at'], row['finished_at'], row['participants'], row['rounds'])
+                         for row in records])
+
+                # Раунды, ответы и участники удаляются каскадно
+                await conn.execute("""
+                    DELETE FROM bride_pinned_messages WHERE game_id = ANY($1::BIGINT[])
+                """, game_ids)
+                await conn.execute("""
+                    DELETE FROM bride_games WHERE game_id = ANY($1::BIGINT[])
+                """, game_ids)
+                return len(game_ids)
+
+    async def _ensure_archive_partitions(self, conn, timestamps):
+        """Создание месячных секций архива (если архив секционирован)"""
+        is_partitioned = await conn.fetchval("""
+            SELECT EXISTS(SELECT 1 FROM pg_partitioned_table
+                          WHERE partrelid = 'bride_games_archive'::regclass)
+        """)
+        if not is_partitioned:
+            return
+        for month in {(ts.year, ts.month) for ts in timestamps}:
+            year, mon = month
+            next_year, next_mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS bride_games_archive_{year}{mon:02d}
+                PARTITION OF bride_games_archive
+                FOR VALUES FROM ('{year}-{mon:02d}-01') TO ('{next_year}-{next_mon:02d}-01')
+            """)
+
+    async def get_table_sizes(self) -> List[Dict]:
+        """Размеры таблиц базы данных (с индексами) и оценка числа строк"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT relname AS table_name,
+                       pg_total_relation_size(relid) AS total_bytes,
+                       n_live_tup AS row_estimate
+                FROM pg_stat_user_tables
+                ORDER BY pg_total_relation_size(relid) DESC
             """)
+            return [dict(row) for row in rows]
+
+    # Методы индекса уведомлений админам
+    async def create_admin_notice(self, user_id: int, kind: str, text: str) -> int:
+        """Создание уведомления админам"""
+        async with self._acquire() as conn:
+            return await conn.fetchval("""
+                INSERT INTO admin_notices (user_id, kind, text)
+                VALUES ($1::BIGINT, $2, $3)
+                RETURNING notice_id
+            """, user_id, kind, text)
+
+    async def save_admin_notice_copies(self, notice_id: Optional[int],
+                                       copies: List[Tuple[int, int, Optional[str]]],
+                                       user_id: int, kind: str):
+        """Сохранение копий уведомления (chat_id, message_id, edit_mode) одним запросом"""
+        async with self._acquire() as conn:
+            await conn.execute("""
+                INSERT INTO admin_notice_messages
+                    (admin_chat_id, message_id, user_id, kind, notice_id, edit_mode)
+                SELECT t.chat_id, t.message_id, $4::BIGINT, $5, $1::BIGINT, t.edit_mode
+                FROM unnest($2::BIGINT[], $3::BIGINT[], $6::TEXT[]) AS t(chat_id, message_id, edit_mode)
+                ON CONFLICT (admin_chat_id, message_id) DO NOTHING
+            """, notice_id, [c[0] for c in copies], [c[1] for c in copies],
+                user_id, kind, [c[2] for c in copies])
+
+    async def find_admin_notice_message(self, admin_chat_id: int, message_id: int) -> Optional[Dict]:
+        """Поиск уведомления по сообщению в чате админа"""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT user_id, kind, notice_id FROM admin_notice_messages
+                WHERE admin_chat_id = $1::BIGINT AND message_id = $2::BIGINT
+            """, admin_chat_id, message_id)
+            return dict(row) if row else None
 
+    async def get_admin_notice(self, notice_id: int) -> Optional[Dict]:
+        """Уведомление вместе со всеми копиями у админов"""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT user_id, kind, text, status FROM admin_notices
+                WHERE notice_id = $1::BIGINT
+            """, notice_id)
+            if not row:
+                return None
+            copies = await conn.fetch("""
+                SELECT admin_chat_id, message_id, edit_mode FROM admin_notice_messages
+                WHERE notice_id = $1::BIGINT
+            """, notice_id)
+            notice = dict(row)
+            notice['copies'] = [(c['admin_chat_id'], c['message_id'], c['edit_mode'])
+                                for c in copies]
+            return notice
+
+    async def update_admin_notice_status(self, notice_id: int, status: str):
+        """Сохранение отметок об обработке уведомления"""
+        async with self._acquire() as conn:
+            await conn.execute("""
+                UPDATE admin_notices SET status = $2 WHERE notice_id = $1::BIGINT
+            """, notice_id, status)
+
+    async def cleanup_admin_notices(self, older_than_days: int = 30) -> int:
+        """Удаление старых записей индекса уведомлений"""
+        async with self._acquire() as conn:
+            status = await conn.execute("""
+                DELETE FROM admin_notice_messages
+                WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => $1)
+            """, older_than_days)
+            await conn.execute("""
+                DELETE FROM admin_notices
+                WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => $1)
+            """, older_than_days)
+            return _affected(status)
+
+    # Методы статистики
+    async def get_stats_summary(self, group_id: int) -> List[Dict]:
+        """Сводка агрегатов сообщества за сегодня, 7 и 30 дней (одно чтение по первичному ключу)"""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT metric, key,
+                       COALESCE(SUM(value) FILTER (WHERE day = CURRENT_DATE), 0) AS today,
+                       COALESCE(SUM(value) FILTER (WHERE day > CURRENT_DATE - 7), 0) AS week,
+                       SUM(value) AS month
+                FROM stats_daily
+                WHERE group_id = $1 AND day > CURRENT_DATE - 30
+                GROUP BY metric, key
+                ORDER BY metric, month DESC, key
+            """, group_id)
+            return [dict(row) for row in rows]
+
+    async def backfill_stats(self) -> int:
+        """Пересчет агрегатов по сырым таблицам.
+
+        Значения только увеличиваются: часть сырых данных (заявки) со временем
+        удаляется, и уже накопленные счетчики не должны уменьшаться.
+        """
+        async with self._acquire() as conn:
+            status = await conn.execute("""
+                INSERT INTO stats_daily (group_id, day, metric, key, value)
+                SELECT group_id, day, metric, key, SUM(value) FROM (
+                    SELECT group_id, joined_at::DATE AS day, 'joins' AS metric, '' AS key,
+                           1 AS value
+                    FROM user_membership WHERE joined_at IS NOT NULL
+                    UNION ALL
+                    SELECT group_id, left_at::DATE, 'leaves', '', 1
+                    FROM user_membership WHERE left_at IS NOT NULL
+                    UNION ALL
+                    SELECT group_id, created_at::DATE, 'applications', COALESCE(role, ''), 1
+                    FROM active_applications
+                    UNION ALL
+                    SELECT group_id, submitted_at::DATE, 'applications', COALESCE(role, ''), 1
+                    FROM pending_applications p
+                    -- Заявки с подтверждением текстом попадают сюда только для очереди
+                    WHERE NOT EXISTS (SELECT 1 FROM active_applications a
+                                      WHERE a.user_id = p.user_id)
+                    UNION ALL
+                    SELECT q.chat_id, p.created_at::DATE, 'quiz_answers', '', 1
+                    FROM quiz_participants p JOIN active_quizzes q ON q.quiz_id = p.quiz_id
+                    UNION ALL
+                    SELECT group_id, created_at::DATE, 'bride_games_started', '', 1
+                    FROM bride_games WHERE status IN ('started', 'finished')
+                    UNION ALL
+                    SELECT group_id, COALESCE(finished_at, created_at)::DATE,
+                           'bride_games_finished', '', 1
+                    FROM bride_games WHERE status = 'finished'
+                    UNION ALL
+                    SELECT group_id, created_at::DATE, 'bride_games_started', '', 1
+                    FROM bride_games_archive
+                    UNION ALL
+                    SELECT group_id, finished_at::DATE, 'bride_games_finished', '', 1
+                    FROM bride_games_archive
+                ) raw
+                WHERE day IS NOT NULL AND group_id IS NOT NULL
+                GROUP BY group_id, day, metric, key
+                ON CONFLICT (group_id, day, metric, key)
+                DO UPDATE SET value = GREATEST(stats_daily.value, EXCLUDED.value)
+            """)
+            return _affected(status)
+
+    async def save_participant_status_snapshot(self, round_id: int, participant_statuses: Dict[int, bool]):
+        """Сохранение снимка статусов участников для восстановления после перезапуска"""
+        async with self._acquire() as conn:
             # Сохраняем статусы
             for user_id, has_answered in participant_statuses.items():
                 await conn.execute("""
@@ -1003,7 +2228,7 @@ class Database:
 
     async def get_participant_status_snapshot(self, round_id: int) -> Dict[int, bool]:
         """Получение сохраненного снимка статусов участников"""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             try:
                 rows = await conn.fetch("""
                     SELECT user_id, has_answered FROM bride_participant_status 
@@ -1014,9 +2239,17 @@ class Database:
                 # Таблица может не существовать, возвращаем пустой словарь
                 return {}
 
-    async def mark_as_bride(self, user_id: int):
-        """Отмечает пользователя как бывшего жениха"""
-        await self.update_bride_history(user_id)
+
+def create_database(backend: str = None) -> Storage:
+    """Хранилище по имени бэкенда (STORAGE_BACKEND: postgres или memory)"""
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'postgres')
+    if backend == 'postgres':
+        return Database()
+    if backend == 'memory':
+        from memory_db import MemoryDatabase
+        return MemoryDatabase()
+    raise ValueError(f"Неизвестное хранилище: {backend}")
+
 
 # Глобальный экземпляр базы данных
-db = Database()
+db = create_database()
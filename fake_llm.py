@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+from aiohttp import web
+
+# Путь, по которому AsyncGroq отправляет запросы относительно base_url
+COMPLETIONS_PATH = '/openai/v1/chat/completions'
+
+
+def echo_reply(messages: List[Dict]) -> str:
+    """Ответ по умолчанию: последний запрос пользователя"""
+    return f"Ответ на: {messages[-1]['content']}"
+
+
+class FakeLLMServer:
+    """Локальный OpenAI-совместимый сервер для проверки llm.py без сети.
+
+    Поддерживает обычные и потоковые (SSE) ответы, задержку и долю ошибок.
+    Использование: GROQ_BASE_URL=<base_url> или LLMService(base_url=...).
+    """
+
+    def __init__(self, latency: float = 0.0, chunk_delay: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 1,
+                 reply: Callable[[List[Dict]], str] = echo_reply):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.reply = reply
+        self.requests: List[Dict] = []
+        self.base_url: Optional[str] = None
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(COMPLETIONS_PATH, self._handle)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск сервера, возвращает базовый URL (порт 0 - любой свободный)"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        logging.info(f"Фейковый LLM API запущен на {self.base_url}")
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests.append(body)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return web.json_response(
+                {'error': {'message': 'Service unavailable', 'type': 'server_error'}},
+                status=503)
+
+        text = self.reply(body['messages'])
+        created = int(time.time())
+        base = {'id': f"chatcmpl-{len(self.requests)}", 'created': created,
+                'model': body.get('model', 'fake')}
+        if not body.get('stream'):
+            return web.json_response({
+                **base, 'object': 'chat.completion',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': text}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        try:
+            await response.prepare(request)
+            words = text.split(' ')
+            for index, word in enumerate(words):
+                delta = word if index == 0 else ' ' + word
+                await self._event(response, {**base, 'object': 'chat.completion.chunk',
+                                             'choices': [{'index': 0, 'finish_reason': None,
+                                                          'delta': {'content': delta}}]})
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+            await self._event(response, {**base, 'object': 'chat.completion.chunk',
+                                         'choices': [{'index': 0, 'finish_reason': 'stop',
+                                                      'delta': {}}]})
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # Клиент закрыл соединение (таймаут или отмена)
+            pass
+        return response
+
+    @staticmethod
+    async def _event(response: web.StreamResponse, payload: Dict):
+        await response.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode())
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from aiohttp import web
+from aiogram.client.telegram import TelegramAPIServer
+
+# Данные бота, которые возвращает фейковый getMe
+FAKE_BOT_ID = 1000000001
+FAKE_BOT_USERNAME = 'fake_test_bot'
+
+# Методы отправки сообщений (возвращают Message)
+SEND_METHODS = frozenset({
+    'sendMessage', 'sendPhoto', 'sendVideo', 'sendAnimation', 'sendDocument',
+    'sendAudio', 'sendVoice', 'sendVideoNote', 'sendSticker'
+})
+# Методы-действия, на которые Telegram отвечает True
+ACTION_METHODS = frozenset({
+    'deleteMessage', 'pinChatMessage', 'unpinChatMessage',
+    'unpinAllChatMessages', 'answerCallbackQuery', 'setMyCommands',
+    'deleteWebhook', 'restrictChatMember', 'promoteChatMember',
+    'setChatAdministratorCustomTitle', 'banChatMember', 'unbanChatMember',
+    'approveChatJoinRequest', 'declineChatJoinRequest', 'sendChatAction'
+})
+
+# Обязательные поля ChatMemberAdministrator
+ADMIN_RIGHTS = (
+    'can_be_edited', 'is_anonymous', 'can_manage_chat', 'can_delete_messages',
+    'can_manage_video_chats', 'can_restrict_members', 'can_promote_members',
+    'can_change_info', 'can_invite_users', 'can_post_stories',
+    'can_edit_stories', 'can_delete_stories'
+)
+
+
+def _parse_value(value: str):
+    """Поля формы aiogram: сложные значения приходят JSON-строкой"""
+    if value and value[0] in '{["' or value in ('true', 'false', 'null'):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+class FakeTelegramState:
+    """Состояние фейкового Telegram: чаты, участники, сообщения и очередь апдейтов"""
+
+    def __init__(self):
+        self.members: Dict[int, Dict[int, str]] = {}
+        # Статус для пользователей, не добавленных явно через set_member
+        self.default_status = 'left'
+        self.users: Dict[int, Dict] = {}
+        # Права администраторов, выданные явно: (chat_id, user_id) -> права
+        self.rights: Dict[tuple, Dict[str, bool]] = {}
+        self.pinned: Dict[int, set] = {}
+        self._message_ids: Dict[int, int] = {}
+        self.updates: deque = deque()
+        self._update_id = 0
+        self._updates_event = asyncio.Event()
+
+    def add_user(self, user_id: int, first_name: str, username: str = None):
+        self.users[user_id] = {'id': user_id, 'is_bot': False,
+                               'first_name': first_name,
+                               **({'username': username} if username else {})}
+
+    def set_member(self, chat_id: int, user_id: int, status: str = 'member',
+                   rights: Dict[str, bool] = None):
+        self.members.setdefault(chat_id, {})[user_id] = status
+        if rights:
+            self.rights[(chat_id, user_id)] = rights
+
+    def next_message_id(self, chat_id: int) -> int:
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        return message_id
+
+    def chat(self, chat_id: int) -> Dict:
+        if chat_id > 0:
+            user = self.users.get(chat_id, {'first_name': f"User {chat_id}"})
+            return {'id': chat_id, 'type': 'private',
+                    'first_name': user['first_name'],
+                    **({'username': user['username']} if 'username' in user else {})}
+        return {'id': chat_id, 'type': 'supergroup', 'title': f"Group {chat_id}"}
+
+    def user(self, user_id: int) -> Dict:
+        if user_id == FAKE_BOT_ID:
+            return {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake Bot',
+                    'username': FAKE_BOT_USERNAME}
+        return self.users.get(user_id, {'id': user_id, 'is_bot': False,
+                                        'first_name': f"User {user_id}"})
+
+    def chat_member(self, chat_id: int, user_id: int) -> Dict:
+        status = self.members.get(chat_id, {}).get(user_id, self.default_status)
+        member = {'status': status, 'user': self.user(user_id)}
+        if status == 'creator':
+            member['is_anonymous'] = False
+        elif status == 'administrator':
+            member.update(dict.fromkeys(ADMIN_RIGHTS, False))
+            member.update(self.rights.get((chat_id, user_id), {}))
+        return member
+
+    def push_update(self, update: Dict) -> int:
+        """Кладет апдейт в очередь getUpdates, возвращает update_id"""
+        self._update_id += 1
+        self.updates.append({**update, 'update_id': self._update_id})
+        self._updates_event.set()
+        return self._update_id
+
+    async def get_updates(self, offset: int, limit: int, timeout: float):
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates)[:limit]
+
+
+class FakeTelegramServer:
+    """Локальный Bot API для нагрузочных тестов.
+
+    latency и jitter задают задержку ответа (секунды), flood_rate - долю
+    запросов, на которые отвечаем 429 с retry_after.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 flood_rate: float = 0.0, retry_after: int = 1,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.state = FakeTelegramState()
+        self.calls: Counter = Counter()
+        self.flood_errors = 0
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url: Optional[str] = None
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.flood_errors = 0
+
+    def api_server(self) -> TelegramAPIServer:
+        return TelegramAPIServer.from_base(self.base_url)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск сервера, возвращает базовый URL (порт 0 - любой свободный)"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        logging.info(f"Фейковый Bot API запущен на {self.base_url}")
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            form = await request.post()
+            params = {key: _parse_value(value) for key, value in form.items()
+                      if isinstance(value, str)}
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method != 'getUpdates' and self.flood_rate and self._random.random() < self.flood_rate:
+            self.flood_errors += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}})
+
+        try:
+            result = await self._dispatch(method, params)
+        except KeyError as e:
+            return web.json_response({'ok': False, 'error_code': 400,
+                                      'description': f"Bad Request: {e} required"})
+        if result is None:
+            return web.json_response({'ok': False, 'error_code': 404,
+                                      'description': 'Not Found: method not found'})
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _dispatch(self, method: str, params: Dict):
+        state = self.state
+        if method == 'getMe':
+            return {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake Bot',
+                    'username': FAKE_BOT_USERNAME}
+        if method == 'getUpdates':
+            return await state.get_updates(int(params.get('offset') or 0),
+                                           int(params.get('limit') or 100),
+                                           float(params.get('timeout') or 0))
+        if method in SEND_METHODS or method == 'copyMessage':
+            chat_id = int(params['chat_id'])
+            message = {'message_id': state.next_message_id(chat_id),
+                       'date': int(time.time()),
+                       'chat': state.chat(chat_id),
+                       'from': {'id': FAKE_BOT_ID, 'is_bot': True,
+                                'first_name': 'Fake Bot'}}
+            if method == 'copyMessage':
+                return {'message_id': message['message_id']}
+            if method == 'sendMessage':
+                message['text'] = params['text']
+            elif params.get('caption'):
+                message['caption'] = params['caption']
+            # В сообщении Telegram возвращает только inline-клавиатуру
+            if isinstance(params.get('reply_markup'), dict) and 'inline_keyboard' in params['reply_markup']:
+                message['reply_markup'] = params['reply_markup']
+            return message
+        if method in ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'):
+            chat_id = int(params['chat_id'])
+            message = {'message_id': int(params['message_id']),
+                       'date': int(time.time()),
+                       'chat': state.chat(chat_id),
+                       'from': {'id': FAKE_BOT_ID, 'is_bot': True,
+                                'first_name': 'Fake Bot'}}
+            if 'text' in params:
+                message['text'] = params['text']
+            if 'caption' in params:
+                message['caption'] = params['caption']
+            return message
+        if method == 'pinChatMessage':
+            state.pinned.setdefault(int(params['chat_id']), set()).add(int(params['message_id']))
+            return True
+        if method == 'unpinChatMessage':
+            pinned = state.pinned.get(int(params['chat_id']), set())
+            pinned.discard(int(params.get('message_id') or 0))
+            return True
+        if method in ACTION_METHODS:
+            return True
+        if method == 'getChat':
+            return {**state.chat(int(params['chat_id'])),
+                    'accent_color_id': 0, 'max_reaction_count': 11}
+        if method == 'getChatMember':
+            return state.chat_member(int(params['chat_id']), int(params['user_id']))
+        if method == 'getChatAdministrators':
+            chat_id = int(params['chat_id'])
+            return [state.chat_member(chat_id, user_id)
+                    for user_id, status in state.members.get(chat_id, {}).items()
+                    if status in ('administrator', 'creator')]
+        if method == 'getChatMemberCount':
+            members = state.members.get(int(params['chat_id']), {})
+            return sum(1 for status in members.values()
+                       if status in ('member', 'administrator', 'creator'))
+        return None
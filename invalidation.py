@@ -0,0 +1,194 @@
+import asyncio
+import inspect
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from metrics import Counter, registry
+
+# Как часто проверять, что соединение LISTEN живо, с
+INVALIDATION_PING_INTERVAL = float(os.environ.get('INVALIDATION_PING_INTERVAL', '30'))
+INVALIDATION_MAX_RECONNECT_DELAY = 30.0
+
+# key=None - сообщение "перечитать всё" (после переподключения)
+Handler = Callable[[Optional[int]], Union[None, Awaitable[None]]]
+
+invalidations_received = registry.register(Counter(
+    'bot_cache_invalidations_total', 'Полученные уведомления об изменениях по таблицам',
+    ('table', 'origin')))
+invalidations_missed = registry.register(Counter(
+    'bot_cache_invalidations_missed_total',
+    'Уведомления, пропущенные за время разрыва соединения LISTEN (оценка по sequence)'))
+cache_resyncs = registry.register(Counter(
+    'bot_cache_resyncs_total', 'Полные перечитывания кэшей после переподключения',
+    ('table',)))
+
+
+def parse_payload(payload: str) -> Optional[Tuple[int, str, Optional[int]]]:
+    """(номер, таблица, ключ) из строки 'seq:table:key' или None"""
+    try:
+        seq, table, key = payload.split(':', 2)
+        return int(seq), table, int(key) if key else None
+    except ValueError:
+        return None
+
+
+class InvalidationBus:
+    """Сброс локальных кэшей по изменениям в Postgres от других процессов.
+
+    Триггеры кэшируемых таблиц (db.CACHE_TABLES) делают pg_notify с
+    компактной строкой 'seq:table:key'. Шина держит отдельное соединение
+    с LISTEN и вызывает обработчики подписчиков таблицы с ключом строки.
+    Изменения, сделанные соединениями своего пула, пропускаются: свои
+    записи кэши обновляют сами.
+
+    Повторные уведомления об одном ключе, пришедшие до обработки,
+    объединяются. После разрыва соединения все подписчики получают
+    key=None (перечитать всё), а число пропущенных уведомлений оценивается
+    по cache_invalidation_seq. Для хранилища в памяти шина не запускается.
+    """
+
+    def __init__(self, database, channel: str,
+                 ping_interval: float = INVALIDATION_PING_INTERVAL):
+        self.db = database
+        self.channel = channel
+        self.ping_interval = ping_interval
+        self._handlers: Dict[str, List[Handler]] = {}
+        # Ключи, ожидающие обработки (dict сохраняет порядок поступления)
+        self._pending: Dict[Tuple[str, Optional[int]], None] = {}
+        self._wakeup = asyncio.Event()
+        self._last_seq: Optional[int] = None
+        self._connection = None
+        self._listen_task: Optional[asyncio.Task] = None
+        self._dispatch_task: Optional[asyncio.Task] = None
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+
+    def subscribe(self, table: str, handler: Handler):
+        """Обработчик изменений строки таблицы (обычная или async-функция)"""
+        self._handlers.setdefault(table, []).append(handler)
+
+    @property
+    def running(self) -> bool:
+        return self._listen_task is not None and not self._listen_task.done()
+
+    async def start(self) -> bool:
+        """Запуск LISTEN. False, если хранилище не поддерживает уведомления"""
+        if self.running:
+            return True
+        connection = await self.db.connect_dedicated('listener')
+        if connection is None:
+            return False
+        self._dispatch_task = asyncio.create_task(self._dispatch_loop())
+        self._listen_task = asyncio.create_task(self._listen_loop(connection))
+        # Слушаем до загрузки состояния, чтобы не пропустить изменения между ними
+        try:
+            await asyncio.wait_for(self.connected.wait(), self.ping_interval)
+        except asyncio.TimeoutError:
+            logging.warning("Шина инвалидации еще не подписалась на уведомления")
+        return True
+
+    async def stop(self):
+        for task in (self._listen_task, self._dispatch_task):
+            if task:
+                task.cancel()
+        await asyncio.gather(*(t for t in (self._listen_task, self._dispatch_task) if t),
+                             return_exceptions=True)
+        self._listen_task = self._dispatch_task = None
+        await self._close_connection()
+
+    async def _listen_loop(self, connection):
+        delay = 1.0
+        first = True
+        while True:
+            lost = asyncio.Event()
+            try:
+                if connection is None:
+                    connection = await self.db.connect_dedicated('listener')
+                self._connection = connection
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(self.channel, self._on_notify)
+                await self._check_missed(connection, resync=not first)
+                first = False
+                delay = 1.0
+                self.connected.set()
+                logging.info(f"Шина инвалидации кэшей слушает канал {self.channel}")
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), self.ping_interval)
+                    except asyncio.TimeoutError:
+                        # Разрыв TCP без закрытия сокета обнаруживается только запросом
+                        await connection.fetchval('SELECT 1', timeout=self.ping_interval)
+                logging.warning("Соединение LISTEN закрыто, переподключение")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка соединения шины инвалидации: {e}")
+            self.connected.clear()
+            await self._close_connection()
+            connection = None
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INVALIDATION_MAX_RECONNECT_DELAY)
+
+    async def _check_missed(self, connection, resync: bool):
+        """Оценка пропущенных уведомлений и полное перечитывание после разрыва"""
+        last_seq = await connection.fetchval("""
+            SELECT CASE WHEN is_called THEN last_value ELSE 0 END
+            FROM cache_invalidation_seq
+        """)
+        if self._last_seq is not None and last_seq > self._last_seq:
+            missed = last_seq - self._last_seq
+            invalidations_missed.inc(missed)
+            logging.warning(f"Пока не было соединения LISTEN, пропущено уведомлений: {missed}")
+        self._last_seq = max(self._last_seq or 0, last_seq)
+        if resync:
+            for table in self._handlers:
+                cache_resyncs.labels(table).inc()
+                self._enqueue(table, None)
+
+    async def _close_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            try:
+                await connection.close(timeout=5)
+            except Exception:
+                connection.terminate()
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        parsed = parse_payload(payload)
+        if parsed is None:
+            logging.warning(f"Некорректное уведомление об изменении: {payload!r}")
+            return
+        seq, table, key = parsed
+        self._last_seq = max(self._last_seq or 0, seq)
+        if pid in self.db.server_pids:
+            invalidations_received.labels(table, 'self').inc()
+            return
+        invalidations_received.labels(table, 'remote').inc()
+        if table in self._handlers:
+            self._enqueue(table, key)
+
+    def _enqueue(self, table: str, key: Optional[int]):
+        self._pending[(table, key)] = None
+        self._wakeup.set()
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                table, key = next(iter(self._pending))
+                del self._pending[(table, key)]
+                # Полное перечитывание заменяет отдельные ключи этой таблицы
+                if key is None:
+                    for pending in [p for p in self._pending if p[0] == table]:
+                        del self._pending[pending]
+                for handler in self._handlers.get(table, ()):
+                    try:
+                        result = handler(key)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception as e:
+                        logging.error(f"Ошибка обработки изменения {table}:{key}: {e}")
+
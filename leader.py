@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import TelegramObject, Update
+
+from metrics import Counter, Gauge, registry
+
+# Выбор ведущего экземпляра: polling ведет только держатель аренды
+LEADER_ELECTION = os.environ.get('LEADER_ELECTION', '1') == '1'
+# Как часто резервный экземпляр пытается взять аренду, с
+LEADER_RETRY_INTERVAL = float(os.environ.get('LEADER_RETRY_INTERVAL', '0.5'))
+# Как часто ведущий проверяет, что соединение с арендой живо, с
+LEADER_CHECK_INTERVAL = float(os.environ.get('LEADER_CHECK_INTERVAL', '1'))
+
+leader_transitions = registry.register(Counter(
+    'bot_leader_transitions_total', 'Смены роли экземпляра', ('event',)))
+
+
+class LeaderLease:
+    """Аренда роли ведущего на advisory lock Postgres.
+
+    Блокировка берется на отдельном соединении вне пула и живет, пока живет
+    сессия: при падении процесса Postgres отпускает ее сразу (или через
+    несколько секунд TCP keepalive, если пропала сеть). Резервный экземпляр
+    пробует взять блокировку каждые LEADER_RETRY_INTERVAL секунд. Ведущий
+    проверяет соединение каждые LEADER_CHECK_INTERVAL секунд и при ошибке
+    считает аренду потерянной, чтобы не вести polling одновременно с новым
+    ведущим.
+
+    Ключ блокировки - один bigint (ID бота): экземпляры разных ботов с общей
+    базой друг другу не мешают. Для хранилища в памяти аренда выдается сразу.
+    """
+
+    def __init__(self, database, key: int,
+                 retry_interval: float = LEADER_RETRY_INTERVAL,
+                 check_interval: float = LEADER_CHECK_INTERVAL):
+        self.db = database
+        self.key = key
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        self.is_leader = False
+        self._connection = None
+        self._lost: Optional[asyncio.Event] = None
+        registry.register(Gauge('bot_leader', 'Экземпляр ведет polling (1) или в резерве (0)',
+                                lambda: [((), 1 if self.is_leader else 0)]))
+
+    async def acquire(self):
+        """Ожидание аренды; возвращается, когда экземпляр стал ведущим"""
+        logged = False
+        while True:
+            try:
+                if self._connection is None or self._connection.is_closed():
+                    self._connection = await self.db.connect_dedicated('leader')
+                    if self._connection is None:
+                        self.is_leader = True
+                        return
+                    self._lost = asyncio.Event()
+                    lost = self._lost
+                    self._connection.add_termination_listener(lambda _: lost.set())
+                acquired = await self._connection.fetchval(
+                    "SELECT pg_try_advisory_lock($1::BIGINT)", self.key,
+                    timeout=self.check_interval * 5)
+                if acquired:
+                    self.is_leader = True
+                    leader_transitions.labels('acquired').inc()
+                    logging.info("Аренда получена: экземпляр ведущий")
+                    return
+                if not logged:
+                    logging.info("Аренду держит другой экземпляр: ожидание в резерве")
+                    logged = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка получения аренды: {e}")
+                await self._close()
+            await asyncio.sleep(self.retry_interval)
+
+    async def wait_lost(self):
+        """Возвращается, если ведущий потерял соединение с арендой"""
+        if self._connection is None:
+            # Хранилище в памяти: аренда не теряется
+            await asyncio.Event().wait()
+        while not self._lost.is_set():
+            try:
+                await asyncio.wait_for(self._lost.wait(), self.check_interval)
+            except asyncio.TimeoutError:
+                try:
+                    await self._connection.fetchval('SELECT 1', timeout=self.check_interval)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(f"Соединение с арендой не отвечает: {e}")
+                    break
+        self.is_leader = False
+        leader_transitions.labels('lost').inc()
+        logging.warning("Аренда потеряна: экземпляр переходит в резерв")
+        await self._close()
+
+    async def release(self):
+        """Добровольная передача аренды (остановка или деплой)"""
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        if self._connection is None:
+            return
+        try:
+            await self._connection.fetchval(
+                "SELECT pg_advisory_unlock($1::BIGINT)", self.key,
+                timeout=self.check_interval)
+            leader_transitions.labels('released').inc()
+            logging.info("Аренда передана")
+        except Exception as e:
+            # Блокировка все равно освободится при закрытии сессии
+            logging.error(f"Ошибка освобождения аренды: {e}")
+        await self._close()
+
+    async def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            try:
+                await connection.close(timeout=self.check_interval)
+            except Exception:
+                connection.terminate()
+
+
+class UpdateOffsetTracker(BaseMiddleware):
+    """Внешний middleware апдейтов: запоминает последний полученный update_id.
+
+    Telegram считает апдейты подтвержденными только при следующем getUpdates
+    со смещением больше их номера. Уходящий ведущий подтверждает их сам
+    (confirm), иначе новый ведущий получит и обработает их повторно.
+    """
+
+    def __init__(self):
+        self.last_update_id: Optional[int] = None
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if isinstance(event, Update):
+            self.seen(event.update_id)
+        return await handler(event, data)
+
+    def seen(self, update_id: int):
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+
+    async def confirm(self, bot: Bot):
+        if self.last_update_id is None:
+            return
+        try:
+            # timeout=0 и limit=1: следующий апдейт не ждем и не подтверждаем
+            await bot.get_updates(offset=self.last_update_id + 1, limit=1, timeout=0)
+        except Exception as e:
+            logging.error(f"Ошибка подтверждения апдейтов перед передачей аренды: {e}")
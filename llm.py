@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Optional
+
+from admin_notices import LRUCache
+from metrics import Counter, Histogram, registry
+
+GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
+# Другой адрес API (например, локальный фейковый сервер fake_llm.py)
+GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL') or None
+GROQ_MODEL = os.environ.get('GROQ_MODEL', 'llama-3.1-8b-instant')
+# Сколько запросов к LLM выполняется одновременно, остальные ждут слота
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '4'))
+# Общий лимит на ожидание слота и ответ, с
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', '15'))
+LLM_CACHE_SIZE = int(os.environ.get('LLM_CACHE_SIZE', '256'))
+LLM_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', '3600'))
+
+llm_requests = registry.register(Counter(
+    'bot_llm_requests_total', 'Запросы к LLM по результату', ('result',)))
+llm_latency = registry.register(Histogram(
+    'bot_llm_request_seconds', 'Длительность запросов к LLM (без кэша)',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+
+
+def normalize_prompt(text: str) -> str:
+    """Ключ кэша: регистр и пробелы не влияют на совпадение"""
+    return ' '.join(text.lower().split())
+
+
+class LLMService:
+    """Обертка над AsyncGroq: ограничение параллельности, таймауты, кэш ответов.
+
+    Запросы не блокируют цикл событий. Одинаковые запросы (с точностью до
+    регистра и пробелов) в пределах TTL берутся из LRU-кэша, одновременные
+    одинаковые запросы объединяются в один. Ошибки и таймауты логируются,
+    вызывающий код получает None.
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str] = GROQ_BASE_URL,
+                 model: str = GROQ_MODEL, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT, cache_size: int = LLM_CACHE_SIZE,
+                 cache_ttl: float = LLM_CACHE_TTL):
+        # Клиент импортируется только при первом использовании LLM
+        from groq import AsyncGroq
+
+        self.client = AsyncGroq(api_key=api_key, base_url=base_url,
+                                timeout=timeout, max_retries=1)
+        self.model = model
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache = LRUCache(cache_size)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight = {}
+
+    def _cache_key(self, prompt: str, system: Optional[str], max_tokens: int,
+                   temperature: float):
+        return (self.model, normalize_prompt(system or ''), normalize_prompt(prompt),
+                max_tokens, temperature)
+
+    def _cached(self, key) -> Optional[str]:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        expires_at, text = entry
+        if expires_at < time.monotonic():
+            self.cache.pop(key)
+            return None
+        return text
+
+    def _store(self, key, text: str):
+        if text:
+            self.cache.put(key, (time.monotonic() + self.cache_ttl, text))
+
+    @staticmethod
+    def _messages(prompt: str, system: Optional[str]):
+        messages = [{'role': 'system', 'content': system}] if system else []
+        messages.append({'role': 'user', 'content': prompt})
+        return messages
+
+    async def complete(self, prompt: str, system: Optional[str] = None,
+                       max_tokens: int = 256, temperature: float = 0.7,
+                       timeout: Optional[float] = None, use_cache: bool = True) -> Optional[str]:
+        """Ответ модели целиком или None при ошибке и таймауте"""
+        if not use_cache:
+            return await self._request(prompt, system, max_tokens, temperature,
+                                       timeout or self.timeout)
+
+        key = self._cache_key(prompt, system, max_tokens, temperature)
+        text = self._cached(key)
+        if text is not None:
+            llm_requests.labels('cached').inc()
+            return text
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._request(
+                prompt, system, max_tokens, temperature, timeout or self.timeout))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None and task.result() is not None:
+            self._store(key, task.result())
+
+    async def _request(self, prompt: str, system: Optional[str], max_tokens: int,
+                       temperature: float, timeout: float) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(timeout):
+                async with self._semaphore:
+                    response = await self.client.chat.completions.create(
+                        model=self.model, messages=self._messages(prompt, system),
+                        max_tokens=max_tokens, temperature=temperature)
+        except TimeoutError:
+            llm_requests.labels('timeout').inc()
+            logging.warning(f"LLM не ответила за {timeout} с")
+            return None
+        except Exception as e:
+            llm_requests.labels('error').inc()
+            logging.error(f"Ошибка запроса к LLM: {e}")
+            return None
+        llm_latency.observe(time.perf_counter() - started)
+        llm_requests.labels('ok').inc()
+        return (response.choices[0].message.content or '').strip()
+
+    async def stream(self, prompt: str, system: Optional[str] = None,
+                     max_tokens: int = 256, temperature: float = 0.7,
+                     timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Ответ модели по частям. При ошибке поток просто заканчивается.
+
+        Полностью полученный ответ кладется в кэш; при попадании в кэш
+        ответ отдается одной частью.
+        """
+        key = self._cache_key(prompt, system, max_tokens, temperature)
+        text = self._cached(key)
+        if text is not None:
+            llm_requests.labels('cached').inc()
+            yield text
+            return
+
+        # Таймаут считается только для ожиданий внутри генератора: время,
+        # которое потребитель тратит между частями, в него не входит
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        parts = []
+        response = None
+        acquired = False
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), deadline - loop.time())
+            acquired = True
+            response = await asyncio.wait_for(self.client.chat.completions.create(
+                model=self.model, messages=self._messages(prompt, system),
+                max_tokens=max_tokens, temperature=temperature, stream=True),
+                deadline - loop.time())
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), deadline - loop.time())
+                except StopAsyncIteration:
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except TimeoutError:
+            llm_requests.labels('timeout').inc()
+            logging.warning(f"LLM не закончила ответ за {timeout or self.timeout} с")
+            return
+        except Exception as e:
+            llm_requests.labels('error').inc()
+            logging.error(f"Ошибка потокового запроса к LLM: {e}")
+            return
+        finally:
+            if response is not None:
+                await response.close()
+            if acquired:
+                self._semaphore.release()
+        llm_latency.observe(time.perf_counter() - started)
+        llm_requests.labels('ok').inc()
+        self._store(key, ''.join(parts).strip())
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        await self.client.close()
+
+
+_service: Optional[LLMService] = None
+
+
+def get_llm() -> Optional[LLMService]:
+    """Общий LLMService, создается при первом обращении. None, если ключ не задан"""
+    global _service
+    if _service is None and GROQ_API_KEY:
+        try:
+            _service = LLMService(GROQ_API_KEY, GROQ_BASE_URL)
+        except Exception as e:
+            logging.error(f"Ошибка инициализации Groq: {e}")
+    return _service
+
+
+async def close_llm():
+    global _service
+    if _service is not None:
+        await _service.close()
+        _service = None
@@ -0,0 +1,379 @@
+"""Нагрузочный тест бота против фейкового Bot API.
+
+Апдейты N симулированных пользователей подаются напрямую в dp.feed_update,
+запросы бота уходят в локальный FakeTelegramServer. Нужна отдельная
+тестовая база (DATABASE_URL) либо хранилище в памяти (STORAGE_BACKEND=memory).
+
+С --workers N апдейты идут через очередь updates_queue (как в режиме
+BOT_MODE=ingest/worker) и обрабатываются N воркерами QueueWorker.
+
+Пример:
+    DATABASE_URL=postgres://localhost/bot_test python loadtest.py --users 200 --latency 0.02
+    STORAGE_BACKEND=memory python loadtest.py --users 200
+    DATABASE_URL=postgres://localhost/bot_test python loadtest.py --users 200 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import Dict, List
+
+# Окружение по умолчанию задается до импорта main (он читает его при импорте)
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+os.environ.setdefault('ADMIN_IDS', '1')
+os.environ.setdefault('GROUP_ID', '-1001000000000')
+os.environ.setdefault('GROUP_LINK', 'https://t.me/+loadtest')
+
+import main  # noqa: E402
+from fake_telegram import FAKE_BOT_ID, FakeTelegramServer  # noqa: E402
+from work_queue import QueueWorker  # noqa: E402
+from aiogram import types  # noqa: E402
+
+SCENARIOS = ('application', 'quiz', 'bride')
+# ID симулированных пользователей начинаются с этого значения
+USER_ID_BASE = 7_000_000_000
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class LoadStats:
+    """Задержки обработки апдейтов по шагам сценариев"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, step: str, duration: float, error: bool = False):
+        self.latencies.setdefault(step, []).append(duration)
+        if error:
+            self.errors[step] = self.errors.get(step, 0) + 1
+
+    @property
+    def updates(self) -> int:
+        return sum(len(values) for values in self.latencies.values())
+
+    def summary(self) -> Dict[str, Dict]:
+        result = {}
+        for step, values in self.latencies.items():
+            result[step] = {
+                'updates': len(values),
+                'errors': self.errors.get(step, 0),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'max_ms': max(values) * 1000,
+            }
+        return result
+
+
+class LoadDriver:
+    """Генератор апдейтов для симулированных пользователей"""
+
+    def __init__(self, server: FakeTelegramServer, users: int,
+                 concurrency: int, seed: int, workers: int = 0,
+                 bride_players: int = 8):
+        self.server = server
+        self.bot = main.bot
+        self.dp = main.dp
+        self.admin_id = main.ADMIN_IDS[0]
+        self.group_id = main.GROUP_ID
+        self.user_ids = [USER_ID_BASE + i for i in range(users)]
+        self.bride_players = bride_players
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.random = random.Random(seed)
+        self.stats = LoadStats()
+        self._update_id = 0
+        self._message_ids: Dict[int, int] = {}
+
+        # Обработка через очередь: update_id -> ожидание результата от воркера
+        self.workers = [QueueWorker(main.db, self.dp, self.bot, worker_id=f"loadtest-{i}",
+                                    concurrency=max(concurrency // workers, 1),
+                                    poll_interval=0.05, on_processed=self._processed)
+                        for i in range(workers)]
+        self._results: Dict[int, asyncio.Future] = {}
+        if workers:
+            # Номера не пересекаются с апдейтами прошлых запусков в той же базе
+            self._update_id = int(time.time()) * 1000
+
+        state = server.state
+        state.add_user(self.admin_id, 'Admin')
+        state.set_member(self.group_id, self.admin_id, 'creator')
+        for index, user_id in enumerate(self.user_ids):
+            state.add_user(user_id, f"User{index}", f"user{index}")
+
+    def _user(self, user_id: int) -> Dict:
+        return self.server.state.user(user_id)
+
+    def _next_message_id(self, chat_id: int) -> int:
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        return message_id
+
+    def _update(self, **payload) -> types.Update:
+        self._update_id += 1
+        return types.Update.model_validate({'update_id': self._update_id, **payload},
+                                           context={'bot': self.bot})
+
+    def message(self, user_id: int, text: str, chat_id: int = None,
+                reply_to_text: str = None) -> types.Update:
+        chat_id = chat_id or user_id
+        message = {
+            'message_id': self._next_message_id(chat_id),
+            'date': int(time.time()),
+            'chat': self.server.state.chat(chat_id),
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if reply_to_text is not None:
+            message['reply_to_message'] = {
+                'message_id': self._next_message_id(chat_id),
+                'date': int(time.time()),
+                'chat': self.server.state.chat(chat_id),
+                'from': {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake Bot'},
+                'text': reply_to_text,
+            }
+        return self._update(message=message)
+
+    def game_message(self, user_id: int, text: str, prompt: str) -> types.Update:
+        """Сообщение игрока в ответ на подсказку бота.
+
+        Ответы админов в личке перехватывает обработчик уведомлений, поэтому
+        админ-участник (ведущий тоже записывается в игру) пишет без reply.
+        """
+        if user_id in main.ADMIN_IDS:
+            return self.message(user_id, text)
+        return self.message(user_id, text, reply_to_text=prompt)
+
+    def callback(self, user_id: int, data: str) -> types.Update:
+        return self._update(callback_query={
+            'id': str(self._update_id + 1),
+            'from': self._user(user_id),
+            'chat_instance': 'loadtest',
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': self.server.state.chat(self.group_id),
+                'from': {'id': FAKE_BOT_ID, 'is_bot': True, 'first_name': 'Fake Bot'},
+                'text': 'loadtest',
+            },
+        })
+
+    def chat_member(self, user_id: int, old_status: str, new_status: str) -> types.Update:
+        user = self._user(user_id)
+        return self._update(chat_member={
+            'chat': self.server.state.chat(self.group_id),
+            'from': user,
+            'date': int(time.time()),
+            'old_chat_member': {'status': old_status, 'user': user},
+            'new_chat_member': {'status': new_status, 'user': user},
+        })
+
+    async def feed(self, step: str, update: types.Update):
+        async with self.semaphore:
+            started = time.perf_counter()
+            error = False
+            try:
+                if self.workers:
+                    error = await self._feed_queue(update)
+                else:
+                    await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                error = True
+                logging.debug(f"Ошибка обработки апдейта ({step}): {e!r}")
+            self.stats.record(step, time.perf_counter() - started, error)
+
+    async def _feed_queue(self, update: types.Update) -> bool:
+        result = asyncio.get_running_loop().create_future()
+        self._results[update.update_id] = result
+        await main.ingest.enqueue([update])
+        for worker in self.workers:
+            worker.wake()
+        return await result
+
+    def _processed(self, update_id: int, error: bool):
+        result = self._results.pop(update_id, None)
+        if result is not None and not result.done():
+            result.set_result(error)
+
+    async def feed_all(self, step: str, updates: List[types.Update]):
+        await asyncio.gather(*(self.feed(step, update) for update in updates))
+
+    # Сценарии
+
+    async def run_application(self):
+        """Заявка на вступление: /start -> роль -> подтверждение возраста"""
+        users = self.user_ids
+        for user_id in users:
+            self.server.state.set_member(self.group_id, user_id, 'left')
+        await self.feed_all('application:start', [self.message(u, '/start') for u in users])
+        await self.feed_all('application:role',
+                            [self.message(u, f"Роль{u % 1000}") for u in users])
+        await self.feed_all('application:age', [self.message(u, '18') for u in users])
+
+    async def run_quiz(self):
+        """Викторина: админ создает вопрос, все пользователи отвечают"""
+        for user_id in self.user_ids:
+            self.server.state.set_member(self.group_id, user_id, 'member')
+        admin = self.admin_id
+        for step, text in (('quiz:create', 'создать викторину'),
+                           ('quiz:create', 'Нагрузочный вопрос?'),
+                           ('quiz:create', 'Да\nНет\nНе знаю'),
+                           ('quiz:create', '1')):
+            await self.feed(step, self.message(admin, text))
+        quiz_id = max(main.quiz_data)
+        await self.feed_all('quiz:answer', [
+            self.callback(u, f"quiz_{quiz_id}_{self.random.randrange(3)}")
+            for u in self.user_ids])
+        await self.feed('quiz:finish', self.message(admin, f"завершить викторину {quiz_id}"))
+
+    async def run_bride(self):
+        """Игра "Жених": набор, запуск, раунды вопросов и исключений"""
+        players = self.user_ids[:max(self.bride_players, 3)]
+        for user_id in players:
+            self.server.state.set_member(self.group_id, user_id, 'member')
+        admin = self.admin_id
+        await self.feed('bride:announce', self.message(admin, 'начать жених'))
+        session = await main.db.get_active_bride_session(self.group_id)
+        if not session:
+            logging.error("Не удалось создать сессию набора в игру")
+            return
+        await self.feed_all('bride:join', [
+            self.callback(u, f"bride_join_{session['session_id']}") for u in players])
+        await self.feed('bride:launch', self.message(admin, 'запустить жених'))
+
+        game = await main.db.get_active_bride_game(self.group_id)
+        if not game or game['status'] != 'started':
+            logging.error("Игра не запустилась")
+            return
+        round_number = 0
+        while True:
+            participants = await main.db.get_bride_participants(game['game_id'])
+            bride = next(p for p in participants if p['is_bride'])
+            active = [p for p in participants if not p['is_bride'] and not p['is_out']]
+            if len(active) <= 1:
+                break
+            round_number += 1
+            await self.feed('bride:question', self.game_message(
+                bride['user_id'], f"Вопрос раунда {round_number}?",
+                "Напишите первый вопрос."))
+            await self.feed_all('bride:answer', [
+                self.game_message(p['user_id'], f"Ответ {p['number']}",
+                                  "Вопрос от жениха! Отправьте свой ответ.")
+                for p in active])
+            choice = self.random.choice(active)['number']
+            await self.feed('bride:eliminate', self.game_message(
+                bride['user_id'], str(choice),
+                "Напишите число того участника, чей ответ вам понравился меньше всего."))
+            game = await main.db.get_bride_game(game['game_id'])
+            if not game or game['status'] == 'finished':
+                break
+        if game and game['status'] != 'finished':
+            await self.feed('bride:finish', self.message(admin, 'завершить жених'))
+
+
+async def run(args) -> Dict:
+    server = FakeTelegramServer(latency=args.latency, jitter=args.jitter,
+                                flood_rate=args.flood_rate, seed=args.seed)
+    await server.start()
+    main.bot.session.api = server.api_server()
+    if not await main.db.connect():
+        await server.stop()
+        raise SystemExit("Нет подключения к тестовой базе (DATABASE_URL)")
+    await main.tenants.load()
+    await main.load_data_from_db()
+
+    driver = LoadDriver(server, args.users, args.concurrency, args.seed, args.workers,
+                        args.bride_players)
+    workers = [asyncio.create_task(worker.run()) for worker in driver.workers]
+    scenarios = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    server.reset_counters()
+    started = time.perf_counter()
+    try:
+        for scenario in scenarios:
+            await getattr(driver, f"run_{scenario}")()
+    finally:
+        elapsed = time.perf_counter() - started
+        for worker in driver.workers:
+            worker.stop()
+        await asyncio.gather(*workers)
+        await main.notifier.close()
+        await main.recruitments.close_all()
+        await main.bot.session.close()
+        await main.db.close()
+        await server.stop()
+
+    updates = driver.stats.updates
+    all_latencies = [v for values in driver.stats.latencies.values() for v in values]
+    return {
+        'users': args.users,
+        'workers': args.workers,
+        'scenarios': list(scenarios),
+        'updates': updates,
+        'elapsed_s': elapsed,
+        'updates_per_s': updates / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(all_latencies, 50) * 1000,
+        'p99_ms': percentile(all_latencies, 99) * 1000,
+        'api_calls': server.total_calls,
+        'api_calls_per_update': server.total_calls / updates if updates else 0.0,
+        'flood_errors': server.flood_errors,
+        'api_methods': dict(server.calls.most_common()),
+        'steps': driver.stats.summary(),
+    }
+
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"Пользователей: {report['users']}, сценарии: {', '.join(report['scenarios'])}"
+        + (f", воркеров очереди: {report['workers']}" if report['workers'] else ""),
+        f"Апдейтов: {report['updates']} за {report['elapsed_s']:.2f} с "
+        f"({report['updates_per_s']:.1f} апд/с)",
+        f"Задержка: p50 {report['p50_ms']:.1f} мс, p99 {report['p99_ms']:.1f} мс",
+        f"Запросов к API: {report['api_calls']} "
+        f"({report['api_calls_per_update']:.2f} на апдейт, 429: {report['flood_errors']})",
+        "",
+        f"{'шаг':<22}{'апд':>7}{'ошибки':>8}{'p50 мс':>10}{'p99 мс':>10}{'max мс':>10}",
+    ]
+    for step, row in report['steps'].items():
+        lines.append(f"{step:<22}{row['updates']:>7}{row['errors']:>8}"
+                     f"{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    lines.append("")
+    lines.append("Методы API: " + ", ".join(
+        f"{method}={count}" for method, count in report['api_methods'].items()))
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help="сколько апдейтов обрабатывается одновременно")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="задержка ответа фейкового API, с")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--flood-rate', type=float, default=0.0,
+                        help="доля ответов 429 Too Many Requests")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="обрабатывать апдейты через updates_queue этим числом воркеров")
+    parser.add_argument('--bride-players', type=int, default=8,
+                        help="сколько пользователей вступает в набор игры \"Жених\"")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="отчет в JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json
+          else format_report(report))
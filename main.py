@@ -1,6 +1,11 @@
+import time
+
+# Отсчет времени запуска: импорт aiogram занимает заметную его часть
+_process_started = time.perf_counter()
+
 import logging
 import asyncio
-from datetime import datetime
+import html
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.enums import ParseMode, ChatType
 from aiogram.fsm.context import FSMContext
@@ -8,14 +13,33 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import ChatPermissions, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 import random
-import requests
 import os
+import signal
 from functools import lru_cache
-import json
-from groq import Groq
+from typing import Optional
 
 # Импортируем базу данных
-from db import db
+from db import CACHE_CHANNEL, QUEUE_CHANNEL, db
+from scheduler import JobScheduler
+from retention import RetentionManager, format_table_sizes
+from admin_notices import AdminNotifier, REPLYABLE_KINDS, parse_legacy_notice_user_id
+from members import MemberDirectory
+from roles import RoleRegistry, normalize_role
+from waitlist import Waitlist
+from recruitment import RecruitmentBoard, recruitment_keyboard, recruitment_text
+from metrics import (InstrumentedSession, StartupTimer, monitor_loop_lag,
+                     register_job_gauges, register_pool_gauges,
+                     register_startup_gauges, setup_dispatcher_metrics,
+                     start_metrics_server)
+from recorder import RECORD_UPDATES_FILE, UpdateRecorder
+from llm import close_llm
+from invalidation import InvalidationBus
+from leader import LEADER_ELECTION, LeaderLease, UpdateOffsetTracker
+from questions import QuestionPool
+from tenants import Tenant, TenantMiddleware, TenantRegistry
+from work_queue import BOT_MODE, DatabaseFSMStorage, QueueWorker, UpdateIngest
+from watchdog import (LOOP_SLOW_CALLBACK_MS, LOOP_WATCHDOG_MS, PROFILE_MODES,
+                      LoopWatchdog, SamplingProfiler, enable_slow_callback_log)
 
 # Базовые настройки с оптимизированным логированием
 logging.basicConfig(level=logging.INFO,
@@ -33,20 +57,74 @@ LIST_ADMIN_ID = tuple(
     int(id) for id in os.environ.get('LIST_ADMIN_ID', '').split(
         ',')) if os.environ.get('LIST_ADMIN_ID') else ()
 
-# Инициализация Groq клиента (используем бесплатный API ключ если доступен)
-GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
-groq_client = None
-if GROQ_API_KEY:
-    try:
-        groq_client = Groq(api_key=GROQ_API_KEY)
-    except Exception as e:
-        logging.error(f"Ошибка инициализации Groq: {e}")
-
 # Оптимизированная инициализация бота
 from aiogram.client.default import DefaultBotProperties
 
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
+bot = Bot(token=TOKEN,
+          session=InstrumentedSession(),
+          default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# Воркеры очереди (BOT_MODE=worker) продолжают диалоги друг друга: FSM в базе
+dp = Dispatcher(storage=DatabaseFSMStorage(db) if BOT_MODE == 'worker' else MemoryStorage())
+ALLOWED_UPDATES = ["message", "chat_member", "callback_query"]
+
+# Метрики хендлеров, Bot API, пула БД и цикла событий (порт /metrics задается METRICS_PORT)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+# Таймаут проверки БД запросом SELECT 1 в /healthz, с
+HEALTH_CHECK_TIMEOUT = float(os.environ.get('HEALTH_CHECK_TIMEOUT', '2'))
+setup_dispatcher_metrics(dp)
+
+# Запись входящих апдейтов для replay.py (файл задается RECORD_UPDATES_FILE)
+recorder = None
+if RECORD_UPDATES_FILE:
+    recorder = UpdateRecorder(RECORD_UPDATES_FILE, keep_ids=ADMIN_IDS + (GROUP_ID,))
+    dp.update.outer_middleware(recorder)
+
+# Сообщества из таблицы groups; группа из переменных окружения - сообщество
+# по умолчанию. Хендлеры получают настройки своей группы в параметре tenant
+tenants = TenantRegistry(db, Tenant(GROUP_ID, GROUP_LINK, ADMIN_IDS, LIST_ADMIN_ID))
+dp.update.outer_middleware(TenantMiddleware(tenants))
+
+# Активный/резервный экземпляры: polling ведет только держатель аренды в Postgres,
+# резервный держит подключение к БД и теплые кэши и перехватывает polling
+leader = LeaderLease(db, bot.id)
+update_offsets = UpdateOffsetTracker()
+dp.update.outer_middleware(update_offsets)
+
+# Режим с отдельными приемом и обработкой: BOT_MODE=ingest пишет апдейты
+# в updates_queue, процессы BOT_MODE=worker обрабатывают их параллельно
+ingest = UpdateIngest(db, bot, ALLOWED_UPDATES, on_received=update_offsets.seen)
+
+# Сброс кэшей в памяти по изменениям из других процессов бота (LISTEN/NOTIFY)
+invalidations = InvalidationBus(db, CACHE_CHANNEL)
+
+# Планировщик фоновых задач (очистка и обслуживание БД)
+scheduler = JobScheduler(db)
+retention = RetentionManager(db)
+
+# Уведомления админам: параллельная рассылка, индекс для ответов и синхронизация
+notifier = AdminNotifier(bot, db, ADMIN_IDS)
+
+# Роли, подписи и эмодзи пользователей в памяти (запись - через справочник)
+member_directory = MemberDirectory(db)
+
+# Занятые и освободившиеся роли: проверка занятости без запросов к БД
+role_registry = RoleRegistry(db)
+
+# Очередь ожидания места и число участников групп (по апдейтам chat_member)
+waitlist = Waitlist(db, bot)
+
+# Шаги запуска (импорт, подключение к БД, getMe, загрузка состояния, прогрев)
+startup = StartupTimer(_process_started)
+
+register_pool_gauges(db)
+register_job_gauges(scheduler)
+register_startup_gauges(startup)
+
+# Профилирование по команде админа ("профиль старт" / "профиль стоп")
+profiler = SamplingProfiler()
+
+# Подсказки вопросов для жениха (генерируются LLM заранее)
+question_pool = QuestionPool(db)
 
 # Временное хранение для сообщений (антиспам)
 message_counts = {}
@@ -97,9 +175,9 @@ class QuizCreation(StatesGroup):
 
 
 # Оптимизированная проверка членства
-async def is_member(user_id: int) -> bool:
+async def is_member(user_id: int, group_id: int) -> bool:
     try:
-        member = await bot.get_chat_member(GROUP_ID, user_id)
+        member = await bot.get_chat_member(group_id, user_id)
         return member.status in {"member", "administrator", "creator"}
     except Exception:
         return False
@@ -113,8 +191,8 @@ def check_message_limit(user_id: int) -> bool:
 
 
 # Функция для назначения эмодзи с автоматическим сохранением
-async def assign_emoji_to_user(user_id: int) -> str:
-    """Назначает эмодзи пользователю и сохраняет в БД"""
+async def assign_emoji_to_user(group_id: int, user_id: int) -> str:
+    """Назначает эмодзи пользователю в сообществе и сохраняет в БД"""
     emojis = [
         "⭐️", "🌟", "💫", "⚡️", "🔥", "❤️", "💞", "💕", "❣️", "💌", "🌈", "✨", "🎯",
         "🎪", "🎨", "🎭", "🎪", "🎢", "🎡", "🎠", "🎪", "🌸", "🌺", "🌷", "🌹", "🌻", "🌼",
@@ -126,17 +204,17 @@ async def assign_emoji_to_user(user_id: int) -> str:
     ]
 
     # Проверяем, есть ли уже эмодзи у пользователя
-    existing_emoji = await db.get_emoji(user_id)
+    existing_emoji = await member_directory.get_emoji(group_id, user_id)
     if existing_emoji:
         return existing_emoji
 
     # Получаем уже используемые эмодзи
-    used_emojis = await db.get_used_emojis()
+    used_emojis = await member_directory.get_used_emojis(group_id)
     available_emojis = [e for e in emojis if e not in used_emojis]
 
     if available_emojis:
         selected_emoji = random.choice(available_emojis)
-        await db.save_emoji(user_id, selected_emoji)
+        await member_directory.save_emoji(group_id, user_id, selected_emoji)
         return selected_emoji
 
     # Если все эмодзи заняты, возвращаем дефолтный
@@ -159,8 +237,8 @@ async def quiz_callback_handler(callback: CallbackQuery):
                                   show_alert=True)
             return
 
-        # Проверяем, что пользователь участник группы
-        if not await is_member(user_id):
+        # Проверяем, что пользователь участник группы викторины
+        if not await is_member(user_id, quiz['chat_id']):
             await callback.answer(
                 "Только участники группы могут участвовать в викторине.",
                 show_alert=True)
@@ -208,25 +286,24 @@ async def delete_pin_messages(message: types.Message):
 
 # Handlers
 @dp.message(F.text.casefold() == "/start")
-async def start_handler(message: types.Message, state: FSMContext):
+async def start_handler(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     user_id = message.from_user.id
-    if not await is_member(user_id) and not check_message_limit(user_id):
+    if not await is_member(user_id, tenant.group_id) and not check_message_limit(user_id):
         await message.answer(
             "Вы исчерпали лимит сообщений. Вступите в группу, чтобы продолжить общение с ботом. Если это баг, напишите <a href='https://t.me/alren15'>администратору</a>."
         )
         return
 
-    member = await bot.get_chat_member(GROUP_ID, user_id)
+    member = await bot.get_chat_member(tenant.group_id, user_id)
     if member.status in {"member", "administrator", "creator"}:
         await message.answer(
             " <b>Вы уже являетесь участником группы</b>\n\n🎮 Используйте меню для навигации:",
             reply_markup=get_menu())
     else:
         # Проверяем количество участников в группе
-        chat_members = await bot.get_chat_member_count(GROUP_ID)
-        if chat_members >= 50:
+        if await waitlist.is_full(tenant.group_id):
             await message.answer(
                 "<b> В группе сейчас максимальное количество участников.</b>\n\n Оставьте заявку и вас примут при освобождении места."
             )
@@ -238,11 +315,52 @@ async def start_handler(message: types.Message, state: FSMContext):
         await state.set_state(Form.role)
 
 
+def format_roles(roles) -> str:
+    return ", ".join(f"<b>{html.escape(role)}</b>" for role in roles)
+
+
+def role_status(group_id: int, role: str, user_id: Optional[int] = None) -> str:
+    """Строка для админов: свободна ли роль из заявки в сообществе"""
+    holder = role_registry.holder(group_id, role)
+    if holder is None:
+        return "свободна"
+    if holder == user_id:
+        return "уже за этим пользователем"
+    return f"занята (<code>{holder}</code>)"
+
+
 @dp.message(Form.role)
-async def role_handler(message: types.Message, state: FSMContext):
+async def role_handler(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
-    await state.update_data(role=message.text.strip())
+    role = message.text.strip()
+    try:
+        check = await role_registry.check(tenant.group_id, role, message.from_user.id)
+    except Exception as e:
+        # Без реестра заявку принимаем: занятость проверят админы
+        logging.error(f"Ошибка проверки роли: {e}")
+        check = None
+
+    if check is not None and check.taken:
+        text = f"Роль <b>{html.escape(check.role)}</b> уже занята. Выберите другую роль."
+        free = check.similar_free()
+        if free:
+            text += f"\n\nСвободные похожие роли: {format_roles(free)}"
+        await message.answer(text)
+        return
+
+    # Похожая роль занята: возможно, опечатка. Повторная отправка подтверждает роль
+    key = normalize_role(role)
+    similar = check.similar_taken() if check is not None else []
+    if similar and (await state.get_data()).get('role_confirm') != key:
+        await state.update_data(role_confirm=key)
+        await message.answer(
+            f"Похожие роли уже заняты: {format_roles(similar)}\n\n"
+            f"Проверьте написание. Если вам нужна именно роль <b>{html.escape(role)}</b>, "
+            f"отправьте ее еще раз.")
+        return
+
+    await state.update_data(role=role, role_confirm=None)
     await message.answer('''
 <b>Подтвердите свой возраст одним из способов:</b>
 
@@ -255,7 +373,8 @@ async def role_handler(message: types.Message, state: FSMContext):
 
 
 @dp.message(Form.age_verify, F.text)
-async def age_verify_text_handler(message: types.Message, state: FSMContext):
+async def age_verify_text_handler(message: types.Message, state: FSMContext,
+                                  tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     user_id = message.from_user.id
@@ -263,13 +382,16 @@ async def age_verify_text_handler(message: types.Message, state: FSMContext):
     role = data.get('role')
 
     # Сохраняем данные пользователя в БД
-    await db.save_user_data(user_id, role=role)
+    await member_directory.save_user_data(tenant.group_id, user_id, role=role)
 
     # Сохраняем заявку
-    await db.save_application(user_id, role)
+    await db.save_application(user_id, role, tenant.group_id)
+    # В заполненную группу - через очередь ожидания
+    if await waitlist.is_full(tenant.group_id):
+        await db.join_waitlist(user_id, role, tenant.group_id)
 
     await message.answer(
-        f' Перейдите по <a href="{GROUP_LINK}"><b>ссылке (нажать)</b></a>. Ваша заявка будет рассмотрена в ближайшее время.\n\n Для повторного заполнения - /start',
+        f' Перейдите по <a href="{tenant.group_link}"><b>ссылке (нажать)</b></a>. Ваша заявка будет рассмотрена в ближайшее время.\n\n Для повторного заполнения - /start',
         disable_web_page_preview=True,
         reply_markup=get_menu())
 
@@ -279,16 +401,18 @@ async def age_verify_text_handler(message: types.Message, state: FSMContext):
         f"#️⃣ ID: <code>{user_id}</code>\n"
         f"👤 Пользователь: <a href='tg://user?id={user_id}'>{message.from_user.full_name}{username}</a>\n"
         f"📌 Роль: <b>{role}</b>\n"
+        f"🎭 Статус роли: {role_status(tenant.group_id, role, user_id)}\n"
         f"Подтверждение: {message.text}\n\n")
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(admin_id, admin_message)
+    await notifier.publish(admin_message, user_id, 'application',
+                           admin_ids=tenant.admin_ids)
 
     await state.clear()
 
 
 @dp.message(Form.age_verify)
-async def age_verify_any_handler(message: types.Message, state: FSMContext):
+async def age_verify_any_handler(message: types.Message, state: FSMContext,
+                                 tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     user_id = message.from_user.id
@@ -296,11 +420,14 @@ async def age_verify_any_handler(message: types.Message, state: FSMContext):
     role = data.get('role')
 
     # Сохраняем роль и заявку
-    await db.save_user_data(user_id, role=role)
-    await db.save_pending_application(user_id, role)
+    await member_directory.save_user_data(tenant.group_id, user_id, role=role)
+    await db.save_pending_application(user_id, role, tenant.group_id)
+    # В заполненную группу - через очередь ожидания
+    if await waitlist.is_full(tenant.group_id):
+        await db.join_waitlist(user_id, role, tenant.group_id)
 
     await message.answer(
-        f' Перейдите по <a href="{GROUP_LINK}"><b>ссылке (нажать)</b></a>. Ваша заявка будет рассмотрена в ближайшее время. <b>Не удаляйте чат.</b>\n\n Для повторного заполнения - /start',
+        f' Перейдите по <a href="{tenant.group_link}"><b>ссылке (нажать)</b></a>. Ваша заявка будет рассмотрена в ближайшее время. <b>Не удаляйте чат.</b>\n\n Для повторного заполнения - /start',
         disable_web_page_preview=True,
         reply_markup=get_menu())
 
@@ -309,21 +436,20 @@ async def age_verify_any_handler(message: types.Message, state: FSMContext):
         f"<b>Заявка на вступление!</b>\n\n"
         f"#️⃣ ID: <code>{user_id}</code>\n"
         f"👤 От: <a href='tg://user?id={user_id}'>{message.from_user.full_name}{username}</a>\n"
-        f"📌 Роль: <b>{role}</b>")
+        f"📌 Роль: <b>{role}</b>\n"
+        f"🎭 Статус роли: {role_status(tenant.group_id, role, user_id)}")
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(admin_id, admin_message)
-        await bot.forward_message(admin_id, message.chat.id,
-                                  message.message_id)
+    await notifier.publish(admin_message, user_id, 'application',
+                           media_from=message, admin_ids=tenant.admin_ids)
 
     await state.clear()
 
 
 @dp.message(
     lambda message: message.text and message.text.lower().startswith("найди "))
-async def photo(message: types.Message):
+async def photo(message: types.Message, tenant: Tenant):
     user_id = message.from_user.id
-    if not await is_member(user_id) and not check_message_limit(user_id):
+    if not await is_member(user_id, tenant.group_id) and not check_message_limit(user_id):
         await message.answer("Извините, ничего не нашлось.")
         return
 
@@ -397,7 +523,7 @@ async def photo(message: types.Message):
 
 
 @dp.message(F.text.lower().startswith("эмодзи"))
-async def set_custom_emoji(message: types.Message):
+async def set_custom_emoji(message: types.Message, tenant: Tenant):
     if message.chat.type not in {ChatType.GROUP, ChatType.SUPERGROUP}:
         return
 
@@ -410,7 +536,7 @@ async def set_custom_emoji(message: types.Message):
         return
 
     # Сохраняем эмодзи в БД
-    await db.save_emoji(user_id, emoji)
+    await member_directory.save_emoji(tenant.group_id, user_id, emoji)
     await message.reply(f"Ваш персональный эмодзи установлен на {emoji}")
 
 
@@ -442,11 +568,11 @@ async def kiss_handler(message: types.Message):
 
 
 @dp.message(F.text == "Рест")
-async def request_rest(message: types.Message, state: FSMContext):
+async def request_rest(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     user_id = message.from_user.id
-    if not await is_member(user_id):
+    if not await is_member(user_id, tenant.group_id):
         await message.answer("Вы не являетесь участником.",
                              reply_markup=get_menu())
         return
@@ -468,7 +594,7 @@ async def rest_reason(message: types.Message, state: FSMContext):
 
 
 @dp.message(Form.duration)
-async def rest_duration(message: types.Message, state: FSMContext):
+async def rest_duration(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     if message.text == "Назад":
@@ -479,7 +605,7 @@ async def rest_duration(message: types.Message, state: FSMContext):
 
     user_id = message.from_user.id
     data = await state.get_data()
-    role = await bot.get_chat_member(GROUP_ID, user_id)
+    role = await bot.get_chat_member(tenant.group_id, user_id)
     username = f" (@{message.from_user.username})" if message.from_user.username else ""
 
     admin_message = f'''<b>Заявка на рест</b>
@@ -489,8 +615,7 @@ async def rest_duration(message: types.Message, state: FSMContext):
 ⌛️ Срок: {message.text}
 Причина: {data['reason']}'''
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(admin_id, admin_message)
+    await notifier.publish(admin_message, user_id, 'rest', admin_ids=tenant.admin_ids)
 
     await message.answer(
         "Заявка на рест отправлена. Ожидайте ответа от администраторов.",
@@ -499,11 +624,11 @@ async def rest_duration(message: types.Message, state: FSMContext):
 
 
 @dp.message(F.text == "Жалоба")
-async def complaint(message: types.Message, state: FSMContext):
+async def complaint(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     user_id = message.from_user.id
-    if not await is_member(user_id):
+    if not await is_member(user_id, tenant.group_id):
         await message.answer("Вы не являетесь участником.",
                              reply_markup=get_menu())
         return
@@ -513,7 +638,7 @@ async def complaint(message: types.Message, state: FSMContext):
 
 
 @dp.message(Form.complaint)
-async def handle_complaint(message: types.Message, state: FSMContext):
+async def handle_complaint(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     if message.text == "Назад":
@@ -523,10 +648,9 @@ async def handle_complaint(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     username = f" (@{message.from_user.username})" if message.from_user.username else ""
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(admin_id, f'''🔔 <b>Новая жалоба:</b>
+    await notifier.publish(f'''🔔 <b>Новая жалоба:</b>
 
-{message.text}''')
+{message.text}''', user_id, 'complaint', admin_ids=tenant.admin_ids)
 
     await message.answer("Жалоба отправлена администраторам. Ожидайте ответ.",
                          reply_markup=get_menu())
@@ -539,11 +663,11 @@ class CantJoinState(StatesGroup):
 
 
 @dp.message(F.text == "Не могу влиться")
-async def cant_join_handler(message: types.Message, state: FSMContext):
+async def cant_join_handler(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.chat.type != ChatType.PRIVATE:
         return
     user_id = message.from_user.id
-    if not await is_member(user_id):
+    if not await is_member(user_id, tenant.group_id):
         await message.answer("Вы не являетесь участником.",
                              reply_markup=get_menu())
         return
@@ -572,7 +696,7 @@ async def handle_admin_choice(message: types.Message, state: FSMContext):
 
 
 @dp.message(CantJoinState.waiting_for_info)
-async def handle_user_info(message: types.Message, state: FSMContext):
+async def handle_user_info(message: types.Message, state: FSMContext, tenant: Tenant):
     if message.text == "Назад":
         await back_to_menu(message, state)
         return
@@ -584,7 +708,7 @@ async def handle_user_info(message: types.Message, state: FSMContext):
     username = f" (@{message.from_user.username})" if message.from_user.username else ""
 
     # Получаем роль пользователя из БД
-    user_data_db = await db.get_user_data(user_id)
+    user_data_db = await member_directory.get_user_data(tenant.group_id, user_id)
     user_role = user_data_db.get("custom_title", "неизвестно")
 
     admin_message = f'''<b>Не может влиться!</b>\n
@@ -593,8 +717,7 @@ async def handle_user_info(message: types.Message, state: FSMContext):
 ⭐️ Фаворит: <b>{admin_choice}</b>
 О себе: {message.text}'''
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(admin_id, admin_message)
+    await notifier.publish(admin_message, user_id, 'cant_join', admin_ids=tenant.admin_ids)
 
     await message.answer("Ваша заявка отправлена.", reply_markup=get_menu())
     await state.clear()
@@ -608,11 +731,28 @@ async def back_to_menu(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+async def offer_waitlist_seat(tenant: Tenant, chat_id: int):
+    """Участник вышел: место получает первая заявка из очереди ожидания"""
+    try:
+        if not await waitlist.left(chat_id):
+            return
+        row = await waitlist.offer_seat(chat_id, tenant.group_link)
+        if row is None:
+            return
+        admin_message = (
+            f"<b>Место предложено из очереди ожидания</b>\n\n"
+            f"#️⃣ ID: <code>{row['user_id']}</code>\n"
+            f"👤 Пользователь: <a href='tg://user?id={row['user_id']}'>{row['user_id']}</a>\n"
+            f"📌 Роль: <b>{html.escape(row['role'] or 'неизвестно')}</b>")
+        await notifier.publish(admin_message, row['user_id'], 'waitlist',
+                               admin_ids=tenant.admin_ids)
+    except Exception as e:
+        logging.error(f"Ошибка очереди ожидания: {e}")
+
+
 @dp.chat_member()
-async def chat_member_handler(update: types.ChatMemberUpdated):
+async def chat_member_handler(update: types.ChatMemberUpdated, tenant: Tenant):
     chat_id = update.chat.id
-    if chat_id != GROUP_ID:
-        return
 
     old_status = update.old_chat_member.status if update.old_chat_member else None
     new_status = update.new_chat_member.status if update.new_chat_member else None
@@ -622,12 +762,21 @@ async def chat_member_handler(update: types.ChatMemberUpdated):
         f"Обновление участника: {old_status} -> {new_status} для пользователя {user_id}"
     )
 
+    # Записываем историю пребывания в группе
+    if new_status in {"left", "kicked"} and old_status not in {"left", "kicked"}:
+        await db.record_user_leave(tenant.group_id, user_id)
+        await offer_waitlist_seat(tenant, chat_id)
+    elif new_status in {"member", "administrator", "restricted"} and old_status in {
+            None, "left", "kicked"}:
+        await db.record_user_join(tenant.group_id, user_id)
+        await waitlist.joined(chat_id, user_id)
+
     # Проверяем выход участника
     if (old_status == "member"
             and new_status == "left") or (old_status == "administrator"
                                           and new_status == "left"):
         # Получаем данные из БД
-        user_data_db = await db.get_user_data(user_id)
+        user_data_db = await member_directory.get_user_data(tenant.group_id, user_id)
         custom_title = user_data_db.get("custom_title", "Неизвестно")
 
         if custom_title != "Неизвестно":
@@ -637,27 +786,25 @@ async def chat_member_handler(update: types.ChatMemberUpdated):
 
             admin_message = f'''<b>Участник покинул группу</b>\n
 😢 Пользователь: <a href='tg://user?id={user_id}'>{update.new_chat_member.user.full_name}{username}</a>\n🎭 Роль: <b>{custom_title}</b>'''
-            for admin_id in ADMIN_IDS:
-                await bot.send_message(admin_id, admin_message)
+            await notifier.publish(admin_message, user_id, 'leave',
+                                   admin_ids=tenant.admin_ids)
 
             # Send notification to LIST_ADMIN_ID
-            for admin_id in LIST_ADMIN_ID:
+            for admin_id in tenant.list_admin_ids:
                 await bot.send_message(
                     admin_id, f"Освободилась роль: <b>{custom_title}</b>")
 
-            # Записываем историю выхода
-            await db.save_join_history(user_id, None, datetime.now())
-
-            # Удаляем данные пользователя из БД
-            await db.remove_emoji(user_id)
-            await db.remove_user_data(user_id)
+            # Роль становится свободной, данные пользователя удаляем из БД
+            await role_registry.release(tenant.group_id, user_id)
+            await member_directory.remove_emoji(tenant.group_id, user_id)
+            await member_directory.remove_user_data(tenant.group_id, user_id)
             return
 
     # Обработка вступления в группу
     if new_status == "member" and not update.new_chat_member.user.is_bot:
         try:
             # Получаем данные пользователя из БД
-            user_data_db = await db.get_user_data(user_id)
+            user_data_db = await member_directory.get_user_data(tenant.group_id, user_id)
             role = user_data_db.get("role")
 
             if not role:
@@ -669,7 +816,7 @@ async def chat_member_handler(update: types.ChatMemberUpdated):
             if not bot_member.can_promote_members:
                 logging.error(
                     f"Бот не имеет прав администратора в группе {chat_id}")
-                for admin_id in ADMIN_IDS:
+                for admin_id in tenant.admin_ids:
                     await bot.send_message(
                         admin_id,
                         f"Бот не имеет необходимых прав администратора в группе {chat_id}"
@@ -688,7 +835,15 @@ async def chat_member_handler(update: types.ChatMemberUpdated):
                 chat_id, user_id, role)
 
             # Сохраняем custom_title в БД
-            await db.save_user_data(user_id, custom_title=role)
+            await member_directory.save_user_data(tenant.group_id, user_id, custom_title=role)
+            # Роль занимается в реестре (у другого участника ее мог назначить админ)
+            if not await role_registry.take(tenant.group_id, role, user_id):
+                logging.warning(f"Роль {role} уже занята, назначена пользователю {user_id}")
+                for admin_id in tenant.admin_ids:
+                    await bot.send_message(
+                        admin_id,
+                        f"Роль <b>{html.escape(role)}</b> назначена {update.new_chat_member.user.full_name}, "
+                        f"но уже занята другим участником")
 
             # Получаем всех админов и назначаем им эмодзи
             members = await bot.get_chat_administrators(chat_id)
@@ -698,7 +853,7 @@ async def chat_member_handler(update: types.ChatMemberUpdated):
             for member in members:
                 if not member.user.is_bot:
                     member_id = member.user.id
-                    emoji = await assign_emoji_to_user(member_id)
+                    emoji = await assign_emoji_to_user(tenant.group_id, member_id)
                     tag = f"<a href='tg://user?id={member_id}'>{emoji}</a>"
                     tags.append(tag)
 
@@ -724,18 +879,18 @@ async def chat_member_handler(update: types.ChatMemberUpdated):
                                    reply_markup=get_menu())
 
             # Send notification to LIST_ADMIN_ID
-            for admin_id in LIST_ADMIN_ID:
+            for admin_id in tenant.list_admin_ids:
                 await bot.send_message(admin_id, f"Занята роль: {role}")
         except Exception as e:
             logging.error(f"Ошибка при назначении роли: {e}")
-            for admin_id in ADMIN_IDS:
+            for admin_id in tenant.admin_ids:
                 await bot.send_message(
                     admin_id,
                     f"Ошибка при назначении роли пользователю {update.new_chat_member.user.full_name}: {str(e)}"
                 )
     elif update.new_chat_member.status in {"left", "kicked"}:
         # Получаем данные изБД
-        user_data_db = await db.get_user_data(user_id)
+        user_data_db = await member_directory.get_user_data(tenant.group_id, user_id)
         custom_title = user_data_db.get("custom_title", "Неизвестно")
 
         if custom_title != "Неизвестно":
@@ -747,68 +902,133 @@ async def chat_member_handler(update: types.ChatMemberUpdated):
             admin_message = f'''<b>Участник покинул группу</b>\n
 😢 Пользователь: <a href='tg://user?id={user_id}'>{update.new_chat_member.user.full_name}{username}</a>
 🎭 Роль: <b>{custom_title}</b>'''
-            for admin_id in ADMIN_IDS:
-                await bot.send_message(admin_id, admin_message)
+            await notifier.publish(admin_message, user_id, 'leave',
+                                   admin_ids=tenant.admin_ids)
 
             # Отправляем уведомление о свободной роли в LIST_ADMIN_ID
-            for admin_id in LIST_ADMIN_ID:
+            for admin_id in tenant.list_admin_ids:
                 await bot.send_message(
                     admin_id, f"Освободилась роль:<b>{custom_title}</b>")
 
-            # Записываем историю выхода
-            await db.save_join_history(user_id, None, datetime.now())
+            # Роль становится свободной, данные пользователя удаляем из БД
+            await role_registry.release(tenant.group_id, user_id)
+            await member_directory.remove_emoji(tenant.group_id, user_id)
+            await member_directory.remove_user_data(tenant.group_id, user_id)
+
 
-            # Удаляем данные пользователя из БД
-            await db.remove_emoji(user_id)
-            await db.remove_user_data(user_id)
+async def unpin_game_messages(game: dict):
+    """Открепление всех сообщений игры в ее группе"""
+    message_ids = await db.get_game_pinned_messages(game['game_id'])
+    for message_id in message_ids:
+        try:
+            await bot.unpin_chat_message(game['group_id'], message_id)
+        except Exception as e:
+            logging.error(f"Ошибка открепления сообщения {message_id}: {e}")
 
+    # Удаляем записи о закрепленных сообщениях
+    await db.delete_game_pinned_messages(game['game_id'])
 
-# Загрузка данных из БД при запуске
+
+# Восстановление данных из БД при запуске
 async def load_data_from_db():
-    """Загружает данные из БД в память при запуске бота"""
+    """Восстанавливает состояние в памяти для всех сообществ.
+
+    Вызывается в фоне после старта polling. Статусное сообщение
+    перерисовывается только для текущего раунда активной игры.
+    """
+    await asyncio.gather(member_directory.load(), role_registry.load(),
+                         *(restore_group_state(tenant.group_id) for tenant in tenants))
+
+
+async def restore_group_state(group_id: int):
+    """Восстанавливает состояние одной группы из одного снимка БД"""
     try:
-        # Загружаем викторины
-        global quiz_data, quiz_participants, bride_status_messages
-        active_quizzes = await db.get_all_active_quizzes()
-        quiz_data = active_quizzes
-
-        # Загружаем участников викторин
-        for quiz_id in active_quizzes.keys():
-            participants = await db.get_quiz_participants(quiz_id)
-            quiz_participants[quiz_id] = participants
-
-        # Загружаем активные игры жених и их статусные сообщения
-        active_game = await db.get_active_bride_game(GROUP_ID)
-        if active_game and active_game['status'] == 'started':
-            # Получаем все раунды активной игры
-            rounds = await db.get_bride_rounds(active_game['game_id'])
-            for round_data in rounds:
-                round_id = round_data['round_id']
-                # Восстанавливаем информацию о статусных сообщениях
-                status_message_info = await db.get_round_status_message(
-                    round_id)
-                if status_message_info:
-                    bride_status_messages[round_id] = {
-                        'creator_id': status_message_info['creator_id'],
-                        'message_id': status_message_info['message_id'],
-                        'game_id': active_game['game_id']
-                    }
-
-                    # Восстанавливаем статус ответов участников и обновляем сообщение
-                    try:
-                        await update_status_message_for_creator(
-                            active_game['game_id'], round_id)
-                    except Exception as e:
-                        logging.error(
-                            f"Ошибка восстановления статус-сообщения для раунда {round_id}: {e}"
-                        )
+        state = await db.get_recovery_state(group_id)
+
+        # Викторины, созданные уже после старта, не перезаписываются
+        for quiz_id, quiz in state['quizzes'].items():
+            quiz_data.setdefault(quiz_id, quiz)
+            quiz_participants.setdefault(quiz_id, state['quiz_participants'][quiz_id])
+
+        # Восстанавливаем информацию о статусных сообщениях раундов
+        game = state['game']
+        current_status = None
+        rounds_count = 0
+        if game and game['status'] == 'started':
+            for round_data in state['rounds']:
+                current_status = None
+                if round_data['status_message_id'] is None:
+                    continue
+                current_status = bride_status_messages.setdefault(round_data['round_id'], {
+                    'creator_id': round_data['status_creator_id'],
+                    'message_id': round_data['status_message_id'],
+                    'game_id': game['game_id']
+                })
+                rounds_count += 1
 
         logging.info(
-            f"Загружено {len(active_quizzes)} активных викторин и восстановлены статусные сообщения игр"
+            f"Группа {group_id}: восстановлено {len(state['quizzes'])} активных викторин и {rounds_count} статусных сообщений игр"
         )
 
+        # Ответы в текущем раунде могли прийти, пока бот был выключен
+        if current_status:
+            answered_user_ids = {answer['user_id'] for answer in state['answers']}
+            await edit_bride_status_message(current_status, state['participants'],
+                                            answered_user_ids)
+
     except Exception as e:
-        logging.error(f"Ошибка при загрузке данных из БД: {e}")
+        logging.error(f"Ошибка при загрузке данных группы {group_id} из БД: {e}")
+
+
+async def warm_up(timer: StartupTimer):
+    """Восстановление состояния и прогрев, которые идут параллельно с polling"""
+    await asyncio.gather(
+        timer.run('restore_state', load_data_from_db()),
+        timer.run('question_pool', question_pool.wait_ready()))
+    timer.log("Прогрев завершен")
+
+
+async def refresh_group(group_id: Optional[int]):
+    """Настройки сообщества изменены в таблице groups"""
+    if group_id is None:
+        await tenants.load()
+    else:
+        await tenants.invalidate(group_id)
+
+
+async def refresh_quiz(quiz_id: Optional[int]):
+    """Викторина создана или завершена другим процессом бота"""
+    if quiz_id is None:
+        active = await db.get_all_active_quizzes()
+        for known_id, quiz in quiz_data.items():
+            quiz['active'] = known_id in active
+        for active_id, quiz in active.items():
+            quiz_data.setdefault(active_id, quiz)
+            quiz_participants.setdefault(active_id, {})
+        return
+    quiz = await db.get_quiz(quiz_id)
+    if quiz is None:
+        quiz_data.pop(quiz_id, None)
+        quiz_participants.pop(quiz_id, None)
+    else:
+        quiz_data[quiz_id] = quiz
+        quiz_participants.setdefault(quiz_id, {})
+
+
+def forget_notice(notice_id: Optional[int]):
+    """Отметку об обработке уведомления поставил админ в другом процессе"""
+    if notice_id is None:
+        notifier.notices.clear()
+    else:
+        notifier.notices.pop(notice_id)
+
+
+invalidations.subscribe('groups', refresh_group)
+invalidations.subscribe('active_quizzes', refresh_quiz)
+invalidations.subscribe('admin_notices', forget_notice)
+invalidations.subscribe('user_data', member_directory.invalidate)
+invalidations.subscribe('user_emojis', member_directory.invalidate)
+invalidations.subscribe('roles', role_registry.invalidate)
 
 
 # Оптимизированная проверка лимита сообщений
@@ -839,9 +1059,9 @@ async def count_symbols(message: types.Message):
     await message.reply(f'Количество указанного символа: {count}')
 
 
-@dp.message(lambda m: m.chat.type == ChatType.PRIVATE and m.from_user.id in
-            ADMIN_IDS and m.text and m.text.lower().startswith("сказать "))
-async def admin_say_command(message: types.Message):
+@dp.message(lambda m, tenant: m.chat.type == ChatType.PRIVATE and
+            tenant.is_admin(m.from_user.id) and m.text and m.text.lower().startswith("сказать "))
+async def admin_say_command(message: types.Message, tenant: Tenant):
     try:
         # Получаем текст после команды "сказать"
         text_to_say = message.text[7:].strip()
@@ -850,15 +1070,111 @@ async def admin_say_command(message: types.Message):
             return
 
         # Отправляем сообщение в группу
-        await bot.send_message(GROUP_ID, text_to_say)
+        await bot.send_message(tenant.group_id, text_to_say)
         await message.reply("Сообщение отправлено в группу.")
     except Exception as e:
         logging.error(f"Ошибка при отправке сообщения в группу: {e}")
         await message.reply("Произошла ошибка при отправке сообщения.")
 
 
-@dp.message(lambda m: m.chat.type == ChatType.PRIVATE and m.from_user.id in
-            ADMIN_IDS and m.text and m.text.lower() == "создать викторину")
+@dp.message(lambda m, tenant: m.chat.type == ChatType.PRIVATE and
+            tenant.is_admin(m.from_user.id) and m.text and m.text.lower() == "размер таблиц")
+async def table_sizes_command(message: types.Message):
+    try:
+        sizes = await db.get_table_sizes()
+        await message.reply(format_table_sizes(sizes))
+    except Exception as e:
+        logging.error(f"Ошибка получения размеров таблиц: {e}")
+        await message.reply("Произошла ошибка при получении размеров таблиц.")
+
+
+@dp.message(lambda m, tenant: m.chat.type == ChatType.PRIVATE and
+            (tenant.is_admin(m.from_user.id) or m.from_user.id in tenant.list_admin_ids)
+            and m.text and m.text.lower() == "свободные роли")
+async def free_roles_command(message: types.Message, tenant: Tenant):
+    free = role_registry.free_roles(tenant.group_id)
+    if not free:
+        await message.reply("Свободных ролей нет.")
+        return
+    await message.reply(f"<b>Свободные роли ({len(free)}):</b>\n\n" +
+                        "\n".join(html.escape(role) for role in free))
+
+
+@dp.message(lambda m, tenant: m.chat.type == ChatType.PRIVATE and
+            tenant.is_admin(m.from_user.id) and m.text and m.text.lower().startswith("профиль "))
+async def profile_command(message: types.Message):
+    parts = message.text.lower().split()
+    action = parts[1] if len(parts) > 1 else ''
+
+    if action == "старт":
+        mode = parts[2] if len(parts) > 2 else 'pstats'
+        if mode not in PROFILE_MODES:
+            await message.reply(f"Режимы профилирования: {', '.join(PROFILE_MODES)}")
+            return
+        if profiler.running:
+            await message.reply("Профилирование уже запущено.")
+            return
+        profiler.start(mode)
+        await message.reply(f"Профилирование запущено ({mode}). Для остановки: профиль стоп")
+    elif action == "стоп":
+        if not profiler.running:
+            await message.reply("Профилирование не запущено.")
+            return
+        try:
+            path = await profiler.stop()
+            await message.reply_document(types.FSInputFile(path),
+                                         caption=f"Профиль сохранен: {path}")
+        except Exception as e:
+            logging.error(f"Ошибка сохранения профиля: {e}")
+            await message.reply("Произошла ошибка при сохранении профиля.")
+    else:
+        await message.reply("Использование: профиль старт [pstats|collapsed] / профиль стоп")
+
+
+# Названия агрегатов статистики
+STATS_TITLES = (
+    ('joins', 'Вступили'),
+    ('leaves', 'Вышли'),
+    ('applications', 'Заявки'),
+    ('quiz_answers', 'Участия в викторинах'),
+    ('bride_games_started', 'Игр «Жених» начато'),
+    ('bride_games_finished', 'Игр «Жених» завершено'),
+)
+
+
+@dp.message(lambda m, tenant: m.chat.type == ChatType.PRIVATE and
+            tenant.is_admin(m.from_user.id) and m.text and m.text.lower() == "статистика")
+async def stats_command(message: types.Message, tenant: Tenant):
+    try:
+        rows = await db.get_stats_summary(tenant.group_id)
+    except Exception as e:
+        logging.error(f"Ошибка получения статистики: {e}")
+        await message.reply("Произошла ошибка при получении статистики.")
+        return
+
+    totals = {}
+    roles = []
+    for row in rows:
+        metric_total = totals.setdefault(row['metric'], [0, 0, 0])
+        metric_total[0] += row['today']
+        metric_total[1] += row['week']
+        metric_total[2] += row['month']
+        if row['metric'] == 'applications' and row['key']:
+            roles.append(row)
+
+    text = "📊 <b>Статистика</b>\n<i>сегодня / 7 дней / 30 дней</i>\n\n"
+    for metric, title in STATS_TITLES:
+        today, week, month = totals.get(metric, (0, 0, 0))
+        text += f"{title}: <b>{today} / {week} / {month}</b>\n"
+        if metric == 'applications':
+            for row in roles[:10]:
+                text += f"└ {html.escape(row['key'])}: {row['today']} / {row['week']} / {row['month']}\n"
+
+    await message.reply(text.strip())
+
+
+@dp.message(lambda m, tenant: m.chat.type == ChatType.PRIVATE and
+            tenant.is_admin(m.from_user.id) and m.text and m.text.lower() == "создать викторину")
 async def create_quiz_start(message: types.Message, state: FSMContext):
     await message.reply("Напишите вопрос для викторины.")
     await state.set_state(QuizCreation.waiting_for_question)
@@ -900,7 +1216,7 @@ async def quiz_answers_handler(message: types.Message, state: FSMContext):
 
 
 @dp.message(QuizCreation.waiting_for_correct)
-async def quiz_correct_handler(message: types.Message, state: FSMContext):
+async def quiz_correct_handler(message: types.Message, state: FSMContext, tenant: Tenant):
     try:
         correct_indices = [int(x.strip()) - 1 for x in message.text.split(',')]
         data = await state.get_data()
@@ -916,7 +1232,7 @@ async def quiz_correct_handler(message: types.Message, state: FSMContext):
 
         # Сохраняем викторину в БД
         await db.save_quiz(quiz_id=quiz_id,
-                           chat_id=GROUP_ID,
+                           chat_id=tenant.group_id,
                            question=data['question'],
                            answers=answers,
                            correct_indices=correct_indices,
@@ -924,6 +1240,7 @@ async def quiz_correct_handler(message: types.Message, state: FSMContext):
 
         # Также сохраняем в локальной памяти для работы бота
         quiz_data[quiz_id] = {
+            'chat_id': tenant.group_id,
             'question': data['question'],
             'answers': answers,
             'correct_indices': correct_indices,
@@ -940,7 +1257,7 @@ async def quiz_correct_handler(message: types.Message, state: FSMContext):
 
         # Отправляем викторину в группу
         quiz_message = f"📝 <b>Викторина\n\n{data['question']}</b>"
-        await bot.send_message(GROUP_ID, quiz_message, reply_markup=keyboard)
+        await bot.send_message(tenant.group_id, quiz_message, reply_markup=keyboard)
 
         await message.reply(
             f"Викторина #{quiz_id} создана и отправлена в группу!\n\n<b>Для завершения викторины напишите: завершить викторину {quiz_id}</b>"
@@ -954,7 +1271,7 @@ async def quiz_correct_handler(message: types.Message, state: FSMContext):
 
 
 @dp.message(
-    lambda m: m.chat.type == ChatType.PRIVATE and m.from_user.id in ADMIN_IDS
+    lambda m, tenant: m.chat.type == ChatType.PRIVATE and tenant.is_admin(m.from_user.id)
     and m.text and m.text.lower().startswith("завершить викторину "))
 async def end_quiz_command(message: types.Message):
     try:
@@ -1019,7 +1336,7 @@ async def end_quiz_command(message: types.Message):
                 results_message += f"• {user}\n"
 
         # Отправляем результаты в группу
-        await bot.send_message(GROUP_ID, results_message)
+        await bot.send_message(quiz['chat_id'], results_message)
 
         # Формируем детальную статистику по вариантам ответов
         total_participants = len(participants)
@@ -1064,7 +1381,7 @@ async def end_quiz_command(message: types.Message):
             stats_message += "\n"
 
         # Отправляем детальную статистику
-        await bot.send_message(GROUP_ID, stats_message)
+        await bot.send_message(quiz['chat_id'], stats_message)
 
         # Уведомляем админа
         await message.reply(
@@ -1078,8 +1395,10 @@ async def end_quiz_command(message: types.Message):
         logging.error(f"Ошибка при завершении викторины: {e}")
         await message.reply("Произошла ошибка при завершении викторины.")              
 
-async def handle_bride_question(message: types.Message, active_game: dict, participants: list, user_participant: dict):
-    """Обработка нового вопроса от жениха"""
+async def handle_bride_question(message: types.Message, active_game: dict, participants: list, user_participant: dict,
+                                question: str = None):
+    """Обработка нового вопроса от жениха (question - выбранная подсказка вместо текста сообщения)"""
+    question = question or message.text
     try:
         # Проверяем, есть ли незавершенный раунд
         current_round = await db.get_current_bride_round(active_game['game_id'])
@@ -1103,7 +1422,8 @@ async def handle_bride_question(message: types.Message, active_game: dict, parti
         round_number = len(existing_rounds) + 1
 
         # Создаем раунд и сохраняем вопрос
-        round_id = await db.create_bride_round(active_game['game_id'], round_number, message.text)
+        round_id = await db.create_bride_round(active_game['game_id'], round_number, question)
+        question_pool.mark_used(question)
 
         await message.reply("Ваш вопрос отправлен участникам.")
 
@@ -1114,11 +1434,11 @@ async def handle_bride_question(message: types.Message, active_game: dict, parti
         ]])
 
         question_msg = await bot.send_message(
-            GROUP_ID, f"<b>Вопрос от жениха!</b>\n\n{message.text}", reply_markup=keyboard)
+            active_game['group_id'], f"<b>Вопрос от жениха!</b>\n\n{question}", reply_markup=keyboard)
 
         # Закрепляем вопрос
         try:
-            await bot.pin_chat_message(GROUP_ID, question_msg.message_id, disable_notification=True)
+            await bot.pin_chat_message(active_game['group_id'], question_msg.message_id, disable_notification=True)
             # Сохраняем ID закрепленного сообщения с вопросом
             await db.save_pinned_message(active_game['game_id'], round_id, question_msg.message_id, 'question')
         except Exception as e:
@@ -1130,7 +1450,7 @@ async def handle_bride_question(message: types.Message, active_game: dict, parti
             try:
                 await bot.send_message(
                     participant['user_id'],
-                    f"<b>Вопрос от жениха!</b>\n{message.text}\n\nОтправьте свой ответ."
+                    f"<b>Вопрос от жениха!</b>\n{question}\n\nОтправьте свой ответ."
                 )
             except Exception as e:
                 logging.error(f"Ошибка отправки вопроса участнику {participant['user_id']}: {e}")
@@ -1170,7 +1490,7 @@ async def handle_participant_answer(message: types.Message, active_game: dict, p
                 try:
                     pinned_question = await db.get_pinned_message(current_round['round_id'], 'question')
                     if pinned_question:
-                        await bot.unpin_chat_message(GROUP_ID, pinned_question)
+                        await bot.unpin_chat_message(active_game['group_id'], pinned_question)
                 except Exception as e:
                     logging.error(f"Ошибка открепления вопроса: {e}")
 
@@ -1183,11 +1503,11 @@ async def handle_participant_answer(message: types.Message, active_game: dict, p
                 for answer in sorted_answers:
                     results_message += f"{answer['number']}\n{answer['answer']}\n\n"
 
-                answers_msg = await bot.send_message(GROUP_ID, results_message.strip())
+                answers_msg = await bot.send_message(active_game['group_id'], results_message.strip())
 
                 # Закрепляем ответы
                 try:
-                    await bot.pin_chat_message(GROUP_ID, answers_msg.message_id, disable_notification=True)
+                    await bot.pin_chat_message(active_game['group_id'], answers_msg.message_id, disable_notification=True)
                     await db.save_pinned_message(active_game['game_id'], current_round['round_id'], answers_msg.message_id, 'answers')
                 except Exception as e:
                     logging.error(f"Ошибка закрепления ответов: {e}")
@@ -1198,7 +1518,7 @@ async def handle_participant_answer(message: types.Message, active_game: dict, p
                     InlineKeyboardButton(text="Перейти в бота", url=f"https://t.me/{bot_username}")
                 ]])
 
-                await bot.send_message(GROUP_ID, "Жених должен выбрать кто выбывает.", reply_markup=keyboard)
+                await bot.send_message(active_game['group_id'], "Жених должен выбрать кто выбывает.", reply_markup=keyboard)
 
                 # Отправляем жениху просьбу выбрать
                 bride_participant = next(p for p in participants if p['is_bride'])
@@ -1251,12 +1571,12 @@ async def handle_bride_elimination_choice(message: types.Message, active_game: d
                     try:
                         pinned_answers = await db.get_pinned_message(round_id, 'answers')
                         if pinned_answers:
-                            await bot.unpin_chat_message(GROUP_ID, pinned_answers)
+                            await bot.unpin_chat_message(active_game['group_id'], pinned_answers)
                     except Exception as e:
                         logging.error(f"Ошибка открепления ответов: {e}")
 
                     # Отправляем сообщение в группу
-                    await bot.send_message(GROUP_ID, f"<b>Выбывает номер: {choice}</b>")
+                    await bot.send_message(active_game['group_id'], f"<b>Выбывает номер: {choice}</b>")
 
                     # Уведомляем исключенного участника
                     await bot.send_message(participant_to_exclude['user_id'], "Вы выбыли. Дождитесь конца игры.")
@@ -1289,13 +1609,14 @@ async def handle_bride_elimination_choice(message: types.Message, active_game: d
                                 participant_user = await bot.get_chat(participant['user_id'])
                                 results_text += f"{participant['number']} - {participant_user.full_name}\n"
 
-                        await bot.send_message(GROUP_ID, results_text.strip())
+                        await bot.send_message(active_game['group_id'], results_text.strip())
 
                         # Завершаем игру
                         await db.finish_bride_game(active_game['game_id'])
                     else:
                         # Продолжаем игру - жених задает новый вопрос
-                        await message.reply("Отправьте следующий вопрос для оставшихся участников.")
+                        await message.reply("Отправьте следующий вопрос для оставшихся участников.",
+                                            reply_markup=get_suggest_keyboard())
 
                 except ValueError:
                     await message.reply("Отправьте только число участника.")
@@ -1309,56 +1630,36 @@ async def handle_bride_elimination_choice(message: types.Message, active_game: d
         await message.reply("Произошла ошибка при обработке выбора.")
 
 
-@dp.message(lambda m: m.chat.type == ChatType.PRIVATE and m.from_user.id in
-            ADMIN_IDS and m.reply_to_message and m.text)
-async def admin_reply_handler(message: types.Message):
+@dp.message(lambda m, tenant: m.chat.type == ChatType.PRIVATE and
+            tenant.is_admin(m.from_user.id) and m.reply_to_message and m.text)
+async def admin_reply_handler(message: types.Message, tenant: Tenant):
     if not message.text:
         return
 
     # Проверяем, что это ответ админа на заявку
-    if not (message.chat.type == ChatType.PRIVATE and message.from_user.id
-            in ADMIN_IDS and message.reply_to_message):
-        return
-
-    reply_text = message.reply_to_message.text or message.reply_to_message.caption or ""
-
-    # Проверяем, что это одна из заявок или ответов пользователей, на которые можно отвечать
-    if not any(keyword in reply_text for keyword in [
-            "Заявка на вступление!", "Заявка на рест", "Не может влиться!",
-            "ответил:", "Ответ от пользователя", "ID для ответа:"
-    ]):
+    if not (message.chat.type == ChatType.PRIVATE and tenant.is_admin(message.from_user.id)
+            and message.reply_to_message):
         return
 
-    # Парсим ID пользователя
-    user_id = None
-
-    # Сначала ищем в строке "ID для ответа:" (для ответов пользователей)
-    if "ID для ответа:" in reply_text:
-        for line in reply_text.split('\n'):
-            if "ID для ответа:" in line:
-                user_id_str = line.split(":")[1].strip().replace(
-                    "<code>", "").replace("</code>", "")
-                if user_id_str.isdigit():
-                    user_id = int(user_id_str)
-                break
-
-    # Если не найден, ищем стандартный формат заявки
-    if not user_id:
-        for line in reply_text.split('\n'):
-            if line.startswith("#️⃣ ID:"):
-                user_id_str = line.split(":")[1].strip().replace(
-                    "<code>", "").replace("</code>", "")
-                if user_id_str.isdigit():
-                    user_id = int(user_id_str)
-                break
-
-    # Альтернативный парсинг если ID не найден
-    if not user_id and "tg://user?id=" in reply_text:
-        user_id = int(reply_text.split("tg://user?id=")[1].split("'")[0])
-
-    if not user_id:
-        await message.reply("Не удалось определить ID пользователя.")
-        return
+    # Находим пользователя по индексу уведомлений
+    notice = await notifier.resolve(message.chat.id,
+                                    message.reply_to_message.message_id)
+    if notice is not None:
+        if notice.kind not in REPLYABLE_KINDS:
+            return
+        user_id = notice.user_id
+        notice_id = notice.notice_id
+    else:
+        # Уведомления, отправленные до появления индекса, разбираем по тексту
+        reply_text = message.reply_to_message.text or message.reply_to_message.caption or ""
+        user_id = parse_legacy_notice_user_id(reply_text)
+        notice_id = None
+        if user_id is None:
+            # Ответ на сообщение, которое не является уведомлением
+            return
+        if not user_id:
+            await message.reply("Не удалось определить ID пользователя.")
+            return
 
     # Проверяем команду изменения роли
     if message.text.lower().startswith("роль "):
@@ -1371,26 +1672,26 @@ async def admin_reply_handler(message: types.Message):
                 await db.update_application_role(user_id, new_role)
 
                 # Обновляем роль в данных пользователя
-                await db.save_user_data(user_id, role=new_role)
+                await member_directory.save_user_data(tenant.group_id, user_id, role=new_role)
 
                 # Уведомляем админа, который изменил роль
+                status = role_status(tenant.group_id, new_role, user_id)
                 await message.reply(
-                    f"Роль пользователя изменена на: {new_role}")
+                    f"Роль пользователя изменена на: {new_role}\nСтатус роли: {status}")
 
                 # Уведомляем остальных админов об изменении роли
                 admin_username = f"@{message.from_user.username}" if message.from_user.username else message.from_user.full_name
                 other_admins_message = f"{admin_username} изменил роль {target_user.full_name} на: <b>{new_role}</b>"
 
-                for admin_id in ADMIN_IDS:
-                    if admin_id != message.from_user.id:  # Не отправляем тому, кто изменил
-                        try:
-                            await bot.send_message(admin_id,
-                                                   other_admins_message,
-                                                   parse_mode=ParseMode.HTML)
-                        except Exception as e:
-                            logging.error(
-                                f"Ошибка отправки уведомления об изменении роли админу {admin_id}: {e}"
-                            )
+                if notice_id:
+                    # Отмечаем изменение роли в копиях уведомления у всех админов
+                    await notifier.mark_handled(
+                        notice_id,
+                        f"{admin_username} изменил роль на: {new_role}")
+                else:
+                    await notifier.publish(other_admins_message, user_id, 'echo',
+                                           exclude_admin=message.from_user.id,
+                                           admin_ids=tenant.admin_ids)
                 return
             except Exception as e:
                 await message.reply(f"Ошибка при изменении роли: {str(e)}")
@@ -1413,16 +1714,15 @@ async def admin_reply_handler(message: types.Message):
         # Формируем текст уведомления для других админов в правильном формате
         notification_text = f"{admin.full_name} отправил ответ {target_user.full_name}:\n\n<code>{message.text}</code>"
 
-        # Отправляем уведомление другим админам
-        for admin_id in ADMIN_IDS:
-            if admin_id != message.from_user.id:
-                try:
-                    await bot.send_message(admin_id,
-                                           notification_text,
-                                           parse_mode=ParseMode.HTML)
-                except Exception as e:
-                    logging.error(
-                        f"Ошибка отправки уведомления админу {admin_id}: {e}")
+        # Отмечаем ответ в копиях уведомления у всех админов
+        if notice_id:
+            await notifier.mark_handled(
+                notice_id,
+                f"{admin.full_name} ответил: {message.text}")
+        else:
+            await notifier.publish(notification_text, user_id, 'echo',
+                                   exclude_admin=message.from_user.id,
+                                   admin_ids=tenant.admin_ids)
 
         await message.reply(f"Ответ успешно отправлен пользователю.")
 
@@ -1434,42 +1734,49 @@ async def admin_reply_handler(message: types.Message):
         await message.reply(error_msg)
 
 
-# Глобальное хранилище для отслеживания сообщений набора
-bride_game_messages = {}
+# Открытые наборы в игру: сообщение о наборе и число участников
+recruitments = RecruitmentBoard(bot)
 
 # Глобальное хранилище для отслеживания сообщений о статусе ответов
 bride_status_messages = {}
 
+# Последняя показанная жениху подсказка: user_id -> вопрос
+bride_suggestions = {}
+
+
+def get_suggest_keyboard():
+    """Кнопка подсказки вопроса (если LLM настроена)"""
+    if not question_pool.enabled:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="💡 Предложить вопрос", callback_data="bride_suggest")
+    ]])
 
-@dp.message(lambda m: m.text and m.text.lower() == "начать жених" and m.
-            from_user.id in ADMIN_IDS)
+
+@dp.message(lambda m, tenant: m.text and m.text.lower() == "начать жених" and
+            tenant.is_admin(m.from_user.id))
 async def start_bride_game_announcement(message: types.Message,
-                                        state: FSMContext):
-    if not db.pool:
+                                        state: FSMContext, tenant: Tenant):
+    if not db.is_connected:
         await message.reply("Ошибка подключения к базе данных.")
         return
 
-    session = await db.get_active_bride_session()
+    session = await db.get_active_bride_session(tenant.group_id)
     if session:
         await message.reply("Игра уже запущена. Сначала завершите текущую.")
         return
 
-    session_id = await db.create_bride_session(message.from_user.id)
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="Присоединиться",
-                             callback_data=f"bride_join_{session_id}")
-    ]])
+    session_id = await db.create_bride_session(message.from_user.id, tenant.group_id)
+    count = await db.join_bride_session(session_id, message.from_user.id)
 
     # Отправляем сообщение в группу
     if message.chat.type in {ChatType.GROUP, ChatType.SUPERGROUP}:
         chat_id = message.chat.id
     else:
-        chat_id = GROUP_ID
+        chat_id = tenant.group_id
 
-    msg = await bot.send_message(chat_id,
-                                 f"Идёт набор в игру \"Жених\"\nУчастников: 1",
-                                 reply_markup=keyboard)
+    msg = await bot.send_message(chat_id, recruitment_text(count),
+                                 reply_markup=recruitment_keyboard(session_id))
 
     # Закрепляем сообщение о наборе
     try:
@@ -1477,25 +1784,17 @@ async def start_bride_game_announcement(message: types.Message,
     except Exception as e:
         logging.error(f"Ошибка закрепления сообщения о наборе: {e}")
 
-    # Сохраняем информацию о сообщении глобально
-    bride_game_messages[session_id] = {
-        "chat_id": chat_id,
-        "message_id": msg.message_id,
-        "participants": [message.from_user.id],
-        "pinned_message_id": msg.message_id
-    }
-
-    await db.add_bride_participant(session_id, message.from_user.id, 0)
+    recruitments.open(session_id, chat_id, msg.message_id, count)
 
     if message.chat.type == ChatType.PRIVATE:
         await message.reply("Набор в игру начат в группе.")
 
 
-@dp.message(lambda m: m.text and m.text.lower() == "запустить жених" and m.
-            from_user.id in ADMIN_IDS)
-async def launch_bride_game(message: types.Message, state: FSMContext):
+@dp.message(lambda m, tenant: m.text and m.text.lower() == "запустить жених" and
+            tenant.is_admin(m.from_user.id))
+async def launch_bride_game(message: types.Message, state: FSMContext, tenant: Tenant):
     try:
-        session = await db.get_active_bride_session()
+        session = await db.get_active_bride_session(tenant.group_id)
         if not session:
             await message.reply("Нет активной сессии для запуска.")
             return
@@ -1517,28 +1816,30 @@ async def launch_bride_game(message: types.Message, state: FSMContext):
         # Выбираем абсолютно случайного жениха из подходящих кандидатов
         bride_id = random.choice(eligible_candidates)
 
-        # Отмечаем выбранного как жениха
-        await db.mark_as_bride(bride_id)
-
-        # Создаем игру в БД
-        game_id = await db.create_bride_game(GROUP_ID, message.from_user.id)
-
-        # Добавляем участников с номерами
-        participant_number = 1
-        for participant_id in participants_ids:
-            if participant_id == bride_id:
-                # Жених без номера
-                await db.add_bride_game_participant(game_id, participant_id,
-                                                    None, True)
-            else:
-                # Остальные участники с номерами - сбрасываем их статус жениха
-                await db.reset_bride_status(participant_id)
-                await db.add_bride_game_participant(game_id, participant_id,
-                                                    participant_number, False)
-                participant_number += 1
+        # Игра создается одной транзакцией: записи участников уходят пакетами
+        async with db.unit_of_work():
+            # Отмечаем выбранного как жениха
+            await db.mark_as_bride(bride_id)
+
+            # Создаем игру в БД
+            game_id = await db.create_bride_game(tenant.group_id, message.from_user.id)
+
+            # Добавляем участников с номерами
+            participant_number = 1
+            for participant_id in participants_ids:
+                if participant_id == bride_id:
+                    # Жених без номера
+                    await db.add_bride_game_participant(game_id, participant_id,
+                                                        None, True)
+                else:
+                    # Остальные участники с номерами - сбрасываем их статус жениха
+                    await db.reset_bride_status(participant_id)
+                    await db.add_bride_game_participant(game_id, participant_id,
+                                                        participant_number, False)
+                    participant_number += 1
 
-        # Запускаем игру
-        await db.start_bride_game(game_id, bride_id)
+            # Запускаем игру
+            await db.start_bride_game(game_id, bride_id)
 
         # Создаем кнопку для перехода в бота
         bot_username = (await bot.me()).username
@@ -1554,7 +1855,7 @@ async def launch_bride_game(message: types.Message, state: FSMContext):
                 reply_markup=keyboard)
         else:
             await bot.send_message(
-                GROUP_ID,
+                tenant.group_id,
                 "<b>Игра началась!</b>\n Участники получили свои роли.",
                 reply_markup=keyboard)
             await message.reply(
@@ -1563,7 +1864,8 @@ async def launch_bride_game(message: types.Message, state: FSMContext):
         # Затем уведомляем жениха
         await bot.send_message(
             bride_id,
-            "<b>🤵 Вы выбраны женихом!</b>\n Никому не говорите свою роль. Напишите первый вопрос."
+            "<b>🤵 Вы выбраны женихом!</b>\n Никому не говорите свою роль. Напишите первый вопрос.",
+            reply_markup=get_suggest_keyboard()
         )
 
         # Отправляем список участников ведущему (создателю игры)
@@ -1608,18 +1910,16 @@ async def launch_bride_game(message: types.Message, state: FSMContext):
                     )
 
         # Открепляем сообщение о наборе
-        if session_id in bride_game_messages:
+        recruitment = recruitments.close(session_id)
+        if recruitment is not None:
             try:
-                await bot.unpin_chat_message(
-                    GROUP_ID,
-                    bride_game_messages[session_id]["pinned_message_id"])
+                await bot.unpin_chat_message(recruitment.chat_id,
+                                             recruitment.message_id)
             except Exception as e:
                 logging.error(f"Ошибка открепления сообщения о наборе: {e}")
 
         # Очищаем сессию набора
         await db.delete_bride_session(session_id)
-        if session_id in bride_game_messages:
-            del bride_game_messages[session_id]
 
         # Очищаем состояние
         await state.clear()
@@ -1629,38 +1929,34 @@ async def launch_bride_game(message: types.Message, state: FSMContext):
         await message.reply(f"Произошла ошибка при запуске игры: {str(e)}")
 
 
-@dp.message(lambda m: m.text and m.text.lower() == "завершить жених" and m.
-            from_user.id in ADMIN_IDS)
-async def finish_bride_game(message: types.Message, state: FSMContext):
+@dp.message(lambda m, tenant: m.text and m.text.lower() == "завершить жених" and
+            tenant.is_admin(m.from_user.id))
+async def finish_bride_game(message: types.Message, state: FSMContext, tenant: Tenant):
     # Проверяем активную сессию набора
-    session = await db.get_active_bride_session()
+    session = await db.get_active_bride_session(tenant.group_id)
     if session:
         # Открепляем сообщение о наборе
-        if session['session_id'] in bride_game_messages:
+        recruitment = recruitments.close(session['session_id'])
+        if recruitment is not None:
             try:
-                await bot.unpin_chat_message(
-                    GROUP_ID, bride_game_messages[session['session_id']]
-                    ["pinned_message_id"])
+                await bot.unpin_chat_message(recruitment.chat_id,
+                                             recruitment.message_id)
             except Exception as e:
                 logging.error(f"Ошибка открепления сообщения о наборе: {e}")
 
         await db.delete_bride_session(session['session_id'])
 
-        # Очищаем глобальное хранилище
-        if session['session_id'] in bride_game_messages:
-            del bride_game_messages[session['session_id']]
-
         if message.chat.type in {ChatType.GROUP, ChatType.SUPERGROUP}:
             await message.answer("Набор в игру завершен.")
         else:
-            await bot.send_message(GROUP_ID, "Набор в игру завершен.")
+            await bot.send_message(tenant.group_id, "Набор в игру завершен.")
             await message.reply("Набор в игру завершен.")
 
         await state.clear()
         return
 
     # Проверяем активную игру
-    active_game = await db.get_active_bride_game(GROUP_ID)
+    active_game = await db.get_active_bride_game(tenant.group_id)
     if not active_game:
         await message.reply("Нет активной игры для завершения.")
         return
@@ -1671,18 +1967,22 @@ async def finish_bride_game(message: types.Message, state: FSMContext):
 
     # Открепляем все закрепленные сообщения игры
     try:
-        await db.unpin_all_game_messages(active_game['game_id'])
+        await unpin_game_messages(active_game)
     except Exception as e:
         logging.error(f"Ошибка открепления сообщений игры: {e}")
 
-    # Завершаем игру
-    await db.finish_bride_game(active_game['game_id'])
+    # Завершаем игру и удаляем статус-сообщения раундов одной транзакцией
+    async with db.unit_of_work():
+        await db.finish_bride_game(active_game['game_id'])
+        rounds = await db.get_bride_rounds(active_game['game_id'])
+        for round_data in rounds:
+            await db.delete_round_status_message(round_data['round_id'])
 
     if message.chat.type in {ChatType.GROUP, ChatType.SUPERGROUP}:
         await message.answer("Игра принудительно завершена администратором.")
     else:
         await bot.send_message(
-            GROUP_ID, "Игра принудительно завершена администратором.")
+            tenant.group_id, "Игра принудительно завершена администратором.")
         await message.reply("Игра принудительно завершена администратором.")
 
     # Уведомляем всех участников
@@ -1695,89 +1995,111 @@ async def finish_bride_game(message: types.Message, state: FSMContext):
             logging.error(
                 f"Ошибка уведомления участника {participant['user_id']}: {e}")
 
-    # Очищаем статус-сообщения из БД и памяти
-    rounds = await db.get_bride_rounds(active_game['game_id'])
+    # Очищаем статус-сообщения из памяти
     for round_data in rounds:
-        round_id = round_data['round_id']
-        # Удаляем из БД
-        await db.delete_round_status_message(round_id)
-        # Удаляем из памяти
-        if round_id in bride_status_messages:
-            del bride_status_messages[round_id]
+        bride_status_messages.pop(round_data['round_id'], None)
 
     # Очищаем состояние
     await state.clear()
 
 
 @dp.callback_query(F.data.startswith("bride_join_"))
-async def bride_join_callback(callback: CallbackQuery, state: FSMContext):
+async def bride_join_callback(callback: CallbackQuery, state: FSMContext, tenant: Tenant):
     session_id = int(callback.data.split("_")[-1])
     user_id = callback.from_user.id
 
-    session = await db.get_active_bride_session()
-    if not session or session["session_id"] != session_id:
-        await callback.answer("Игра уже началась или завершена.",
-                              show_alert=True)
+    # Вступление - один INSERT; сессию и участников заново не читаем
+    count = await db.join_bride_session(session_id, user_id)
+    if count is None:
+        session = await db.get_active_bride_session(tenant.group_id)
+        if not session or session["session_id"] != session_id:
+            await callback.answer("Игра уже началась или завершена.",
+                                  show_alert=True)
+        else:
+            await callback.answer("Вы уже присоединились.", show_alert=True)
         return
 
-    # Получаем участников из базы данных
-    participants_data = await db.get_bride_session_participants(session_id)
-    participant_ids = [p['user_id'] for p in participants_data]
+    await bot.send_message(user_id, "Вы присоединились к игре.")
+
+    # После перезапуска сообщение о наборе известно только из нажатия
+    if recruitments.get(session_id) is None and callback.message:
+        recruitments.open(session_id, callback.message.chat.id,
+                          callback.message.message_id)
+    recruitments.joined(session_id, count)
+
+    await callback.answer()
+
+
+async def get_bride_for_suggestion(callback: CallbackQuery, tenant: Tenant):
+    """Активная игра, участники и жених для кнопок подсказки (или None)"""
+    active_game = await db.get_active_bride_game(tenant.group_id)
+    if not active_game or active_game['status'] != 'started':
+        await callback.answer("Игра уже завершена.", show_alert=True)
+        return None
+    participants = await db.get_bride_participants(active_game['game_id'])
+    user_participant = next(
+        (p for p in participants if p['user_id'] == callback.from_user.id), None)
+    if not user_participant or not user_participant['is_bride']:
+        await callback.answer("Подсказки доступны только жениху.", show_alert=True)
+        return None
+    return active_game, participants, user_participant
+
 
-    if user_id in participant_ids:
-        await callback.answer("Вы уже присоединились.", show_alert=True)
+@dp.callback_query(F.data == "bride_suggest")
+async def bride_suggest_callback(callback: CallbackQuery, tenant: Tenant):
+    if not await get_bride_for_suggestion(callback, tenant):
         return
 
-    number = len(participant_ids)
-    await db.add_bride_participant(session_id, user_id, number)
-    participant_ids.append(user_id)
+    question = question_pool.take()
+    if not question:
+        await callback.answer("Подсказки еще готовятся, попробуйте через минуту.",
+                              show_alert=True)
+        return
 
-    # Обновляем глобальное хранилище если оно существует
-    if session_id in bride_game_messages:
-        bride_game_messages[session_id]["participants"] = participant_ids
+    bride_suggestions[callback.from_user.id] = question
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Задать этот вопрос", callback_data="bride_ask"),
+        InlineKeyboardButton(text="🔄 Другой", callback_data="bride_suggest")
+    ]])
+    await callback.message.answer(f"💡 <b>Вариант вопроса:</b>\n{question}", reply_markup=keyboard)
+    await callback.answer()
 
-    await bot.send_message(user_id, "Вы присоединились к игре.")
 
-    # Обновляем сообщение в группе
-    try:
-        # Если есть информация о сообщении в памяти, используем её
-        if session_id in bride_game_messages:
-            await bot.edit_message_text(
-                chat_id=bride_game_messages[session_id]["chat_id"],
-                message_id=bride_game_messages[session_id]["message_id"],
-                text=
-                f"Идёт набор в игру \"Жених\"\nУчастников: {len(participant_ids)}",
-                reply_markup=callback.message.reply_markup)
-        else:
-            # Иначе пытаемся обновить текущее сообщение
-            await bot.edit_message_text(
-                chat_id=callback.message.chat.id,
-                message_id=callback.message.message_id,
-                text=
-                f"Идёт набор в игру \"Жених\"\nУчастников: {len(participant_ids)}",
-                reply_markup=callback.message.reply_markup)
-    except Exception as e:
-        logging.error(f"Ошибка обновления сообщения: {e}")
+@dp.callback_query(F.data == "bride_ask")
+async def bride_ask_callback(callback: CallbackQuery, tenant: Tenant):
+    bride = await get_bride_for_suggestion(callback, tenant)
+    if not bride:
+        return
+
+    question = bride_suggestions.pop(callback.from_user.id, None)
+    if not question:
+        await callback.answer("Этот вариант уже недоступен, запросите новый.", show_alert=True)
+        return
 
     await callback.answer()
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except Exception as e:
+        logging.error(f"Ошибка удаления кнопок подсказки: {e}")
+    await handle_bride_question(callback.message, *bride, question=question)
 
 
 @dp.message()
-async def handle_admin_response(message: types.Message, state: FSMContext):
+async def handle_admin_response(message: types.Message, state: FSMContext, tenant: Tenant):
     try:
         # Игнорируем сообщения, которые уже обработаны другими хендлерами
         if not message.text:
             return
 
         # Проверяем подключение к БД
-        if not db.pool:
+        if not db.is_connected:
             logging.error("Нет подключения к базе данных")
             return
 
         # Проверяем, не связано ли это с игрой Жених
         active_game = None
         try:
-            active_game = await db.get_active_bride_game(GROUP_ID)
+            active_game = await db.get_active_bride_game(tenant.group_id)
         except Exception as e:
             logging.error(f"Ошибка получения активной игры: {e}")
             return
@@ -1836,9 +2158,9 @@ async def handle_admin_response(message: types.Message, state: FSMContext):
             return
 
         # Антиспам проверка для пользователей не из группы
-        if message.from_user.id not in ADMIN_IDS:
+        if not tenant.is_admin(message.from_user.id):
             user_id = message.from_user.id
-            if not await is_member(user_id) and not check_message_limit(
+            if not await is_member(user_id, tenant.group_id) and not check_message_limit(
                     user_id):
                 try:
                     await message.answer(
@@ -1849,7 +2171,7 @@ async def handle_admin_response(message: types.Message, state: FSMContext):
                 return
 
         # Проверяем, не является ли это ответом пользователя на сообщение админа
-        if (message.from_user.id not in ADMIN_IDS and message.reply_to_message
+        if (not tenant.is_admin(message.from_user.id) and message.reply_to_message
                 and message.chat.type == ChatType.PRIVATE):
 
             reply_text = message.reply_to_message.text or message.reply_to_message.caption or ""
@@ -1866,24 +2188,17 @@ async def handle_admin_response(message: types.Message, state: FSMContext):
 
 <b>{message.text}</b>'''
 
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await bot.send_message(admin_id,
-                                               admin_notification,
-                                               parse_mode=ParseMode.HTML)
-                    except Exception as e:
-                        logging.error(
-                            f"Ошибка отправки ответа пользователя админу {admin_id}: {e}"
-                        )
+                await notifier.publish(admin_notification, user_id, 'user_reply',
+                                       admin_ids=tenant.admin_ids)
 
                 await message.reply("Ваш ответ отправлен администраторам.")
                 return
 
         # Обрабатываем сообщения от пользователей не из группы (обратная связь)
-        if (message.from_user.id not in ADMIN_IDS
+        if (not tenant.is_admin(message.from_user.id)
                 and message.chat.type == ChatType.PRIVATE
                 and not message.reply_to_message
-                and not await is_member(message.from_user.id)):
+                and not await is_member(message.from_user.id, tenant.group_id)):
 
             # Это обратная связь от пользователя не из группы
             user = message.from_user
@@ -1896,15 +2211,8 @@ async def handle_admin_response(message: types.Message, state: FSMContext):
 
 <b>{message.text}</b>'''
 
-            for admin_id in ADMIN_IDS:
-                try:
-                    await bot.send_message(admin_id,
-                                           admin_notification,
-                                           parse_mode=ParseMode.HTML)
-                except Exception as e:
-                    logging.error(
-                        f"Ошибка отправки сообщения пользователя админу {admin_id}: {e}"
-                    )
+            await notifier.publish(admin_notification, user_id, 'user_reply',
+                                   admin_ids=tenant.admin_ids)
 
             await message.reply("Ваше сообщение отправлено администраторам.")
             return
@@ -2006,91 +2314,263 @@ async def update_status_message_for_creator(game_id: int, round_id: int):
         participants = await db.get_bride_participants(game_id)
         answers = await db.get_bride_answers(round_id)
         answered_user_ids = {answer['user_id'] for answer in answers}
+        await edit_bride_status_message(status_info, participants, answered_user_ids)
 
-        bride = next((p for p in participants if p['is_bride']), None)
-        if not bride:
-            return
+    except Exception as e:
+        logging.error(f"Ошибка обновления статус-сообщения: {e}")
 
-        # Получаем информацию о женихе
-        bride_user = await bot.get_chat(bride['user_id'])
 
-        # Формируем обновленное сообщение
-        status_text = f"Жених {bride_user.full_name} - ответил\n"
+async def edit_bride_status_message(status_info: dict, participants: list,
+                                    answered_user_ids: set):
+    """Перерисовывает сообщение создателя игры со статусом ответов участников"""
+    bride = next((p for p in participants if p['is_bride']), None)
+    if not bride:
+        return
 
-        # Добавляем участников с их статусом в случайном порядке
-        active_participants = [
-            p for p in participants if not p['is_bride'] and not p['is_out']
-        ]
-        # Перемешиваем список участников случайным образом
-        random.shuffle(active_participants)
+    # Добавляем участников с их статусом в случайном порядке
+    active_participants = [
+        p for p in participants if not p['is_bride'] and not p['is_out']
+    ]
+    # Перемешиваем список участников случайным образом
+    random.shuffle(active_participants)
+
+    # Имена жениха и участников запрашиваются параллельно
+    bride_user, *users = await asyncio.gather(
+        bot.get_chat(bride['user_id']),
+        *(bot.get_chat(p['user_id']) for p in active_participants),
+        return_exceptions=True)
+    if isinstance(bride_user, Exception):
+        raise bride_user
+
+    # Формируем обновленное сообщение
+    status_text = f"Жених {bride_user.full_name} - ответил\n"
+    for participant, participant_user in zip(active_participants, users):
+        status = "ответил" if participant[
+            'user_id'] in answered_user_ids else "не ответил"
+        if isinstance(participant_user, Exception):
+            logging.error(
+                f"Ошибка получения информации об участнике {participant['user_id']}: {participant_user}"
+            )
+            status_text += f"Участник {participant['user_id']} - {status}\n"
+        else:
+            status_text += f"{participant_user.full_name} - {status}\n"
 
-        for participant in active_participants:
-            try:
-                participant_user = await bot.get_chat(participant['user_id'])
-                status = "ответил" if participant[
-                    'user_id'] in answered_user_ids else "не ответил"
-                status_text += f"{participant_user.full_name} - {status}\n"
-            except Exception as e:
-                logging.error(
-                    f"Ошибка получения информации об участнике {participant['user_id']}: {e}"
-                )
-                status = "ответил" if participant[
-                    'user_id'] in answered_user_ids else "не ответил"
-                status_text += f"Участник {participant['user_id']} - {status}\n"
+    # Обновляем сообщение
+    await bot.edit_message_text(chat_id=status_info['creator_id'],
+                                message_id=status_info['message_id'],
+                                text=status_text.strip())
 
-        # Обновляем сообщение
-        await bot.edit_message_text(chat_id=status_info['creator_id'],
-                                    message_id=status_info['message_id'],
-                                    text=status_text.strip())
 
-    except Exception as e:
-        logging.error(f"Ошибка обновления статус-сообщения: {e}")
+def setup_scheduler():
+    """Регистрирует фоновые задачи обслуживания БД"""
+    if scheduler.jobs:
+        return
+    scheduler.add_job("cleanup_expired_applications",
+                      db.cleanup_expired_applications,
+                      interval=3600, jitter=60, timeout=60, run_on_start=True)
+    scheduler.add_job("delete_old_applications",
+                      db.delete_old_applications,
+                      at="04:00", jitter=300, timeout=120)
+    scheduler.add_job("cleanup_finished_game_state",
+                      db.cleanup_finished_game_state,
+                      interval=3600, jitter=60, timeout=120)
+    scheduler.add_job("archive_finished_games", retention.run,
+                      at="03:30", jitter=300, timeout=900)
+    scheduler.add_job("cleanup_admin_notices", db.cleanup_admin_notices,
+                      at="04:30", jitter=300, timeout=120)
+    scheduler.add_job("backfill_stats", db.backfill_stats,
+                      at="05:00", jitter=300, timeout=600, run_on_start=True)
+
+
+async def serve_updates():
+    """Polling (или прием в очередь), пока экземпляр держит аренду;
+    без аренды - ожидание в резерве.
+
+    При SIGTERM ведущий останавливает polling, подтверждает полученные
+    апдейты и сразу отпускает аренду, так что резервный экземпляр
+    продолжает работу меньше чем через секунду.
+    """
+    if not LEADER_ELECTION:
+        if BOT_MODE == 'ingest':
+            await ingest.run()
+        else:
+            await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
+        return
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set():
+            acquiring = asyncio.create_task(leader.acquire())
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait({acquiring, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if not acquiring.done():
+                acquiring.cancel()
+                await asyncio.gather(acquiring, stopping, return_exceptions=True)
+                break
+            stopping.cancel()
+            acquiring.result()
+
+            if BOT_MODE == 'ingest':
+                polling = asyncio.create_task(ingest.run())
+            else:
+                polling = asyncio.create_task(dp.start_polling(
+                    bot, allowed_updates=ALLOWED_UPDATES, handle_signals=False,
+                    close_bot_session=False))
+            lost = asyncio.create_task(leader.wait_lost())
+            stopping = asyncio.create_task(stop.wait())
+            done = set()
+            try:
+                done, _ = await asyncio.wait({polling, lost, stopping},
+                                             return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if not polling.done():
+                    try:
+                        if BOT_MODE == 'ingest':
+                            # Пачка апдейтов либо записана, либо будет получена снова
+                            polling.cancel()
+                        else:
+                            await dp.stop_polling()
+                    except RuntimeError:
+                        # polling еще не успел запуститься
+                        polling.cancel()
+                await asyncio.gather(polling, return_exceptions=True)
+                for task in (lost, stopping):
+                    task.cancel()
+                await asyncio.gather(lost, stopping, return_exceptions=True)
+                if leader.is_leader:
+                    await update_offsets.confirm(bot)
+                    await leader.release()
+            if not polling.cancelled() and polling.exception():
+                raise polling.exception()
+            if polling in done:
+                # polling завершился сам: дальше работать нечему
+                break
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await leader.release()
+        await bot.session.close()
+
+
+async def run_worker():
+    """Обработка апдейтов из очереди до SIGTERM (начатые апдейты дорабатываются)"""
+    worker = QueueWorker(db, dp, bot)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run(QUEUE_CHANNEL)
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await bot.session.close()
 
 
 async def main():
     max_retries = 3
     retry_count = 0
-
-    while retry_count < max_retries:
+    startup.mark('imports')
+
+    # Метрики запускаются до подключения к БД, чтобы /healthz отвечал сразу
+    metrics_runner = None
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    watchdog = None
+    if LOOP_WATCHDOG_MS:
+        watchdog = LoopWatchdog(LOOP_WATCHDOG_MS / 1000)
+        watchdog.start()
+    if LOOP_SLOW_CALLBACK_MS:
+        enable_slow_callback_log(LOOP_SLOW_CALLBACK_MS / 1000)
+    if METRICS_PORT:
         try:
-            # Подключаемся к базе данных
-            if not await db.connect():
-                retry_count += 1
-                if retry_count >= max_retries:
-                    logging.error(
-                        "Не удалось подключиться к базе данных после нескольких попыток. Остановка бота."
-                    )
-                    return
-                logging.warning(
-                    f"Попытка подключения к БД {retry_count}/{max_retries}")
-                await asyncio.sleep(5)
-                continue
-
-            # Загружаем данные из БД
-            await load_data_from_db()
-
-            logging.info("Bot started")
-            await dp.start_polling(
-                bot,
-                allowed_updates=["message", "chat_member", "callback_query"])
-            break
+            metrics_runner = await start_metrics_server(
+                METRICS_PORT, health_check=lambda: db.ping(HEALTH_CHECK_TIMEOUT))
         except Exception as e:
-            retry_count += 1
-            logging.error(
-                f"Ошибка подключения (попытка {retry_count}/{max_retries}): {e}"
-            )
-            if retry_count >= max_retries:
-                logging.error(
-                    "Максимальное количество попыток подключения исчерпано")
-                raise
-            await asyncio.sleep(10)
-        finally:
-            # Закрываем соединение с БД при остановке
+            logging.error(f"Ошибка запуска сервера метрик: {e}")
+
+    try:
+        while retry_count < max_retries:
+            warm_up_task = None
             try:
-                await db.close()
-            except Exception as e:
-                logging.error(f"Ошибка закрытия БД: {e}")
+                # Подключение к БД и getMe независимы и идут параллельно;
+                # polling берет bot.me() из кэша
+                connected, me = await asyncio.gather(
+                    startup.run('db_connect', db.connect()),
+                    startup.run('get_me', bot.me()),
+                    return_exceptions=True)
+                if connected is not True:
+                    retry_count += 1
+                    if retry_count >= max_retries:
+                        logging.error(
+                            "Не удалось подключиться к базе данных после нескольких попыток. Остановка бота."
+                        )
+                        return
+                    logging.warning(
+                        f"Попытка подключения к БД {retry_count}/{max_retries}")
+                    await asyncio.sleep(5)
+                    continue
+                if isinstance(me, Exception):
+                    raise me
+
+                # Подписка на изменения - до загрузки кэшей, чтобы не пропустить
+                # изменения, сделанные между загрузкой и подпиской
+                try:
+                    await startup.run('invalidation_bus', invalidations.start())
+                except Exception as e:
+                    logging.error(f"Шина инвалидации кэшей не запущена: {e}")
+
+                # Сообщества нужны до первого апдейта: по ним выбирается группа
+                await startup.run('tenants', tenants.load())
+                question_pool.start()
 
+                # Запускаем фоновые задачи
+                setup_scheduler()
+                scheduler.start()
+
+                # Состояние из БД и пул подсказок догружаются уже при работающем polling
+                startup.log("Bot started")
+                warm_up_task = asyncio.create_task(warm_up(startup))
+                if BOT_MODE == 'worker':
+                    await run_worker()
+                else:
+                    await serve_updates()
+                break
+            except Exception as e:
+                retry_count += 1
+                logging.error(
+                    f"Ошибка подключения (попытка {retry_count}/{max_retries}): {e}"
+                )
+                if retry_count >= max_retries:
+                    logging.error(
+                        "Максимальное количество попыток подключения исчерпано")
+                    raise
+                await asyncio.sleep(10)
+            finally:
+                # Останавливаем фоновые задачи и закрываем соединение с БД
+                if warm_up_task:
+                    warm_up_task.cancel()
+                    await asyncio.gather(warm_up_task, return_exceptions=True)
+                await scheduler.stop()
+                await invalidations.stop()
+                await notifier.close()
+                await recruitments.close_all()
+                await question_pool.close()
+                try:
+                    await db.close()
+                except Exception as e:
+                    logging.error(f"Ошибка закрытия БД: {e}")
+
+    finally:
+        lag_task.cancel()
+        if watchdog:
+            watchdog.stop()
+        if recorder:
+            await recorder.close()
+        await close_llm()
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from metrics import Counter, Gauge, registry
+
+member_lookups = registry.register(Counter(
+    'bot_member_directory_lookups_total',
+    'Запросы к справочнику участников: hit - из памяти, miss - из базы', ('result',)))
+_hits = member_lookups.labels('hit')
+_misses = member_lookups.labels('miss')
+
+
+class Member:
+    """Роль, подпись и эмодзи пользователя (registered - есть строка в user_data)"""
+    __slots__ = ('role', 'custom_title', 'emoji', 'registered')
+
+    def __init__(self, role: Optional[str] = None, custom_title: Optional[str] = None,
+                 emoji: Optional[str] = None, registered: bool = False):
+        self.role = role
+        self.custom_title = custom_title
+        self.emoji = emoji
+        self.registered = registered
+
+    @property
+    def empty(self) -> bool:
+        return not self.registered and self.emoji is None
+
+
+class MemberDirectory:
+    """Справочник участников: user_data и user_emojis в памяти процесса.
+
+    Загружается целиком при старте (load) и дальше обновляется при записи:
+    изменения идут через методы справочника, которые пишут в базу и сразу
+    обновляют запись в памяти. После загрузки отсутствие пользователя в
+    справочнике означает, что данных о нем нет, и база не запрашивается.
+    До загрузки и для пользователей, измененных другим процессом
+    (invalidate), данные читаются из базы и кэшируются.
+
+    Записи хранятся по сообществам: у пользователя своя роль и свой эмодзи в
+    каждом сообществе. Уведомления об изменениях приходят по user_id, поэтому
+    измененный пользователь перечитывается сразу во всех сообществах.
+
+    Методы повторяют одноименные методы хранилища и возвращают то же самое.
+    """
+
+    def __init__(self, database):
+        self.db = database
+        # group_id -> user_id -> запись
+        self._members: Dict[int, Dict[int, Member]] = {}
+        self._loaded = False
+        # Пользователи, измененные другим процессом: следующий запрос - в базу
+        self._stale: Set[int] = set()
+        # Пользователи, записанные во время загрузки: их строки из снимка устарели
+        self._touched: Optional[Set[int]] = None
+        self._writes = 0
+        registry.register(Gauge('bot_member_directory_size',
+                                'Пользователи в справочнике участников',
+                                lambda: [((), len(self))]))
+
+    def __len__(self):
+        return sum(len(members) for members in self._members.values())
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    async def load(self):
+        """Загрузка всех пользователей одним снимком user_data и user_emojis"""
+        self._touched = set()
+        try:
+            user_data, emojis = await asyncio.gather(self.db.get_all_user_data(),
+                                                     self.db.get_all_emojis())
+        except Exception as e:
+            # Без загрузки справочник продолжает читать пользователей из базы
+            logging.error(f"Ошибка загрузки справочника участников: {e}")
+            return
+        finally:
+            touched, self._touched = self._touched, None
+
+        members = _collect(user_data, emojis)
+        for user_id in touched:
+            if user_id not in self._stale:
+                # Запись в памяти новее снимка
+                _replace_user(members, user_id, {
+                    group_id: group_members[user_id]
+                    for group_id, group_members in self._members.items()
+                    if user_id in group_members})
+            else:
+                # Неизвестно, попала ли запись в снимок: прочитаем заново
+                _replace_user(members, user_id, {})
+                self._stale.add(user_id)
+        self._members = members
+        self._loaded = True
+        logging.info(f"Справочник участников загружен: {len(self)}")
+
+    async def invalidate(self, user_id: Optional[int]):
+        """Строка user_data или user_emojis изменена другим процессом"""
+        if user_id is None:
+            # Уведомления могли быть пропущены: до перезагрузки читаем из базы
+            self._loaded = False
+            self._members.clear()
+            await self.load()
+            return
+        self._stale.add(user_id)
+
+    async def get(self, group_id: int, user_id: int) -> Optional[Member]:
+        member = self._members.get(group_id, {}).get(user_id)
+        if user_id not in self._stale and (member is not None or self._loaded):
+            _hits.inc()
+            return member
+        _misses.inc()
+        writes = self._writes
+        # Пользователь перечитывается во всех сообществах (см. invalidate)
+        user_data, emojis = await asyncio.gather(self.db.get_all_user_data(user_id),
+                                                 self.db.get_all_emojis(user_id))
+        members = _collect(user_data, emojis)
+        # Запись, сделанная во время чтения, новее прочитанного
+        if writes == self._writes:
+            self._stale.discard(user_id)
+            _replace_user(self._members, user_id, {
+                member_group: group_members[user_id]
+                for member_group, group_members in members.items()})
+        return members.get(group_id, {}).get(user_id)
+
+    async def get_user_data(self, group_id: int, user_id: int) -> Dict:
+        member = await self.get(group_id, user_id)
+        if member is None or not member.registered:
+            return {}
+        return {'role': member.role, 'custom_title': member.custom_title}
+
+    async def get_emoji(self, group_id: int, user_id: int) -> Optional[str]:
+        member = await self.get(group_id, user_id)
+        return member.emoji if member is not None else None
+
+    async def get_used_emojis(self, group_id: int) -> List[str]:
+        if not self._loaded or self._stale:
+            return await self.db.get_used_emojis(group_id)
+        return [m.emoji for m in self._members.get(group_id, {}).values()
+                if m.emoji is not None]
+
+    async def save_user_data(self, group_id: int, user_id: int, role: str = None,
+                             custom_title: str = None):
+        await self.db.save_user_data(group_id, user_id, role=role, custom_title=custom_title)
+        member = self._written(group_id, user_id)
+        if member is not None:
+            if role is not None:
+                member.role = role
+            if custom_title is not None:
+                member.custom_title = custom_title
+            member.registered = True
+
+    async def update_user_role(self, group_id: int, user_id: int, new_role: str):
+        await self.db.update_user_role(group_id, user_id, new_role)
+        member = self._written(group_id, user_id)
+        if member is not None and member.registered:
+            member.role = new_role
+
+    async def remove_user_data(self, group_id: int, user_id: int):
+        await self.db.remove_user_data(group_id, user_id)
+        member = self._written(group_id, user_id)
+        if member is not None:
+            member.role = member.custom_title = None
+            member.registered = False
+            self._store(group_id, user_id, member)
+
+    async def save_emoji(self, group_id: int, user_id: int, emoji: str):
+        await self.db.save_emoji(group_id, user_id, emoji)
+        member = self._written(group_id, user_id)
+        if member is not None:
+            member.emoji = emoji
+
+    async def remove_emoji(self, group_id: int, user_id: int):
+        await self.db.remove_emoji(group_id, user_id)
+        member = self._written(group_id, user_id)
+        if member is not None:
+            member.emoji = None
+            self._store(group_id, user_id, member)
+
+    def _written(self, group_id: int, user_id: int) -> Optional[Member]:
+        """Запись пользователя для обновления после записи в базу.
+
+        None - пользователь неизвестен и не загружен: прочитается при запросе.
+        """
+        self._writes += 1
+        if self._touched is not None:
+            self._touched.add(user_id)
+        member = self._members.get(group_id, {}).get(user_id)
+        if user_id in self._stale or (member is None and not self._loaded):
+            return None
+        if member is None:
+            member = self._members.setdefault(group_id, {})[user_id] = Member()
+        return member
+
+    def _store(self, group_id: int, user_id: int, member: Member):
+        if member.empty:
+            group_members = self._members.get(group_id, {})
+            group_members.pop(user_id, None)
+            if not group_members:
+                self._members.pop(group_id, None)
+        else:
+            self._members.setdefault(group_id, {})[user_id] = member
+
+
+def _collect(user_data: Dict[Tuple[int, int], Dict],
+             emojis: Dict[Tuple[int, int], str]) -> Dict[int, Dict[int, Member]]:
+    """Записи справочника из строк user_data и user_emojis по (group_id, user_id)"""
+    members: Dict[int, Dict[int, Member]] = {}
+    for (group_id, user_id), data in user_data.items():
+        members.setdefault(group_id, {})[user_id] = Member(
+            data['role'], data['custom_title'], registered=True)
+    for (group_id, user_id), emoji in emojis.items():
+        member = members.setdefault(group_id, {}).get(user_id)
+        if member is None:
+            members[group_id][user_id] = Member(emoji=emoji)
+        else:
+            member.emoji = emoji
+    return members
+
+
+def _replace_user(members: Dict[int, Dict[int, Member]], user_id: int,
+                  by_group: Dict[int, Member]):
+    """Замена записей пользователя во всех сообществах"""
+    for group_id in list(members):
+        group_members = members[group_id]
+        group_members.pop(user_id, None)
+        if not group_members:
+            del members[group_id]
+    for group_id, member in by_group.items():
+        if not member.empty:
+            members.setdefault(group_id, {})[user_id] = member
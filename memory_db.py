@@ -0,0 +1,1191 @@
+import json
+import sys
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from roles import similar_roles
+from storage import IntegrityError, Storage
+
+# Статусы незавершенной игры "Жених"
+ACTIVE_GAME_STATUSES = ('waiting', 'started')
+APPLICATION_TTL = timedelta(days=5)
+WAITLIST_TTL = timedelta(days=30)
+
+
+class _Row:
+    """Базовый класс строк: компактные объекты со __slots__ вместо словарей"""
+    __slots__ = ()
+
+    def as_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Group(_Row):
+    __slots__ = ('group_id', 'group_link', 'admin_ids', 'list_admin_ids', 'title',
+                 'active', 'updated_at')
+
+    def __init__(self, group_id, group_link, admin_ids, list_admin_ids, title, now):
+        self.group_id = group_id
+        self.group_link = group_link
+        self.admin_ids = admin_ids
+        self.list_admin_ids = list_admin_ids
+        self.title = title
+        self.active = True
+        self.updated_at = now
+
+
+class _UserData(_Row):
+    __slots__ = ('group_id', 'user_id', 'role', 'custom_title', 'created_at', 'updated_at')
+
+    def __init__(self, group_id, user_id, role, custom_title, now):
+        self.group_id = group_id
+        self.user_id = user_id
+        self.role = role
+        self.custom_title = custom_title
+        self.created_at = now
+        self.updated_at = now
+
+
+class _Role(_Row):
+    __slots__ = ('role_id', 'group_id', 'role_key', 'role', 'user_id')
+
+    def __init__(self, role_id, group_id, role_key, role, user_id):
+        self.role_id = role_id
+        self.group_id = group_id
+        self.role_key = role_key
+        self.role = role
+        self.user_id = user_id
+
+
+class _Quiz(_Row):
+    __slots__ = ('quiz_id', 'chat_id', 'question', 'answers', 'correct_indices',
+                 'creator_id', 'active', 'created_at')
+
+    def __init__(self, quiz_id, chat_id, question, answers, correct_indices,
+                 creator_id, now):
+        self.quiz_id = quiz_id
+        self.chat_id = chat_id
+        self.question = question
+        self.answers = tuple(answers)
+        self.correct_indices = tuple(correct_indices)
+        self.creator_id = creator_id
+        self.active = True
+        self.created_at = now
+
+    def as_dict(self) -> Dict:
+        return {'quiz_id': self.quiz_id, 'chat_id': self.chat_id,
+                'question': self.question, 'answers': list(self.answers),
+                'correct_indices': list(self.correct_indices),
+                'creator_id': self.creator_id, 'active': self.active}
+
+
+class _Membership(_Row):
+    __slots__ = ('id', 'group_id', 'user_id', 'joined_at', 'left_at')
+
+    def __init__(self, row_id, group_id, user_id, joined_at, left_at=None):
+        self.id = row_id
+        self.group_id = group_id
+        self.user_id = user_id
+        self.joined_at = joined_at
+        self.left_at = left_at
+
+
+class _Application(_Row):
+    __slots__ = ('user_id', 'role', 'group_id', 'created_at', 'expires_at')
+
+    def __init__(self, user_id, role, group_id, now):
+        self.user_id = user_id
+        self.role = role
+        self.group_id = group_id
+        self.created_at = now
+        self.expires_at = now + APPLICATION_TTL
+
+
+class _PendingApplication(_Row):
+    __slots__ = ('user_id', 'role', 'group_id', 'submitted_at', 'waitlisted_at')
+
+    def __init__(self, user_id, role, group_id, now):
+        self.user_id = user_id
+        self.role = role
+        self.group_id = group_id
+        self.submitted_at = now
+        self.waitlisted_at = None
+
+
+class _Session(_Row):
+    __slots__ = ('session_id', 'creator_id', 'created_at', 'started', 'group_id')
+
+    def __init__(self, session_id, creator_id, now, group_id):
+        self.session_id = session_id
+        self.creator_id = creator_id
+        self.created_at = now
+        self.started = False
+        self.group_id = group_id
+
+
+class _SessionParticipant(_Row):
+    __slots__ = ('user_id', 'user_number', 'eliminated', 'is_bride')
+
+    def __init__(self, user_id, user_number, is_bride):
+        self.user_id = user_id
+        self.user_number = user_number
+        self.eliminated = False
+        self.is_bride = is_bride
+
+
+class _Game(_Row):
+    __slots__ = ('game_id', 'group_id', 'creator_id', 'status', 'current_round',
+                 'bride_id', 'message_id', 'created_at', 'finished_at')
+
+    def __init__(self, game_id, group_id, creator_id, now):
+        self.game_id = game_id
+        self.group_id = group_id
+        self.creator_id = creator_id
+        self.status = 'waiting'
+        self.current_round = 1
+        self.bride_id = None
+        self.message_id = None
+        self.created_at = now
+        self.finished_at = None
+
+
+class _Participant(_Row):
+    __slots__ = ('game_id', 'user_id', 'number', 'is_out', 'is_bride')
+
+    def __init__(self, game_id, user_id, number, is_bride):
+        self.game_id = game_id
+        self.user_id = user_id
+        self.number = number
+        self.is_out = False
+        self.is_bride = is_bride
+
+
+class _Round(_Row):
+    __slots__ = ('round_id', 'game_id', 'round_number', 'question', 'voted_out')
+
+    def __init__(self, round_id, game_id, round_number, question):
+        self.round_id = round_id
+        self.game_id = game_id
+        self.round_number = round_number
+        self.question = question
+        self.voted_out = None
+
+
+class _BrideHistory(_Row):
+    __slots__ = ('user_id', 'was_bride_count', 'last_bride_game', 'games_since_bride')
+
+    def __init__(self, user_id, was_bride_count=0, last_bride_game=None, games_since_bride=0):
+        self.user_id = user_id
+        self.was_bride_count = was_bride_count
+        self.last_bride_game = last_bride_game
+        self.games_since_bride = games_since_bride
+
+
+class _RoundStatus(_Row):
+    __slots__ = ('round_id', 'creator_id', 'message_id', 'created_at')
+
+    def __init__(self, round_id, creator_id, message_id, now):
+        self.round_id = round_id
+        self.creator_id = creator_id
+        self.message_id = message_id
+        self.created_at = now
+
+
+class _Notice(_Row):
+    __slots__ = ('notice_id', 'user_id', 'kind', 'text', 'status', 'created_at')
+
+    def __init__(self, notice_id, user_id, kind, text, now):
+        self.notice_id = notice_id
+        self.user_id = user_id
+        self.kind = kind
+        self.text = text
+        self.status = None
+        self.created_at = now
+
+
+class _NoticeMessage(_Row):
+    __slots__ = ('user_id', 'kind', 'notice_id', 'created_at', 'edit_mode')
+
+    def __init__(self, user_id, kind, notice_id, now, edit_mode):
+        self.user_id = user_id
+        self.kind = kind
+        self.notice_id = notice_id
+        self.created_at = now
+        self.edit_mode = edit_mode
+
+
+class _QueuedUpdate(_Row):
+    __slots__ = ('update_id', 'partition_key', 'payload', 'received_at', 'claimed_by',
+                 'claimed_at', 'attempts')
+
+    def __init__(self, update_id, partition_key, payload, now):
+        self.update_id = update_id
+        self.partition_key = partition_key
+        self.payload = payload
+        self.received_at = now
+        self.claimed_by = None
+        self.claimed_at = None
+        self.attempts = 0
+
+
+class MemoryDatabase(Storage):
+    """Хранилище в памяти процесса с той же семантикой, что и Database.
+
+    Таблицы - словари по первичному ключу со строками-объектами (__slots__),
+    для горячих запросов поддерживаются вторичные индексы. Данные не
+    сохраняются между запусками; предназначено для тестов и бенчмарков.
+    """
+
+    def __init__(self):
+        self._connected = False
+        self._sequences: Dict[str, int] = {}
+        self._locks: Set[Tuple[int, int]] = set()
+        self.job_runs: Dict[str, datetime] = {}
+
+        self.groups: Dict[int, _Group] = {}
+        # (group_id, user_id) -> эмодзи / данные пользователя в сообществе
+        self.user_emojis: Dict[Tuple[int, int], str] = {}
+        self.user_data: Dict[Tuple[int, int], _UserData] = {}
+        # (group_id, role_key) -> роль
+        self.roles: Dict[Tuple[int, str], _Role] = {}
+        self.quizzes: Dict[int, _Quiz] = {}
+        # quiz_id -> user_id -> (answer_index, created_at)
+        self.quiz_answers: Dict[int, Dict[int, Tuple[int, datetime]]] = {}
+
+        # user_id -> интервалы во всех сообществах
+        self.membership: Dict[int, List[_Membership]] = {}
+        # (group_id, user_id) -> открытый интервал
+        self._open_membership: Dict[Tuple[int, int], _Membership] = {}
+
+        self.applications: Dict[int, _Application] = {}
+        self.pending_applications: Dict[int, _PendingApplication] = {}
+
+        self.sessions: Dict[int, _Session] = {}
+        self.session_participants: Dict[int, Dict[int, _SessionParticipant]] = {}
+
+        self.games: Dict[int, _Game] = {}
+        self._active_games: Dict[int, Set[int]] = {}
+        self.participants: Dict[int, Dict[int, _Participant]] = {}
+        self.rounds: Dict[int, _Round] = {}
+        self._game_rounds: Dict[int, List[int]] = {}
+        # round_id -> user_id -> answer
+        self.answers: Dict[int, Dict[int, str]] = {}
+        self.bride_history: Dict[int, _BrideHistory] = {}
+
+        # (game_id, round_id, message_type) -> message_id
+        self.pinned: Dict[Tuple[int, int, str], int] = {}
+        self._game_pinned: Dict[int, Set[Tuple[int, int, str]]] = {}
+        self.round_status: Dict[int, _RoundStatus] = {}
+        self.participant_status: Dict[int, Dict[int, bool]] = {}
+        self.archive: Dict[int, Dict] = {}
+
+        self.stats: Dict[Tuple[int, date, str, str], int] = {}
+        self.notices: Dict[int, _Notice] = {}
+        self.notice_messages: Dict[Tuple[int, int], _NoticeMessage] = {}
+        self._notice_copies: Dict[int, List[Tuple[int, int]]] = {}
+
+        self.updates_queue: Dict[int, _QueuedUpdate] = {}
+        # partition_key -> update_id по порядку
+        self._queue_partitions: Dict[int, List[int]] = {}
+        # key -> (state, data)
+        self.fsm_states: Dict[str, Tuple[Optional[str], Dict]] = {}
+
+    def _next_id(self, sequence: str) -> int:
+        value = self._sequences.get(sequence, 0) + 1
+        self._sequences[sequence] = value
+        return value
+
+    def _bump_stat(self, group_id: int, metric: str, key: str = '', delta: int = 1):
+        stat_key = (group_id, date.today(), metric, key or '')
+        self.stats[stat_key] = self.stats.get(stat_key, 0) + delta
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self) -> bool:
+        self._connected = True
+        return True
+
+    async def close(self):
+        self._connected = False
+
+    async def ping(self, timeout: float) -> bool:
+        return self._connected
+
+    async def connect_dedicated(self, purpose: str):
+        # Один процесс: координация с другими процессами не нужна
+        return None
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        # Изменения в памяти применяются сразу, откат не поддерживается
+        yield None
+
+    @asynccontextmanager
+    async def job_lock(self, namespace: int, key: int, name: str,
+                       min_interval: float, force: bool = False):
+        lock_key = (namespace, key)
+        if lock_key in self._locks:
+            yield False
+            return
+        last_run = self.job_runs.get(name)
+        due = (force or last_run is None
+               or (datetime.now() - last_run).total_seconds() >= min_interval)
+        self._locks.add(lock_key)
+        try:
+            yield due
+        finally:
+            self._locks.discard(lock_key)
+
+    async def record_job_run(self, name: str):
+        self.job_runs[name] = datetime.now()
+
+    # Эмодзи
+    async def save_emoji(self, group_id: int, user_id: int, emoji: str):
+        self.user_emojis[group_id, user_id] = emoji
+
+    async def get_emoji(self, group_id: int, user_id: int) -> Optional[str]:
+        return self.user_emojis.get((group_id, user_id))
+
+    async def get_all_emojis(self, user_id: int = None) -> Dict[Tuple[int, int], str]:
+        return {key: emoji for key, emoji in self.user_emojis.items()
+                if user_id is None or key[1] == user_id}
+
+    async def remove_emoji(self, group_id: int, user_id: int):
+        self.user_emojis.pop((group_id, user_id), None)
+
+    async def get_used_emojis(self, group_id: int) -> List[str]:
+        return [emoji for (emoji_group, _), emoji in self.user_emojis.items()
+                if emoji_group == group_id]
+
+    # Данные пользователей
+    async def save_user_data(self, group_id: int, user_id: int, role: str = None,
+                             custom_title: str = None):
+        now = datetime.now()
+        row = self.user_data.get((group_id, user_id))
+        if row is None:
+            self.user_data[group_id, user_id] = _UserData(group_id, user_id, role,
+                                                          custom_title, now)
+            return
+        if role is not None:
+            row.role = role
+        if custom_title is not None:
+            row.custom_title = custom_title
+        row.updated_at = now
+
+    async def get_user_data(self, group_id: int, user_id: int) -> Dict:
+        row = self.user_data.get((group_id, user_id))
+        if row:
+            return {'role': row.role, 'custom_title': row.custom_title}
+        return {}
+
+    async def get_all_user_data(self, user_id: int = None) -> Dict[Tuple[int, int], Dict]:
+        return {key: {'role': row.role, 'custom_title': row.custom_title}
+                for key, row in self.user_data.items()
+                if user_id is None or row.user_id == user_id}
+
+    async def remove_user_data(self, group_id: int, user_id: int):
+        self.user_data.pop((group_id, user_id), None)
+
+    async def update_user_role(self, group_id: int, user_id: int, new_role: str):
+        row = self.user_data.get((group_id, user_id))
+        if row is not None:
+            row.role = new_role
+            row.updated_at = datetime.now()
+
+    # Реестр ролей
+    async def get_roles(self) -> List[Dict]:
+        return [row.as_dict() for row in self.roles.values()]
+
+    async def get_role(self, role_id: int) -> Optional[Dict]:
+        for row in self.roles.values():
+            if row.role_id == role_id:
+                return row.as_dict()
+        return None
+
+    async def take_role(self, group_id: int, role_key: str, role: str,
+                        user_id: int) -> Optional[Dict]:
+        row = self.roles.get((group_id, role_key))
+        if row is None:
+            row = self.roles[group_id, role_key] = _Role(self._next_id('roles'), group_id,
+                                                         role_key, role, None)
+        elif row.user_id is not None and row.user_id != user_id:
+            return None
+        for other in self.roles.values():
+            if other.group_id == group_id and other.user_id == user_id and other is not row:
+                other.user_id = None
+        row.role = role
+        row.user_id = user_id
+        return row.as_dict()
+
+    async def release_roles(self, group_id: int, user_id: int) -> List[Dict]:
+        released = []
+        for row in self.roles.values():
+            if row.group_id == group_id and row.user_id == user_id:
+                row.user_id = None
+                released.append(row.as_dict())
+        return released
+
+    async def find_similar_roles(self, group_id: int, role_key: str, limit: int) -> List[Dict]:
+        return similar_roles(role_key, (row.as_dict() for row in self.roles.values()
+                                        if row.group_id == group_id), limit)
+
+    # Викторины
+    async def save_quiz(self, quiz_id: int, chat_id: int, question: str, answers: List[str],
+                        correct_indices: List[int], creator_id: int):
+        row = self.quizzes.get(quiz_id)
+        if row is None:
+            self.quizzes[quiz_id] = _Quiz(quiz_id, chat_id, question, answers,
+                                          correct_indices, creator_id, datetime.now())
+            return
+        row.question = question
+        row.answers = tuple(answers)
+        row.correct_indices = tuple(correct_indices)
+        row.active = True
+
+    async def get_quiz(self, quiz_id: int) -> Optional[Dict]:
+        row = self.quizzes.get(quiz_id)
+        return row.as_dict() if row else None
+
+    async def get_all_active_quizzes(self) -> Dict[int, Dict]:
+        return {quiz_id: row.as_dict() for quiz_id, row in self.quizzes.items() if row.active}
+
+    async def deactivate_quiz(self, quiz_id: int):
+        row = self.quizzes.get(quiz_id)
+        if row is not None:
+            row.active = False
+
+    async def delete_quiz(self, quiz_id: int):
+        self.quiz_answers.pop(quiz_id, None)
+        self.quizzes.pop(quiz_id, None)
+
+    async def save_quiz_answer(self, quiz_id: int, user_id: int, answer_index: int):
+        answers = self.quiz_answers.setdefault(quiz_id, {})
+        previous = answers.get(user_id)
+        if previous is None:
+            answers[user_id] = (answer_index, datetime.now())
+            quiz = self.quizzes.get(quiz_id)
+            if quiz is not None:
+                self._bump_stat(quiz.chat_id, 'quiz_answers')
+        else:
+            answers[user_id] = (answer_index, previous[1])
+
+    async def get_quiz_participants(self, quiz_id: int) -> Dict[int, int]:
+        return {user_id: answer[0]
+                for user_id, answer in self.quiz_answers.get(quiz_id, {}).items()}
+
+    # История пребывания в группе
+    async def record_user_join(self, group_id: int, user_id: int, joined_at: datetime = None):
+        if (group_id, user_id) in self._open_membership:
+            return
+        row = _Membership(self._next_id('user_membership'), group_id, user_id,
+                          joined_at or datetime.now())
+        self.membership.setdefault(user_id, []).append(row)
+        self._open_membership[group_id, user_id] = row
+        self._bump_stat(group_id, 'joins')
+
+    async def record_user_leave(self, group_id: int, user_id: int, left_at: datetime = None):
+        left_at = left_at or datetime.now()
+        row = self._open_membership.pop((group_id, user_id), None)
+        if row is not None:
+            row.left_at = left_at
+        else:
+            # Вход пользователя не был зафиксирован (например, до запуска бота)
+            self.membership.setdefault(user_id, []).append(
+                _Membership(self._next_id('user_membership'), group_id, user_id, None, left_at))
+        self._bump_stat(group_id, 'leaves')
+
+    async def get_user_history(self, user_id: int) -> List[Dict]:
+        rows = sorted(self.membership.get(user_id, ()),
+                      key=lambda r: (r.joined_at is not None, r.joined_at or datetime.min))
+        return [{'joined_at': r.joined_at, 'left_at': r.left_at} for r in rows]
+
+    async def get_user_join_periods(self, user_id: int) -> List[Tuple[str, str]]:
+        rows = sorted((r for r in self.membership.get(user_id, ())
+                       if r.joined_at is not None and r.left_at is not None),
+                      key=lambda r: r.joined_at)
+        return [(r.joined_at.strftime('%d.%m.%y'), r.left_at.strftime('%d.%m.%y'))
+                for r in rows]
+
+    async def get_members_at(self, moment: datetime) -> List[int]:
+        return [user_id for user_id, rows in self.membership.items()
+                if any(r.joined_at is not None and r.joined_at <= moment
+                       and (r.left_at is None or r.left_at > moment) for r in rows)]
+
+    async def get_membership_churn(self, start: datetime, end: datetime) -> List[Dict]:
+        days: Dict[date, List[int]] = {}
+        for rows in self.membership.values():
+            for r in rows:
+                if r.joined_at is not None and start <= r.joined_at < end:
+                    days.setdefault(r.joined_at.date(), [0, 0])[0] += 1
+                if r.left_at is not None and start <= r.left_at < end:
+                    days.setdefault(r.left_at.date(), [0, 0])[1] += 1
+        return [{'day': day, 'joins': joins, 'leaves': leaves}
+                for day, (joins, leaves) in sorted(days.items())]
+
+    # Игра "Жених"
+    def _set_game_status(self, game: _Game, status: str):
+        game.status = status
+        active = self._active_games.setdefault(game.group_id, set())
+        if status in ACTIVE_GAME_STATUSES:
+            active.add(game.game_id)
+        else:
+            active.discard(game.game_id)
+
+    def _delete_game(self, game_id: int):
+        """Удаление игры с каскадом на участников, раунды и ответы"""
+        game = self.games.pop(game_id, None)
+        if game is None:
+            return
+        self._active_games.get(game.group_id, set()).discard(game_id)
+        self.participants.pop(game_id, None)
+        for round_id in self._game_rounds.pop(game_id, ()):
+            self.rounds.pop(round_id, None)
+            self.answers.pop(round_id, None)
+
+    async def create_bride_game(self, group_id: int, creator_id: int) -> int:
+        game_id = self._next_id('bride_games')
+        game = self.games[game_id] = _Game(game_id, group_id, creator_id, datetime.now())
+        self._set_game_status(game, 'waiting')
+        return game_id
+
+    async def join_bride_game(self, game_id: int, user_id: int) -> bool:
+        try:
+            self._insert_participant(game_id, user_id, None, False)
+            return True
+        except IntegrityError:
+            return False
+
+    async def get_bride_game(self, game_id: int) -> Optional[Dict]:
+        game = self.games.get(game_id)
+        return game.as_dict() if game else None
+
+    async def get_active_bride_game(self, group_id: int) -> Optional[Dict]:
+        active = self._active_games.get(group_id)
+        if not active:
+            return None
+        game = max((self.games[game_id] for game_id in active),
+                   key=lambda g: (g.created_at, g.game_id))
+        return game.as_dict()
+
+    def _insert_participant(self, game_id: int, user_id: int, number, is_bride: bool):
+        if game_id not in self.games:
+            raise IntegrityError(f"bride_games: игра {game_id} не найдена")
+        participants = self.participants.setdefault(game_id, {})
+        if user_id in participants:
+            raise IntegrityError(f"bride_participants: ({game_id}, {user_id}) уже существует")
+        participants[user_id] = _Participant(game_id, user_id, number, is_bride)
+
+    async def add_bride_game_participant(self, game_id: int, user_id: int, number: int = None,
+                                         is_bride: bool = False):
+        self._insert_participant(game_id, user_id, number, is_bride)
+
+        # Увеличиваем счетчик игр для всех участников (кроме жениха)
+        if not is_bride:
+            history = self.bride_history.get(user_id)
+            if history is None:
+                self.bride_history[user_id] = _BrideHistory(user_id, 0, None, 1)
+            else:
+                history.games_since_bride = (history.games_since_bride or 0) + 1
+
+    def _sorted_rounds(self, game_id: int) -> List[_Round]:
+        return sorted((self.rounds[round_id] for round_id in self._game_rounds.get(game_id, ())),
+                      key=lambda r: r.round_number)
+
+    async def get_bride_rounds(self, game_id: int) -> List[Dict]:
+        return [r.as_dict() for r in self._sorted_rounds(game_id)]
+
+    async def get_bride_participants(self, game_id: int) -> List[Dict]:
+        participants = self.participants.get(game_id, {})
+        return [participants[user_id].as_dict() for user_id in sorted(participants)]
+
+    async def start_bride_game(self, game_id: int, bride_id: int):
+        game = self.games.get(game_id)
+        if game is not None:
+            if game.status == 'waiting':
+                self._bump_stat(game.group_id, 'bride_games_started')
+            self._set_game_status(game, 'started')
+            game.bride_id = bride_id
+
+        participant = self.participants.get(game_id, {}).get(bride_id)
+        if participant is not None:
+            participant.is_bride = True
+
+    async def create_bride_round(self, game_id: int, round_number: int, question: str) -> int:
+        if game_id not in self.games:
+            raise IntegrityError(f"bride_games: игра {game_id} не найдена")
+        round_id = self._next_id('bride_rounds')
+        self.rounds[round_id] = _Round(round_id, game_id, round_number, question)
+        self._game_rounds.setdefault(game_id, []).append(round_id)
+        return round_id
+
+    async def save_bride_answer(self, round_id: int, user_id: int, answer: str):
+        if round_id not in self.rounds:
+            raise IntegrityError(f"bride_rounds: раунд {round_id} не найден")
+        self.answers.setdefault(round_id, {})[user_id] = answer
+
+    async def get_bride_answers(self, round_id: int) -> List[Dict]:
+        round_row = self.rounds.get(round_id)
+        if round_row is None:
+            return []
+        participants = self.participants.get(round_row.game_id, {})
+        result = []
+        for user_id, answer in self.answers.get(round_id, {}).items():
+            participant = participants.get(user_id)
+            if participant is not None:
+                result.append({'round_id': round_id, 'user_id': user_id,
+                               'answer': answer, 'number': participant.number})
+        return result
+
+    async def vote_out_participant(self, game_id: int, user_id: int, round_id: int):
+        user_id = int(user_id) if isinstance(user_id, str) else user_id
+        participant = self.participants.get(game_id, {}).get(user_id)
+        if participant is not None:
+            participant.is_out = True
+        round_row = self.rounds.get(round_id)
+        if round_row is not None:
+            round_row.voted_out = user_id
+
+    async def finish_bride_game(self, game_id: int):
+        game = self.games.get(game_id)
+        if game is not None:
+            if game.status != 'finished':
+                self._bump_stat(game.group_id, 'bride_games_finished')
+            self._set_game_status(game, 'finished')
+            game.finished_at = datetime.now()
+
+    async def get_current_bride_round(self, game_id: int) -> Optional[Dict]:
+        rounds = self._sorted_rounds(game_id)
+        return rounds[-1].as_dict() if rounds else None
+
+    async def get_recent_bride_questions(self, limit: int = 500) -> List[str]:
+        round_ids = sorted(self.rounds, reverse=True)[:limit]
+        return [self.rounds[round_id].question for round_id in round_ids
+                if self.rounds[round_id].question is not None]
+
+    # Сессии набора в игру "Жених"
+    async def create_bride_session(self, creator_id: int, group_id: int) -> int:
+        session_id = self._next_id('bride_game_sessions')
+        self.sessions[session_id] = _Session(session_id, creator_id, datetime.now(), group_id)
+        return session_id
+
+    async def join_bride_session(self, session_id: int, user_id: int) -> Optional[int]:
+        session = self.sessions.get(session_id)
+        if session is None or session.started:
+            return None
+        participants = self.session_participants.setdefault(session_id, {})
+        if user_id in participants:
+            return None
+        participants[user_id] = _SessionParticipant(
+            user_id, self._next_id('bride_join_seq'), False)
+        return len(participants)
+
+    async def get_bride_session_participants(self, session_id: int) -> List[Dict]:
+        return [p.as_dict() for p in self.session_participants.get(session_id, {}).values()]
+
+    async def eliminate_bride_participant(self, session_id: int, user_number: int):
+        for participant in self.session_participants.get(session_id, {}).values():
+            if participant.user_number == user_number:
+                participant.eliminated = True
+
+    async def delete_bride_session(self, session_id: int):
+        self.session_participants.pop(session_id, None)
+        self.sessions.pop(session_id, None)
+
+    async def start_bride_session(self, session_id: int):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.started = True
+
+    async def get_active_bride_session(self, group_id: int) -> Optional[Dict]:
+        for session in self.sessions.values():
+            if not session.started and session.group_id in (group_id, None):
+                return session.as_dict()
+        return None
+
+    # Заявки
+    async def save_pending_application(self, user_id: int, role: str, group_id: int):
+        row = self.pending_applications.get(user_id)
+        if row is None:
+            self.pending_applications[user_id] = _PendingApplication(user_id, role, group_id,
+                                                                     datetime.now())
+        else:
+            row.role = role
+            row.submitted_at = datetime.now()
+            if row.group_id != group_id:
+                row.waitlisted_at = None
+            row.group_id = group_id
+        self._bump_stat(group_id, 'applications', role)
+
+    async def delete_old_applications(self) -> int:
+        now = datetime.now()
+        expired = [user_id for user_id, row in self.pending_applications.items()
+                   if (row.submitted_at < now - APPLICATION_TTL if row.waitlisted_at is None
+                       else row.waitlisted_at < now - WAITLIST_TTL)]
+        for user_id in expired:
+            del self.pending_applications[user_id]
+        return len(expired)
+
+    async def join_waitlist(self, user_id: int, role: str, group_id: int):
+        now = datetime.now()
+        row = self.pending_applications.get(user_id)
+        if row is None:
+            row = self.pending_applications[user_id] = _PendingApplication(user_id, role,
+                                                                           group_id, now)
+        row.role = role
+        if row.waitlisted_at is None or row.group_id != group_id:
+            row.waitlisted_at = now
+        row.group_id = group_id
+
+    async def leave_waitlist(self, user_id: int, group_id: int):
+        row = self.pending_applications.get(user_id)
+        if row is not None and row.group_id == group_id:
+            row.waitlisted_at = None
+
+    async def pop_waitlist(self, group_id: int) -> Optional[Dict]:
+        queued = [row for row in self.pending_applications.values()
+                  if row.waitlisted_at is not None and row.group_id == group_id]
+        if not queued:
+            return None
+        row = min(queued, key=lambda r: (r.waitlisted_at, r.user_id))
+        row.waitlisted_at = None
+        return {'user_id': row.user_id, 'role': row.role, 'submitted_at': row.submitted_at}
+
+    async def get_application_role(self, user_id: int) -> Optional[str]:
+        row = self.pending_applications.get(user_id)
+        return row.role if row else None
+
+    async def save_application(self, user_id: int, role: str, group_id: int):
+        self.applications[user_id] = _Application(user_id, role, group_id, datetime.now())
+        self._bump_stat(group_id, 'applications', role)
+
+    async def save_application_internal(self, user_id: int, role: str):
+        previous = self.applications.get(user_id)
+        self.applications[user_id] = _Application(
+            user_id, role, previous.group_id if previous else None, datetime.now())
+
+    async def get_application(self, user_id: int) -> Optional[Dict]:
+        row = self.applications.get(user_id)
+        if row is None or row.expires_at <= datetime.now():
+            return None
+        return row.as_dict()
+
+    async def update_application_role(self, user_id: int, new_role: str):
+        row = self.applications.get(user_id)
+        if row is not None:
+            row.role = new_role
+
+    async def delete_application(self, user_id: int):
+        self.applications.pop(user_id, None)
+
+    async def cleanup_expired_applications(self) -> int:
+        now = datetime.now()
+        expired = [user_id for user_id, row in self.applications.items()
+                   if row.expires_at <= now]
+        for user_id in expired:
+            del self.applications[user_id]
+        return len(expired)
+
+    # История женихов
+    async def get_bride_history(self, user_id: int) -> Optional[Dict]:
+        history = self.bride_history.get(user_id)
+        return history.as_dict() if history else None
+
+    async def update_bride_history(self, user_id: int):
+        history = self.bride_history.get(user_id)
+        if history is None:
+            self.bride_history[user_id] = _BrideHistory(user_id, 1, datetime.now(), 0)
+            return
+        history.was_bride_count += 1
+        history.last_bride_game = datetime.now()
+        history.games_since_bride = 0
+
+    async def reset_bride_status(self, user_id: int):
+        history = self.bride_history.get(user_id)
+        if history is not None:
+            history.was_bride_count = 0
+            history.games_since_bride = 0
+
+    # Служебные сообщения игры
+    async def save_pinned_message(self, game_id: int, round_id: int, message_id: int,
+                                  message_type: str):
+        key = (game_id, round_id, message_type)
+        self.pinned[key] = message_id
+        self._game_pinned.setdefault(game_id, set()).add(key)
+
+    async def get_pinned_message(self, round_id: int, message_type: str) -> int:
+        round_row = self.rounds.get(round_id)
+        if round_row is not None:
+            message_id = self.pinned.get((round_row.game_id, round_id, message_type))
+            if message_id is not None:
+                return message_id
+        # Раунд уже удален - ищем по всем записям
+        for (_, pinned_round, pinned_type), message_id in self.pinned.items():
+            if pinned_round == round_id and pinned_type == message_type:
+                return message_id
+        return None
+
+    async def get_game_pinned_messages(self, game_id: int) -> List[int]:
+        return [self.pinned[key] for key in self._game_pinned.get(game_id, ())]
+
+    async def delete_game_pinned_messages(self, game_id: int):
+        for key in self._game_pinned.pop(game_id, ()):
+            self.pinned.pop(key, None)
+
+    async def save_round_status_message(self, round_id: int, creator_id: int, message_id: int):
+        row = self.round_status.get(round_id)
+        if row is None:
+            self.round_status[round_id] = _RoundStatus(round_id, creator_id, message_id,
+                                                       datetime.now())
+        else:
+            row.message_id = message_id
+
+    async def get_round_status_message(self, round_id: int) -> Optional[Dict]:
+        row = self.round_status.get(round_id)
+        return row.as_dict() if row else None
+
+    async def delete_round_status_message(self, round_id: int):
+        self.round_status.pop(round_id, None)
+
+    async def get_participant_answer_status(self, round_id: int, user_id: int) -> bool:
+        return user_id in self.answers.get(round_id, {})
+
+    async def get_all_participants_status(self, game_id: int, round_id: int) -> Dict[int, bool]:
+        answered = self.answers.get(round_id, {})
+        return {user_id: user_id in answered
+                for user_id, p in self.participants.get(game_id, {}).items()
+                if not p.is_bride and not p.is_out}
+
+    # Сообщества
+    async def get_groups(self) -> List[Dict]:
+        return [row.as_dict() for row in self.groups.values() if row.active]
+
+    async def get_group(self, group_id: int) -> Optional[Dict]:
+        row = self.groups.get(group_id)
+        return row.as_dict() if row is not None and row.active else None
+
+    async def save_group(self, group_id: int, group_link: str, admin_ids: List[int],
+                         list_admin_ids: List[int] = (), title: str = None):
+        self.groups[group_id] = _Group(group_id, group_link, list(admin_ids),
+                                       list(list_admin_ids), title, datetime.now())
+
+    async def deactivate_group(self, group_id: int):
+        row = self.groups.get(group_id)
+        if row is not None:
+            row.active = False
+            row.updated_at = datetime.now()
+
+    # Очередь апдейтов
+    async def enqueue_updates(self, updates: List[Tuple[int, int, str]]) -> int:
+        now = datetime.now()
+        inserted = 0
+        for update_id, partition_key, payload in updates:
+            if update_id in self.updates_queue:
+                continue
+            self.updates_queue[update_id] = _QueuedUpdate(update_id, partition_key, payload, now)
+            partition = self._queue_partitions.setdefault(partition_key, [])
+            partition.append(update_id)
+            partition.sort()
+            inserted += 1
+        return inserted
+
+    async def claim_updates(self, worker_id: str, limit: int,
+                            claim_timeout: float) -> List[Dict]:
+        now = datetime.now()
+        stale = now - timedelta(seconds=claim_timeout)
+        heads = sorted((self.updates_queue[partition[0]]
+                        for partition in self._queue_partitions.values()),
+                       key=lambda row: row.update_id)
+        claimed = []
+        for row in heads:
+            if len(claimed) >= limit:
+                break
+            if row.claimed_at is not None and row.claimed_at >= stale:
+                continue
+            row.claimed_by = worker_id
+            row.claimed_at = now
+            row.attempts += 1
+            claimed.append({'update_id': row.update_id, 'payload': row.payload,
+                            'attempts': row.attempts,
+                            'wait': (now - row.received_at).total_seconds()})
+        return claimed
+
+    async def complete_updates(self, update_ids: List[int]):
+        for update_id in update_ids:
+            row = self.updates_queue.pop(update_id, None)
+            if row is None:
+                continue
+            partition = self._queue_partitions[row.partition_key]
+            partition.remove(update_id)
+            if not partition:
+                del self._queue_partitions[row.partition_key]
+
+    # Состояния FSM
+    async def get_fsm(self, key: str) -> Optional[Dict]:
+        if key not in self.fsm_states:
+            return None
+        state, data = self.fsm_states[key]
+        return {'state': state, 'data': json.loads(json.dumps(data))}
+
+    async def set_fsm_state(self, key: str, state: Optional[str]):
+        _, data = self.fsm_states.get(key, (None, {}))
+        self.fsm_states[key] = (state, data)
+
+    async def set_fsm_data(self, key: str, data: Dict):
+        state, _ = self.fsm_states.get(key, (None, {}))
+        if not data and state is None:
+            self.fsm_states.pop(key, None)
+        elif data or key in self.fsm_states:
+            # Копия через JSON: как и в Postgres, сохраняются только JSON-значения
+            self.fsm_states[key] = (state, json.loads(json.dumps(data)))
+
+    # Восстановление состояния при запуске
+    async def get_recovery_state(self, group_id: int) -> Dict:
+        quizzes = {quiz_id: quiz for quiz_id, quiz in (await self.get_all_active_quizzes()).items()
+                   if quiz['chat_id'] == group_id}
+        state = {'quizzes': quizzes,
+                 'quiz_participants': {quiz_id: await self.get_quiz_participants(quiz_id)
+                                       for quiz_id in quizzes},
+                 'game': await self.get_active_bride_game(group_id), 'rounds': [],
+                 'participants': [], 'answers': [], 'pinned_messages': []}
+        if state['game'] is None:
+            return state
+        game_id = state['game']['game_id']
+        for round_row in self._sorted_rounds(game_id):
+            status = self.round_status.get(round_row.round_id)
+            state['rounds'].append({**round_row.as_dict(),
+                                    'status_creator_id': status and status.creator_id,
+                                    'status_message_id': status and status.message_id})
+        state['participants'] = await self.get_bride_participants(game_id)
+        if state['rounds']:
+            state['answers'] = await self.get_bride_answers(state['rounds'][-1]['round_id'])
+        state['pinned_messages'] = await self.get_game_pinned_messages(game_id)
+        return state
+
+    async def save_participant_status_snapshot(self, round_id: int,
+                                               participant_statuses: Dict[int, bool]):
+        self.participant_status.setdefault(round_id, {}).update(participant_statuses)
+
+    async def get_participant_status_snapshot(self, round_id: int) -> Dict[int, bool]:
+        return dict(self.participant_status.get(round_id, {}))
+
+    def _round_is_active(self, round_id: int) -> bool:
+        round_row = self.rounds.get(round_id)
+        if round_row is None:
+            return False
+        game = self.games.get(round_row.game_id)
+        return game is not None and game.status in ACTIVE_GAME_STATUSES
+
+    async def cleanup_finished_game_state(self) -> Dict[str, int]:
+        participant_status = [round_id for round_id in self.participant_status
+                              if not self._round_is_active(round_id)]
+        participant_rows = 0
+        for round_id in participant_status:
+            participant_rows += len(self.participant_status.pop(round_id))
+
+        round_status = [round_id for round_id in self.round_status
+                        if not self._round_is_active(round_id)]
+        for round_id in round_status:
+            del self.round_status[round_id]
+
+        pinned = 0
+        for game_id in list(self._game_pinned):
+            game = self.games.get(game_id)
+            if game is None or game.status not in ACTIVE_GAME_STATUSES:
+                pinned += len(self._game_pinned[game_id])
+                await self.delete_game_pinned_messages(game_id)
+
+        return {
+            'bride_participant_status': participant_rows,
+            'bride_round_status': len(round_status),
+            'bride_pinned_messages': pinned,
+        }
+
+    # Хранение истории
+    def _archive_record(self, game: _Game) -> Dict:
+        participants = sorted(self.participants.get(game.game_id, {}).values(),
+                              key=lambda p: (p.number is not None, p.number or 0))
+        rounds = [[r.round_number, r.question, r.voted_out,
+                   [[user_id, answer] for user_id, answer in self.answers.get(r.round_id, {}).items()]]
+                  for r in self._sorted_rounds(game.game_id)]
+        return {
+            'game_id': game.game_id,
+            'group_id': game.group_id,
+            'creator_id': game.creator_id,
+            'bride_id': game.bride_id,
+            'created_at': game.created_at,
+            'finished_at': game.finished_at or game.created_at,
+            'participants': json.dumps([[p.user_id, p.number, p.is_out, p.is_bride]
+                                        for p in participants], ensure_ascii=False),
+            'rounds': json.dumps(rounds, ensure_ascii=False),
+        }
+
+    async def archive_finished_games(self, older_than_days: int, batch_size: int = 100,
+                                     exporter=None) -> int:
+        threshold = datetime.now() - timedelta(days=older_than_days)
+        game_ids = sorted(game_id for game_id, game in self.games.items()
+                          if game.status == 'finished'
+                          and (game.finished_at or game.created_at) < threshold)[:batch_size]
+        if not game_ids:
+            return 0
+        records = [self._archive_record(self.games[game_id]) for game_id in game_ids]
+        if exporter is not None:
+            await exporter(records)
+        else:
+            for record in records:
+                self.archive.setdefault(record['game_id'], record)
+        for game_id in game_ids:
+            await self.delete_game_pinned_messages(game_id)
+            self._delete_game(game_id)
+        return len(game_ids)
+
+    async def get_table_sizes(self) -> List[Dict]:
+        tables = {
+            'groups': self.groups,
+            'user_emojis': self.user_emojis,
+            'user_data': self.user_data,
+            'active_quizzes': self.quizzes,
+            'quiz_participants': self.quiz_answers,
+            'user_membership': self.membership,
+            'active_applications': self.applications,
+            'pending_applications': self.pending_applications,
+            'bride_game_sessions': self.sessions,
+            'bride_game_participants': self.session_participants,
+            'bride_games': self.games,
+            'bride_participants': self.participants,
+            'bride_rounds': self.rounds,
+            'bride_answers': self.answers,
+            'bride_history': self.bride_history,
+            'bride_pinned_messages': self.pinned,
+            'bride_round_status': self.round_status,
+            'bride_participant_status': self.participant_status,
+            'bride_games_archive': self.archive,
+            'stats_daily': self.stats,
+            'admin_notices': self.notices,
+            'admin_notice_messages': self.notice_messages,
+            'updates_queue': self.updates_queue,
+            'fsm_states': self.fsm_states,
+        }
+        rows = []
+        for name, table in tables.items():
+            # Для вложенных таблиц считаем строки второго уровня
+            values = list(table.values())
+            nested = values and isinstance(values[0], (dict, list))
+            row_count = sum(len(v) for v in values) if nested else len(values)
+            size = sys.getsizeof(table) + sum(sys.getsizeof(v) for v in values)
+            rows.append({'table_name': name, 'total_bytes': size, 'row_estimate': row_count})
+        rows.sort(key=lambda row: row['total_bytes'], reverse=True)
+        return rows
+
+    # Уведомления админам
+    async def create_admin_notice(self, user_id: int, kind: str, text: str) -> int:
+        notice_id = self._next_id('admin_notice_seq')
+        self.notices[notice_id] = _Notice(notice_id, user_id, kind, text, datetime.now())
+        return notice_id
+
+    async def save_admin_notice_copies(self, notice_id: Optional[int],
+                                       copies: List[Tuple[int, int, Optional[str]]],
+                                       user_id: int, kind: str):
+        now = datetime.now()
+        for chat_id, message_id, edit_mode in copies:
+            key = (chat_id, message_id)
+            if key in self.notice_messages:
+                continue
+            self.notice_messages[key] = _NoticeMessage(user_id, kind, notice_id, now, edit_mode)
+            if notice_id is not None:
+                self._notice_copies.setdefault(notice_id, []).append(key)
+
+    async def find_admin_notice_message(self, admin_chat_id: int, message_id: int) -> Optional[Dict]:
+        row = self.notice_messages.get((admin_chat_id, message_id))
+        if row is None:
+            return None
+        return {'user_id': row.user_id, 'kind': row.kind, 'notice_id': row.notice_id}
+
+    async def get_admin_notice(self, notice_id: int) -> Optional[Dict]:
+        notice = self.notices.get(notice_id)
+        if notice is None:
+            return None
+        copies = []
+        for key in self._notice_copies.get(notice_id, ()):
+            row = self.notice_messages.get(key)
+            if row is not None:
+                copies.append((key[0], key[1], row.edit_mode))
+        return {'user_id': notice.user_id, 'kind': notice.kind, 'text': notice.text,
+                'status': notice.status, 'copies': copies}
+
+    async def update_admin_notice_status(self, notice_id: int, status: str):
+        notice = self.notices.get(notice_id)
+        if notice is not None:
+            notice.status = status
+
+    async def cleanup_admin_notices(self, older_than_days: int = 30) -> int:
+        threshold = datetime.now() - timedelta(days=older_than_days)
+        expired = [key for key, row in self.notice_messages.items() if row.created_at < threshold]
+        for key in expired:
+            row = self.notice_messages.pop(key)
+            copies = self._notice_copies.get(row.notice_id)
+            if copies is not None:
+                copies.remove(key)
+                if not copies:
+                    del self._notice_copies[row.notice_id]
+        for notice_id in [n for n, row in self.notices.items() if row.created_at < threshold]:
+            del self.notices[notice_id]
+        return len(expired)
+
+    # Статистика
+    async def get_stats_summary(self, group_id: int) -> List[Dict]:
+        today = date.today()
+        summary: Dict[Tuple[str, str], List[int]] = {}
+        for (stat_group, day, metric, key), value in self.stats.items():
+            age = (today - day).days
+            if stat_group != group_id or age >= 30:
+                continue
+            totals = summary.setdefault((metric, key), [0, 0, 0])
+            if age == 0:
+                totals[0] += value
+            if age < 7:
+                totals[1] += value
+            totals[2] += value
+        rows = [{'metric': metric, 'key': key, 'today': today_value, 'week': week, 'month': month}
+                for (metric, key), (today_value, week, month) in summary.items()]
+        rows.sort(key=lambda row: (row['metric'], -row['month'], row['key']))
+        return rows
+
+    async def backfill_stats(self) -> int:
+        raw: Dict[Tuple[int, date, str, str], int] = {}
+
+        def add(group_id, moment, metric, key=''):
+            if group_id is not None and moment is not None:
+                raw_key = (group_id, moment.date(), metric, key)
+                raw[raw_key] = raw.get(raw_key, 0) + 1
+
+        for rows in self.membership.values():
+            for r in rows:
+                add(r.group_id, r.joined_at, 'joins')
+                add(r.group_id, r.left_at, 'leaves')
+        for row in self.applications.values():
+            add(row.group_id, row.created_at, 'applications', row.role or '')
+        for row in self.pending_applications.values():
+            # Заявки с подтверждением текстом попадают сюда только для очереди
+            if row.user_id not in self.applications:
+                add(row.group_id, row.submitted_at, 'applications', row.role or '')
+        for quiz_id, answers in self.quiz_answers.items():
+            quiz = self.quizzes.get(quiz_id)
+            if quiz is None:
+                continue
+            for _, created_at in answers.values():
+                add(quiz.chat_id, created_at, 'quiz_answers')
+        for game in self.games.values():
+            if game.status in ('started', 'finished'):
+                add(game.group_id, game.created_at, 'bride_games_started')
+            if game.status == 'finished':
+                add(game.group_id, game.finished_at or game.created_at, 'bride_games_finished')
+        for record in self.archive.values():
+            add(record['group_id'], record['created_at'], 'bride_games_started')
+            add(record['group_id'], record['finished_at'], 'bride_games_finished')
+
+        for stat_key, value in raw.items():
+            self.stats[stat_key] = max(self.stats.get(stat_key, 0), value)
+        return len(raw)
@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+# Границы гистограмм задержек (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # Последняя ячейка - +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values) -> Any:
+        """Дочерняя метрика для набора меток (создается один раз и переиспользуется)"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"
+                for values, child in self._children.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labelnames, values, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Метрика-значение, вычисляемая в момент сбора"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+                 collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]],
+                 labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _render_samples(self) -> List[str]:
+        try:
+            samples = list(self.collect())
+        except Exception as e:
+            logging.error(f"Ошибка сбора метрики {self.name}: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {value}"
+                for values, value in samples]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+update_latency = registry.register(Histogram(
+    'bot_update_duration_seconds', 'Время обработки апдейта', ('event_type',)))
+update_errors = registry.register(Counter(
+    'bot_update_errors_total', 'Необработанные ошибки при обработке апдейта', ('event_type',)))
+handler_latency = registry.register(Histogram(
+    'bot_handler_duration_seconds', 'Время выполнения хендлера', ('handler',)))
+handler_errors = registry.register(Counter(
+    'bot_handler_errors_total', 'Ошибки в хендлерах', ('handler',)))
+api_latency = registry.register(Histogram(
+    'bot_api_request_duration_seconds', 'Время запроса к Bot API', ('method',)))
+api_errors = registry.register(Counter(
+    'bot_api_request_errors_total', 'Ошибки запросов к Bot API', ('method',)))
+loop_lag = registry.register(Histogram(
+    'bot_event_loop_lag_seconds', 'Задержка цикла событий',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+
+
+def register_pool_gauges(database):
+    """Метрики пула соединений asyncpg (размер, свободные, занятые)"""
+    def collect():
+        # У хранилища в памяти пула нет
+        pool = getattr(database, 'pool', None)
+        if not pool:
+            return []
+        size = pool.get_size()
+        idle = pool.get_idle_size()
+        return [(('size',), size),
+                (('idle',), idle),
+                (('busy',), size - idle),
+                (('max',), pool.get_max_size())]
+
+    registry.register(Gauge('bot_db_pool_connections', 'Соединения пула БД',
+                            collect, ('state',)))
+
+
+def register_job_gauges(scheduler):
+    """Метрики фоновых задач планировщика"""
+    def collect():
+        samples = []
+        for name, stats in scheduler.stats().items():
+            samples.append(((name, 'runs'), stats['runs']))
+            samples.append(((name, 'failures'), stats['failures']))
+            samples.append(((name, 'timeouts'), stats['timeouts']))
+            samples.append(((name, 'skipped'), stats['skipped']))
+            samples.append(((name, 'last_duration_seconds'), stats['last_duration']))
+        return samples
+
+    registry.register(Gauge('bot_job', 'Статистика фоновых задач', collect,
+                            ('job', 'stat')))
+
+
+class StartupTimer:
+    """Разбивка времени запуска по шагам: пишется в лог и в /metrics"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.steps: Dict[str, float] = {}
+
+    def record(self, step: str, seconds: float):
+        self.steps[step] = seconds
+
+    def mark(self, step: str):
+        """Шаг, который длится с момента старта процесса"""
+        self.record(step, time.perf_counter() - self.started)
+
+    async def run(self, step: str, awaitable: Awaitable):
+        """Выполняет шаг запуска и запоминает его длительность"""
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(step, time.perf_counter() - started)
+
+    def log(self, title: str):
+        parts = ', '.join(f"{step} {seconds * 1000:.0f} мс" for step, seconds in self.steps.items())
+        logging.info(f"{title} через {(time.perf_counter() - self.started) * 1000:.0f} мс: {parts}")
+
+
+def register_startup_gauges(timer: StartupTimer):
+    registry.register(Gauge('bot_startup_seconds', 'Длительность шагов запуска',
+                            lambda: [((step,), seconds) for step, seconds in timer.steps.items()],
+                            ('step',)))
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: общая задержка и ошибки по типу события"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        event_type = getattr(event, 'event_type', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update_errors.labels(event_type).inc()
+            raise
+        finally:
+            update_latency.labels(event_type).observe(time.perf_counter() - started)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: задержка и ошибки конкретного хендлера"""
+
+    def __init__(self):
+        # Дочерние метрики кэшируются по объекту хендлера
+        self._children: Dict[int, Tuple[Any, Any]] = {}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        key = id(handler_object)
+        children = self._children.get(key)
+        if children is None:
+            name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+            children = self._children[key] = (handler_latency.labels(name),
+                                               handler_errors.labels(name))
+        latency, errors = children
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            latency.observe(time.perf_counter() - started)
+
+
+class InstrumentedSession(AiohttpSession):
+    """Сессия aiohttp с замером времени запросов к Bot API"""
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await super().make_request(bot, method, timeout)
+        except Exception:
+            api_errors.labels(name).inc()
+            raise
+        finally:
+            api_latency.labels(name).observe(time.perf_counter() - started)
+
+
+def setup_dispatcher_metrics(dp):
+    """Подключение middleware метрик к диспетчеру"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_middleware = HandlerMetricsMiddleware()
+    for observer in (dp.message, dp.callback_query, dp.chat_member):
+        observer.middleware(handler_middleware)
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """Периодически измеряет задержку цикла событий"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(loop.time() - started - interval, 0.0))
+
+
+async def start_metrics_server(port: int,
+                               health_check: Callable[[], Awaitable[bool]] = None):
+    """HTTP-сервер с эндпоинтами /metrics и /healthz"""
+    from aiohttp import web
+
+    async def metrics_view(request):
+        return web.Response(text=registry.render(),
+                            content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def health_view(request):
+        healthy = await health_check() if health_check else True
+        return web.json_response({'status': 'ok' if healthy else 'degraded'},
+                                 status=200 if healthy else 503)
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_view)
+    app.router.add_get('/healthz', health_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    logging.info(f"Метрики доступны на порту {port}")
+    return runner
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+from typing import Callable, Optional
+
+from llm import LLMService, get_llm, normalize_prompt
+
+# Сколько готовых подсказок держать в пуле и при каком остатке его пополнять
+BRIDE_SUGGESTIONS_TARGET = int(os.environ.get('BRIDE_SUGGESTIONS_TARGET', '12'))
+BRIDE_SUGGESTIONS_LOW = int(os.environ.get('BRIDE_SUGGESTIONS_LOW', '4'))
+# Сколько прошлых вопросов из bride_rounds учитывается при отсеве повторов
+BRIDE_QUESTIONS_HISTORY = 500
+
+SUGGESTION_SYSTEM = (
+    "Ты помогаешь вести игру \"Жених\" в телеграм-чате. Жених задает участникам "
+    "вопрос, а потом по ответам выбирает, кто выбывает. Пиши на русском."
+)
+SUGGESTION_PROMPT = (
+    "Придумай {count} коротких вопросов от жениха к участникам: веселых, "
+    "неожиданных, без пошлости, с ответом в одну-две фразы. "
+    "Каждый вопрос с новой строки, без нумерации и пояснений."
+)
+MIN_QUESTION_LENGTH = 10
+MAX_QUESTION_LENGTH = 200
+# Нумерация, маркеры списка и кавычки, которые модель добавляет к строкам
+_LIST_PREFIX_RE = re.compile(r'^\s*(?:\d+[.)]|[-*•])\s*')
+
+
+def clean_question(line: str) -> Optional[str]:
+    """Вопрос из строки ответа модели или None, если строка не подходит"""
+    question = _LIST_PREFIX_RE.sub('', line).strip().strip('"«»').strip()
+    # Вопрос уходит в сообщения с HTML-разметкой
+    question = question.replace('<', '').replace('>', '')
+    if not MIN_QUESTION_LENGTH <= len(question) <= MAX_QUESTION_LENGTH:
+        return None
+    if not question.endswith('?'):
+        return None
+    return question
+
+
+class QuestionPool:
+    """Заранее сгенерированные вопросы для жениха.
+
+    Подсказка выдается из пула сразу, без ожидания LLM. Когда в пуле
+    остается BRIDE_SUGGESTIONS_LOW вопросов, он пополняется в фоне.
+    Повторы отсеиваются по уже заданным вопросам (bride_rounds) и по уже
+    выданным подсказкам.
+    """
+
+    def __init__(self, database, llm_factory: Callable[[], Optional[LLMService]] = get_llm,
+                 target: int = BRIDE_SUGGESTIONS_TARGET, low: int = BRIDE_SUGGESTIONS_LOW):
+        self.db = database
+        self._llm_factory = llm_factory
+        self.target = target
+        self.low = low
+        self._pool = deque()
+        self._seen = set()
+        self._history_loaded = False
+        self._refill_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._llm_factory() is not None
+
+    def __len__(self):
+        return len(self._pool)
+
+    def start(self):
+        """Первое заполнение пула (в фоне)"""
+        self._maybe_refill()
+
+    def take(self) -> Optional[str]:
+        """Готовый вопрос или None, если пул пуст"""
+        question = self._pool.popleft() if self._pool else None
+        self._maybe_refill()
+        return question
+
+    def mark_used(self, question: str):
+        """Вопрос задан в игре: больше его не предлагать"""
+        self._seen.add(normalize_prompt(question))
+
+    def _maybe_refill(self):
+        if len(self._pool) > self.low or not self.enabled:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        llm = self._llm_factory()
+        try:
+            if not self._history_loaded:
+                for question in await self.db.get_recent_bride_questions(BRIDE_QUESTIONS_HISTORY):
+                    self.mark_used(question)
+                self._history_loaded = True
+
+            # Несколько попыток: часть вопросов может оказаться повторами
+            for _ in range(3):
+                missing = self.target - len(self._pool)
+                if missing <= 0:
+                    break
+                text = await llm.complete(
+                    SUGGESTION_PROMPT.format(count=missing + 2), SUGGESTION_SYSTEM,
+                    max_tokens=80 * (missing + 2), temperature=1.0, use_cache=False)
+                if not text:
+                    break
+                for line in text.splitlines():
+                    question = clean_question(line)
+                    key = question and normalize_prompt(question)
+                    if key and key not in self._seen:
+                        self._seen.add(key)
+                        self._pool.append(question)
+            logging.info(f"Пул подсказок для жениха: {len(self._pool)} вопросов")
+        except Exception as e:
+            logging.error(f"Ошибка пополнения пула вопросов: {e}")
+
+    async def wait_ready(self):
+        """Ожидание текущего пополнения пула (отмена ожидания его не прерывает)"""
+        if self._refill_task and not self._refill_task.done():
+            await asyncio.shield(self._refill_task)
+
+    async def close(self):
+        if self._refill_task and not self._refill_task.done():
+            self._refill_task.cancel()
+            await asyncio.gather(self._refill_task, return_exceptions=True)
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# Запись входящих апдейтов в JSONL для последующего воспроизведения (replay.py).
+# Пустое значение - запись выключена
+RECORD_UPDATES_FILE = os.environ.get('RECORD_UPDATES_FILE', '')
+# Соль для псевдонимизации ID и текстов. Пустое значение - для каждого файла
+# записи генерируется случайная соль (псевдонимы не совпадают между файлами)
+RECORD_SALT = os.environ.get('RECORD_SALT', '')
+# Сохранять тексты сообщений и имена пользователей без изменений (только с
+# согласия пользователей). По умолчанию они заменяются хешами
+RECORD_RAW_TEXT = os.environ.get('RECORD_RAW_TEXT', '') == '1'
+
+# Поля с именами пользователей, которые заменяются псевдонимами
+NAME_FIELDS = ('first_name', 'last_name', 'username')
+# Поля, которые удаляются из записи целиком
+DROPPED_FIELDS = ('phone_number', 'contact', 'location', 'venue', 'bio',
+                  'birthdate', 'business_location')
+# Поля с ID пользователей (ID групп отрицательные и не меняются)
+ID_FIELDS = ('id', 'user_id', 'chat_id')
+# Текстовые поля: заменяются хешами, а при RECORD_RAW_TEXT в них заменяются
+# уже встреченные ID (например, в уведомлениях админам)
+TEXT_FIELDS = ('text', 'caption', 'file_name')
+# ID файлов (фото, видеосообщения, документы и т.п.): по ним файл можно
+# скачать, поэтому они заменяются хешами, кроме записи с RECORD_RAW_TEXT
+FILE_FIELDS = ('file_id', 'file_unique_id')
+# Псевдонимизированные ID попадают в этот диапазон
+PSEUDO_ID_BASE = 9_000_000_000
+_NUMBER_RE = re.compile(r'\d{5,}')
+
+
+class Redactor:
+    """Удаление персональных данных из апдейта.
+
+    ID пользователей заменяются стабильными псевдонимами (HMAC), чтобы
+    апдейты одного пользователя оставались связанными. ID из keep_ids
+    (админы, группа) сохраняются: от них зависят сценарии бота. Имена,
+    тексты и ID файлов заменяются хешами; у команд сохраняется сама команда
+    (/start), чтобы запись можно было воспроизвести. raw_text=True оставляет
+    их как есть. Без соли используется случайная.
+    """
+
+    def __init__(self, keep_ids: Iterable[int] = (), salt: str = RECORD_SALT,
+                 raw_text: bool = RECORD_RAW_TEXT):
+        self.keep_ids = frozenset(keep_ids)
+        self._key = (salt or secrets.token_hex(16)).encode()
+        self.raw_text = raw_text
+        self._ids: Dict[int, int] = {}
+
+    def _digest(self, value: str) -> int:
+        digest = hmac.new(self._key, value.encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:4], 'big')
+
+    def pseudo_id(self, value: int) -> int:
+        if value <= 0 or value in self.keep_ids:
+            return value
+        pseudo = self._ids.get(value)
+        if pseudo is None:
+            pseudo = self._ids[value] = PSEUDO_ID_BASE + self._digest(str(value))
+        return pseudo
+
+    def redact_text(self, text: str) -> str:
+        if self.raw_text:
+            return _NUMBER_RE.sub(self._replace_known_id, text)
+        command, _, rest = text.partition(' ')
+        if command.startswith('/'):
+            return f"{command} text:{self._digest(rest):08x}" if rest else command
+        return f"text:{self._digest(text):08x}"
+
+    def redact_file_id(self, key: str, file_id: str) -> str:
+        if self.raw_text:
+            return file_id
+        return f"file:{self._digest(f'{key}:{file_id}'):08x}"
+
+    def redact_name(self, key: str, name: str, owner_id: Any) -> str:
+        # Имя выводится из ID владельца, чтобы оно совпадало во всех апдейтах
+        digest = self._digest(f"{key}:{owner_id if isinstance(owner_id, int) else name}")
+        if key == 'username':
+            return f"u{digest % 10 ** 9}"
+        return f"User {digest % 10 ** 9}"
+
+    def _replace_known_id(self, match) -> str:
+        pseudo = self._ids.get(int(match.group()))
+        return str(pseudo) if pseudo is not None else match.group()
+
+    def redact(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self.redact(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        result = {}
+        raw_id = value.get('id')
+        for key, item in value.items():
+            if key in DROPPED_FIELDS:
+                continue
+            if key in ID_FIELDS and isinstance(item, int):
+                result[key] = self.pseudo_id(item)
+            elif key in TEXT_FIELDS and isinstance(item, str):
+                result[key] = self.redact_text(item)
+            elif key in FILE_FIELDS and isinstance(item, str):
+                result[key] = self.redact_file_id(key, item)
+            elif key in NAME_FIELDS and isinstance(item, str):
+                if self.raw_text:
+                    result[key] = item
+                elif key != 'last_name':
+                    result[key] = self.redact_name(key, item, raw_id)
+            else:
+                result[key] = self.redact(item)
+        return result
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Внешний middleware апдейтов: пишет каждый апдейт в JSONL до обработки.
+
+    Строки копятся в буфере и дописываются в файл в отдельном потоке.
+    """
+
+    def __init__(self, path: str, keep_ids: Iterable[int] = (),
+                 salt: str = RECORD_SALT, raw_text: bool = RECORD_RAW_TEXT,
+                 flush_every: int = 50, flush_interval: float = 1.0):
+        if not salt:
+            logging.warning("RECORD_SALT не задан: для записи апдейтов сгенерирована случайная соль")
+        if raw_text:
+            logging.warning("RECORD_RAW_TEXT=1: тексты и имена пользователей записываются без изменений")
+        self.path = path
+        self.redactor = Redactor(keep_ids, salt, raw_text)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if isinstance(event, Update):
+            self.record(event)
+        return await handler(event, data)
+
+    def record(self, update: Update):
+        try:
+            payload = update.model_dump(mode='json', exclude_none=True, by_alias=True)
+            self._buffer.append(json.dumps(
+                {'ts': round(time.time(), 3), 'update': self.redactor.redact(payload)},
+                ensure_ascii=False))
+            self.recorded += 1
+        except Exception as e:
+            logging.error(f"Ошибка записи апдейта: {e}")
+            return
+
+        if (len(self._buffer) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            task = asyncio.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        async with self._lock:
+            lines, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if lines:
+                try:
+                    await asyncio.to_thread(self._write, lines)
+                except Exception as e:
+                    logging.error(f"Ошибка сохранения записи апдейтов: {e}")
+
+    def _write(self, lines: List[str]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    async def close(self):
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+
+def load_recording(path: str) -> List[Dict]:
+    """Чтение записи: список {'ts': ..., 'update': {...}} в порядке времени"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda record: record['ts'])
+    return records
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Сообщение о наборе редактируется не чаще одного раза за интервал, с
+RECRUITMENT_EDIT_INTERVAL = float(os.environ.get('RECRUITMENT_EDIT_INTERVAL', '2'))
+
+
+def recruitment_text(count: int) -> str:
+    return f"Идёт набор в игру \"Жених\"\nУчастников: {count}"
+
+
+def recruitment_keyboard(session_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="Присоединиться",
+                             callback_data=f"bride_join_{session_id}")
+    ]])
+
+
+class Recruitment:
+    """Сообщение о наборе в игру и число участников в памяти"""
+    __slots__ = ('session_id', 'chat_id', 'message_id', 'count', 'shown',
+                 'last_edit', 'pending')
+
+    def __init__(self, session_id: int, chat_id: int, message_id: int, count: int):
+        self.session_id = session_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.count = count
+        # Число, которое сейчас показано в сообщении
+        self.shown = count
+        self.last_edit = time.monotonic()
+        self.pending: Optional[asyncio.Task] = None
+
+
+class RecruitmentBoard:
+    """Счетчики участников открытых наборов и отложенное обновление сообщений.
+
+    Число участников приходит из базы при вступлении (join_bride_session) и
+    только растет. Первое изменение после паузы показывается сразу,
+    следующие в пределах edit_interval объединяются в одно редактирование
+    с последним значением: при массовом вступлении сообщение обновляется
+    несколько раз, а не на каждое нажатие.
+    """
+
+    def __init__(self, bot: Bot, edit_interval: float = RECRUITMENT_EDIT_INTERVAL):
+        self.bot = bot
+        self.edit_interval = edit_interval
+        self._open: Dict[int, Recruitment] = {}
+
+    def get(self, session_id: int) -> Optional[Recruitment]:
+        return self._open.get(session_id)
+
+    def open(self, session_id: int, chat_id: int, message_id: int,
+             count: int = 0) -> Recruitment:
+        recruitment = self._open.get(session_id)
+        if recruitment is None:
+            recruitment = Recruitment(session_id, chat_id, message_id, count)
+            self._open[session_id] = recruitment
+        return recruitment
+
+    def joined(self, session_id: int, count: int):
+        """Новое число участников; сообщение обновится не позже чем через edit_interval"""
+        recruitment = self._open.get(session_id)
+        if recruitment is None or count <= recruitment.count:
+            return
+        recruitment.count = count
+        if recruitment.pending is None:
+            recruitment.pending = asyncio.create_task(self._flush(recruitment))
+
+    def close(self, session_id: int) -> Optional[Recruitment]:
+        """Набор завершен: отложенное редактирование отменяется"""
+        recruitment = self._open.pop(session_id, None)
+        if recruitment is not None and recruitment.pending is not None:
+            recruitment.pending.cancel()
+            recruitment.pending = None
+        return recruitment
+
+    async def _flush(self, recruitment: Recruitment):
+        try:
+            while recruitment.count != recruitment.shown:
+                delay = recruitment.last_edit + self.edit_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                count = recruitment.count
+                recruitment.last_edit = time.monotonic()
+                try:
+                    await self.bot.edit_message_text(
+                        chat_id=recruitment.chat_id, message_id=recruitment.message_id,
+                        text=recruitment_text(count),
+                        reply_markup=recruitment_keyboard(recruitment.session_id))
+                    recruitment.shown = count
+                except TelegramRetryAfter as e:
+                    recruitment.last_edit = time.monotonic() + e.retry_after
+                except TelegramBadRequest as e:
+                    # Сообщение удалено или уже содержит этот текст
+                    logging.error(f"Ошибка обновления сообщения о наборе: {e}")
+                    recruitment.shown = count
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка обновления сообщения о наборе: {e}")
+        finally:
+            recruitment.pending = None
+
+    async def close_all(self):
+        tasks = [r.pending for r in self._open.values() if r.pending is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,240 @@
+"""Воспроизведение записанных апдейтов (recorder.py) против фейкового Bot API.
+
+Апдейты подаются в dp.feed_update в реальном темпе записи (--speed real),
+с ускорением (--speed 10) или без пауз (--speed fast). Апдейты одного чата
+обрабатываются по порядку, разных чатов - параллельно, как при polling.
+Нужна отдельная тестовая база (DATABASE_URL) либо STORAGE_BACKEND=memory.
+Тексты в записи заменены хешами (кроме команд), поэтому шаги, зависящие от
+введенного текста, воспроизводятся полностью только с записью RECORD_RAW_TEXT=1.
+
+Пример:
+    DATABASE_URL=postgres://localhost/bot_test python replay.py recordings/updates.jsonl --speed fast
+    STORAGE_BACKEND=memory python replay.py recordings/updates.jsonl --speed 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# loadtest задает окружение по умолчанию до импорта main
+from loadtest import percentile  # noqa: E402
+import main  # noqa: E402
+from aiogram import BaseMiddleware  # noqa: E402
+from aiogram.types import TelegramObject, Update  # noqa: E402
+from fake_telegram import FakeTelegramServer  # noqa: E402
+from recorder import load_recording  # noqa: E402
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренний middleware: длительность каждого вызова хендлера"""
+
+    def __init__(self):
+        self.durations: Dict[str, List[float]] = {}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.durations.setdefault(name, []).append(time.perf_counter() - started)
+
+
+class QueryCounter:
+    """Подсчет SQL-запросов через логгер запросов asyncpg"""
+
+    def __init__(self):
+        self.total = 0
+        self.elapsed = 0.0
+        self.by_query: Counter = Counter()
+
+    def attach(self, conn):
+        conn.add_query_logger(self._log)
+
+    def _log(self, record):
+        self.total += 1
+        self.elapsed += record.elapsed or 0.0
+        self.by_query[' '.join(record.query.split())[:80]] += 1
+
+
+def _chat_key(update: Update) -> int:
+    event = update.event
+    chat = getattr(event, 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user is not None else 0
+
+
+class Replayer:
+    def __init__(self, records: List[Dict], speed: float, concurrency: int):
+        self.records = records
+        self.speed = speed
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    async def run(self) -> float:
+        """Воспроизводит запись, возвращает длительность в секундах"""
+        bot = main.bot
+        tasks = []
+        last_by_chat: Dict[int, asyncio.Task] = {}
+        first_ts = self.records[0]['ts'] if self.records else 0.0
+        started = time.perf_counter()
+        for record in self.records:
+            if self.speed:
+                delay = (record['ts'] - first_ts) / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.model_validate(record['update'], context={'bot': bot})
+            key = _chat_key(update)
+            task = asyncio.create_task(self._feed(update, last_by_chat.get(key)))
+            last_by_chat[key] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+    async def _feed(self, update: Update, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                await main.dp.feed_update(main.bot, update)
+            except Exception as e:
+                self.errors += 1
+                logging.debug(f"Ошибка обработки апдейта {update.update_id}: {e!r}")
+            self.latencies.append(time.perf_counter() - started)
+
+
+async def run(args) -> Dict:
+    records = load_recording(args.recording)
+    if args.limit:
+        records = records[:args.limit]
+
+    server = FakeTelegramServer(latency=args.latency, seed=1)
+    server.state.default_status = args.default_status
+    for admin_id in main.ADMIN_IDS:
+        server.state.set_member(main.GROUP_ID, admin_id, 'creator')
+    await server.start()
+    main.bot.session.api = server.api_server()
+
+    queries = QueryCounter()
+    if hasattr(main.db, 'connection_hooks'):
+        main.db.connection_hooks.append(queries.attach)
+    timing = HandlerTimingMiddleware()
+    for observer in (main.dp.message, main.dp.callback_query, main.dp.chat_member):
+        observer.middleware(timing)
+
+    if not await main.db.connect():
+        await server.stop()
+        raise SystemExit("Нет подключения к тестовой базе (DATABASE_URL)")
+    await main.tenants.load()
+    await main.load_data_from_db()
+
+    speed = {'fast': 0.0, 'real': 1.0}.get(args.speed)
+    replayer = Replayer(records, float(args.speed) if speed is None else speed,
+                        args.concurrency)
+    server.reset_counters()
+    queries_before = queries.total
+    try:
+        elapsed = await replayer.run()
+    finally:
+        await main.notifier.close()
+        await main.bot.session.close()
+        await main.db.close()
+        await server.stop()
+
+    updates = len(records)
+    query_total = queries.total - queries_before
+    return {
+        'recording': args.recording,
+        'speed': args.speed,
+        'updates': updates,
+        'errors': replayer.errors,
+        'elapsed_s': elapsed,
+        'updates_per_s': updates / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(replayer.latencies, 50) * 1000,
+        'p99_ms': percentile(replayer.latencies, 99) * 1000,
+        'queries': query_total,
+        'queries_per_update': query_total / updates if updates else 0.0,
+        'api_calls': server.total_calls,
+        'api_calls_per_update': server.total_calls / updates if updates else 0.0,
+        'handlers': {
+            name: {'calls': len(values),
+                   'p50_ms': percentile(values, 50) * 1000,
+                   'p99_ms': percentile(values, 99) * 1000}
+            for name, values in sorted(timing.durations.items(),
+                                       key=lambda item: -sum(item[1]))
+        },
+        'top_queries': dict(queries.by_query.most_common(10)),
+    }
+
+
+# Показатели, которые сравниваются с эталонным прогоном
+COMPARED_FIELDS = ('updates_per_s', 'p50_ms', 'p99_ms', 'queries_per_update',
+                   'api_calls_per_update')
+
+
+def format_report(report: Dict, baseline: Optional[Dict] = None) -> str:
+    def delta(field):
+        if not baseline or not baseline.get(field):
+            return ''
+        change = (report[field] - baseline[field]) / baseline[field] * 100
+        return f" ({change:+.1f}%)"
+
+    lines = [
+        f"Запись: {report['recording']}, скорость: {report['speed']}",
+        f"Апдейтов: {report['updates']} (ошибок: {report['errors']}) за "
+        f"{report['elapsed_s']:.2f} с, {report['updates_per_s']:.1f} апд/с{delta('updates_per_s')}",
+        f"Задержка: p50 {report['p50_ms']:.1f} мс{delta('p50_ms')}, "
+        f"p99 {report['p99_ms']:.1f} мс{delta('p99_ms')}",
+        f"Запросов к БД: {report['queries']} "
+        f"({report['queries_per_update']:.2f} на апдейт{delta('queries_per_update')})",
+        f"Запросов к API: {report['api_calls']} "
+        f"({report['api_calls_per_update']:.2f} на апдейт{delta('api_calls_per_update')})",
+        "",
+        f"{'хендлер':<36}{'вызовы':>8}{'p50 мс':>10}{'p99 мс':>10}",
+    ]
+    for name, row in report['handlers'].items():
+        lines.append(f"{name:<36}{row['calls']:>8}{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    lines.append("")
+    lines.append("Частые запросы:")
+    for query, count in report['top_queries'].items():
+        lines.append(f"{count:>7}  {query}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('recording', help="JSONL, записанный RECORD_UPDATES_FILE")
+    parser.add_argument('--speed', default='fast',
+                        help="fast, real или множитель скорости (например, 10)")
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=0, help="сколько апдейтов воспроизвести")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="задержка ответа фейкового API, с")
+    parser.add_argument('--default-status', default='member',
+                        help="статус в группе для пользователей из записи")
+    parser.add_argument('--save', help="сохранить отчет в JSON")
+    parser.add_argument('--compare', help="отчет эталонного прогона для сравнения")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(format_report(report, baseline))
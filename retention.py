@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List
+
+# Настройки хранения истории игр "Жених"
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '30'))
+# archive - перенос в bride_games_archive, export - выгрузка в gzip JSONL на диск
+RETENTION_MODE = os.environ.get('RETENTION_MODE', 'archive')
+RETENTION_EXPORT_DIR = os.environ.get('RETENTION_EXPORT_DIR', 'archive')
+RETENTION_BATCH_SIZE = 100
+
+
+class RetentionManager:
+    """Перенос завершенных игр из рабочих таблиц в архив"""
+
+    def __init__(self, database, days: int = RETENTION_DAYS,
+                 mode: str = RETENTION_MODE,
+                 export_dir: str = RETENTION_EXPORT_DIR,
+                 batch_size: int = RETENTION_BATCH_SIZE):
+        if mode not in ('archive', 'export'):
+            raise ValueError(f"Неизвестный режим хранения: {mode}")
+        self.db = database
+        self.days = days
+        self.mode = mode
+        self.export_dir = export_dir
+        self.batch_size = batch_size
+
+    async def run(self) -> Dict[str, int]:
+        """Переносит все подходящие игры пачками, возвращает статистику"""
+        exporter = self._export if self.mode == 'export' else None
+        moved = 0
+        while True:
+            count = await self.db.archive_finished_games(
+                self.days, self.batch_size, exporter=exporter)
+            moved += count
+            if count < self.batch_size:
+                break
+        return {'games': moved}
+
+    async def _export(self, records: List[Dict]):
+        # Запись на диск выполняется в отдельном потоке, чтобы не блокировать цикл событий
+        await asyncio.to_thread(self._write_jsonl, records)
+
+    def _write_jsonl(self, records: List[Dict]):
+        os.makedirs(self.export_dir, exist_ok=True)
+        path = os.path.join(
+            self.export_dir,
+            f"bride_games-{datetime.now().strftime('%Y%m%d')}.jsonl.gz")
+        # Дописываем новый gzip-член: файл остается корректным gzip-потоком
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps({
+                    'game_id': record['game_id'],
+                    'group_id': record['group_id'],
+                    'creator_id': record['creator_id'],
+                    'bride_id': record['bride_id'],
+                    'created_at': record['created_at'].isoformat(),
+                    'finished_at': record['finished_at'].isoformat(),
+                    'participants': json.loads(record['participants']),
+                    'rounds': json.loads(record['rounds']),
+                }, ensure_ascii=False))
+                f.write('\n')
+        logging.info(f"Выгружено {len(records)} игр в {path}")
+
+
+def format_table_sizes(rows: List[Dict]) -> str:
+    """Текст отчета о размерах таблиц для админов"""
+    def human(size: int) -> str:
+        for unit in ('Б', 'КБ', 'МБ'):
+            if size < 1024:
+                return f"{size:.0f} {unit}"
+            size /= 1024
+        return f"{size:.1f} ГБ"
+
+    total = sum(row['total_bytes'] for row in rows)
+    lines = [f"<b>Размер таблиц</b> (всего {human(total)}):\n"]
+    for row in rows:
+        lines.append(
+            f"{row['table_name']}: {human(row['total_bytes'])}, ~{row['row_estimate']} строк")
+    return "\n".join(lines)
@@ -0,0 +1,209 @@
+import asyncio
+import difflib
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+# Сколько похожих ролей предлагать при опечатке или занятой роли
+ROLE_SUGGESTIONS = int(os.environ.get('ROLE_SUGGESTIONS', '3'))
+# Порог похожести (0..1): ниже него роль не считается похожей
+ROLE_SIMILARITY = float(os.environ.get('ROLE_SIMILARITY', '0.5'))
+
+
+def normalize_role(role: str) -> str:
+    """Ключ роли: без учета регистра и лишних пробелов.
+
+    Совпадает с выражением lower(regexp_replace(btrim(...), '\\s+', ' ', 'g'))
+    в Postgres.
+    """
+    return ' '.join(role.split()).lower()
+
+
+def similar_roles(key: str, rows: Iterable[Dict], limit: int,
+                  threshold: float = ROLE_SIMILARITY) -> List[Dict]:
+    """Похожие роли без pg_trgm (хранилище в памяти или база без расширения)"""
+    scored = []
+    for row in rows:
+        if row['role_key'] == key:
+            continue
+        score = difflib.SequenceMatcher(None, key, row['role_key']).ratio()
+        if score >= threshold:
+            scored.append((score, row))
+    scored.sort(key=lambda item: -item[0])
+    return [dict(row, similarity=score) for score, row in scored[:limit]]
+
+
+class RoleEntry:
+    """Роль в реестре: user_id - кто ее занимает (None - свободна)"""
+    __slots__ = ('role_id', 'role', 'user_id')
+
+    def __init__(self, role_id: int, role: str, user_id: Optional[int]):
+        self.role_id = role_id
+        self.role = role
+        self.user_id = user_id
+
+
+class RoleCheck:
+    """Ответ на вопрос "свободна ли роль" и похожие роли"""
+    __slots__ = ('role', 'holder', 'similar')
+
+    def __init__(self, role: str, holder: Optional[int], similar: List[RoleEntry]):
+        self.role = role
+        self.holder = holder
+        self.similar = similar
+
+    @property
+    def taken(self) -> bool:
+        return self.holder is not None
+
+    def similar_taken(self) -> List[str]:
+        return [entry.role for entry in self.similar if entry.user_id is not None]
+
+    def similar_free(self) -> List[str]:
+        return [entry.role for entry in self.similar if entry.user_id is None]
+
+
+class _GroupRoles:
+    """Роли одного сообщества"""
+    __slots__ = ('roles', 'by_user', 'free')
+
+    def __init__(self):
+        # role_key -> роль
+        self.roles: Dict[str, RoleEntry] = {}
+        # user_id -> role_key занятой роли
+        self.by_user: Dict[int, str] = {}
+        # Свободные роли (dict сохраняет порядок освобождения)
+        self.free: Dict[str, None] = {}
+
+
+class RoleRegistry:
+    """Реестр ролей: какие роли заняты участниками, какие освободились.
+
+    У каждого сообщества свой реестр: одна и та же роль может быть занята
+    в разных сообществах разными участниками. Роль занимается при
+    вступлении в группу с ней (take) и освобождается при выходе (release).
+    Занятость проверяется по множеству ключей в памяти (normalize_role) без
+    запроса к базе; в базе ключ уникален в сообществе, так что одну роль не
+    могут занять двое, даже при нескольких процессах. Освободившиеся роли
+    остаются в реестре и составляют список свободных, который обновляется
+    на каждом take/release. Похожие роли ищутся по индексу pg_trgm в
+    Postgres, а без него (или в хранилище в памяти) - по реестру в памяти.
+    """
+
+    def __init__(self, database, suggestions: int = ROLE_SUGGESTIONS):
+        self.db = database
+        self.suggestions = suggestions
+        self._groups: Dict[int, _GroupRoles] = {}
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    def __len__(self):
+        return sum(len(group.roles) for group in self._groups.values())
+
+    async def load(self):
+        async with self._load_lock:
+            rows = await self.db.get_roles()
+            self._groups.clear()
+            for row in rows:
+                self._apply(row)
+            self._loaded = True
+        taken = sum(len(group.by_user) for group in self._groups.values())
+        free = sum(len(group.free) for group in self._groups.values())
+        logging.info(f"Реестр ролей загружен: {taken} занято, {free} свободно")
+
+    async def invalidate(self, role_id: Optional[int]):
+        """Роль изменена другим процессом"""
+        if role_id is None:
+            await self.load()
+            return
+        row = await self.db.get_role(role_id)
+        if row is not None:
+            self._apply(row)
+
+    async def check(self, group_id: int, role: str, user_id: Optional[int] = None) -> RoleCheck:
+        """Занята ли роль в сообществе другим пользователем и какие роли на нее похожи"""
+        if not self._loaded:
+            await self.load()
+        group = self._group(group_id)
+        key = normalize_role(role)
+        entry = group.roles.get(key)
+        holder = entry.user_id if entry is not None else None
+        if holder == user_id:
+            holder = None
+        similar = []
+        if self.suggestions > 0:
+            try:
+                if self.db.has_trgm:
+                    rows = await self.db.find_similar_roles(group_id, key, self.suggestions)
+                else:
+                    # Без индекса база прочитала бы все роли: сравниваем по реестру
+                    rows = similar_roles(key, ({'role_key': role_key} for role_key in group.roles),
+                                         self.suggestions)
+                similar = [group.roles[row['role_key']] for row in rows
+                           if row['role_key'] in group.roles]
+            except Exception as e:
+                logging.error(f"Ошибка поиска похожих ролей: {e}")
+        return RoleCheck(entry.role if entry is not None else role, holder, similar)
+
+    def holder(self, group_id: int, role: str) -> Optional[int]:
+        entry = self._group(group_id).roles.get(normalize_role(role))
+        return entry.user_id if entry is not None else None
+
+    def role_of(self, group_id: int, user_id: int) -> Optional[str]:
+        group = self._group(group_id)
+        key = group.by_user.get(user_id)
+        return group.roles[key].role if key is not None else None
+
+    def free_roles(self, group_id: int) -> List[str]:
+        group = self._group(group_id)
+        return sorted((group.roles[key].role for key in group.free), key=str.lower)
+
+    async def take(self, group_id: int, role: str, user_id: int) -> bool:
+        """Пользователь занял роль в сообществе. False - ее уже занимает другой"""
+        key = normalize_role(role)
+        row = await self.db.take_role(group_id, key, role, user_id)
+        if row is None:
+            return False
+        # Прежняя роль пользователя освобождается тем же запросом
+        group = self._group(group_id)
+        previous = group.by_user.get(user_id)
+        if previous is not None and previous != key:
+            self._set_holder(group, previous, None)
+        self._apply(row)
+        return True
+
+    async def release(self, group_id: int, user_id: int) -> List[str]:
+        """Пользователь вышел из сообщества: его роли там освобождаются
+        (возвращает их названия)"""
+        rows = await self.db.release_roles(group_id, user_id)
+        for row in rows:
+            self._apply(row)
+        # Роль могла быть занята до появления реестра и в нем отсутствовать
+        self._group(group_id).by_user.pop(user_id, None)
+        return [row['role'] for row in rows]
+
+    def _group(self, group_id: int) -> _GroupRoles:
+        group = self._groups.get(group_id)
+        if group is None:
+            group = self._groups[group_id] = _GroupRoles()
+        return group
+
+    def _apply(self, row: Dict):
+        group = self._group(row['group_id'])
+        key = row['role_key']
+        entry = group.roles.get(key)
+        if entry is None:
+            entry = group.roles[key] = RoleEntry(row['role_id'], row['role'], None)
+        entry.role = row['role']
+        self._set_holder(group, key, row['user_id'])
+
+    def _set_holder(self, group: _GroupRoles, key: str, user_id: Optional[int]):
+        entry = group.roles[key]
+        if entry.user_id is not None and group.by_user.get(entry.user_id) == key:
+            del group.by_user[entry.user_id]
+        entry.user_id = user_id
+        if user_id is None:
+            group.free[key] = None
+        else:
+            group.free.pop(key, None)
+            group.by_user[user_id] = key
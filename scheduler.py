@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import random
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+# Пространство имён advisory-локов планировщика (первый ключ pg_try_advisory_lock)
+JOBS_LOCK_NAMESPACE = 0x4A4F4253  # "JOBS"
+# Период ежедневных задач (at="ЧЧ:ММ"), с
+DAY = 86400
+
+
+class JobStats:
+    """Метрики выполнения задачи"""
+    __slots__ = ('runs', 'failures', 'timeouts', 'skipped', 'last_duration',
+                 'total_duration', 'max_duration', 'last_run_at',
+                 'last_error')
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_run_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict:
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'skipped': self.skipped,
+            'last_duration': self.last_duration,
+            'avg_duration': self.total_duration / self.runs if self.runs else 0.0,
+            'max_duration': self.max_duration,
+            'last_run_at': self.last_run_at,
+            'last_error': self.last_error,
+        }
+
+
+class Job:
+    """Описание периодической задачи.
+
+    interval - период запуска в секундах, at - ежедневное время "ЧЧ:ММ".
+    """
+
+    def __init__(self, name: str, func: Callable[[], Awaitable],
+                 interval: Optional[float] = None, at: Optional[str] = None,
+                 jitter: float = 0.0, timeout: float = 300.0,
+                 run_on_start: bool = False, exclusive: bool = True):
+        if (interval is None) == (at is None):
+            raise ValueError(f"Задача {name}: укажите либо interval, либо at")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.at = tuple(int(part) for part in at.split(':')) if at else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.run_on_start = run_on_start
+        # exclusive - выполнять один раз за период на одном экземпляре бота
+        # (advisory lock и время последнего запуска в job_runs)
+        self.exclusive = exclusive
+        self.lock_key = zlib.crc32(name.encode()) & 0x7FFFFFFF
+        self.running = False
+        self.stats = JobStats()
+
+    @property
+    def min_interval(self) -> float:
+        """Сколько секунд после успешного запуска задача не повторяется ни на
+        одном экземпляре: раньше следующий период начаться не может (запуск
+        сдвигается джиттером и длится не дольше таймаута)"""
+        period = self.interval if self.interval is not None else DAY
+        return max(period - self.jitter - self.timeout, 0.0)
+
+    def next_delay(self, now: datetime) -> float:
+        """Задержка до следующего запуска с учетом джиттера"""
+        if self.interval is not None:
+            delay = self.interval
+        else:
+            hour, minute = self.at
+            target = now.replace(hour=hour, minute=minute, second=0,
+                                 microsecond=0)
+            if target <= now:
+                target += timedelta(days=1)
+            delay = (target - now).total_seconds()
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+
+class JobScheduler:
+    """Планировщик фоновых задач в цикле событий бота"""
+
+    def __init__(self, database=None):
+        self.db = database
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def add_job(self, name: str, func: Callable[[], Awaitable], **kwargs) -> Job:
+        """Регистрация задачи (см. параметры Job)"""
+        if name in self.jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        job = Job(name, func, **kwargs)
+        self.jobs[name] = job
+        if self._tasks:
+            self._tasks[name] = asyncio.create_task(self._loop(job))
+        return job
+
+    def start(self):
+        """Запуск циклов всех зарегистрированных задач"""
+        for name, job in self.jobs.items():
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(self._loop(job),
+                                                        name=f"job:{name}")
+        logging.info(f"Планировщик запущен, задач: {len(self.jobs)}")
+
+    async def stop(self):
+        """Остановка планировщика с отменой выполняющихся задач"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {name: job.stats.as_dict() for name, job in self.jobs.items()}
+
+    async def run_job(self, name: str) -> bool:
+        """Внеочередной запуск задачи. Возвращает True, если задача выполнилась"""
+        return await self._execute(self.jobs[name], force=True)
+
+    async def _loop(self, job: Job):
+        if not job.run_on_start:
+            await asyncio.sleep(job.next_delay(datetime.now()))
+        while True:
+            await self._execute(job)
+            await asyncio.sleep(job.next_delay(datetime.now()))
+
+    async def _execute(self, job: Job, force: bool = False) -> bool:
+        # Защита от наложения запусков одной задачи
+        if job.running:
+            job.stats.skipped += 1
+            logging.warning(f"Задача {job.name} еще выполняется, запуск пропущен")
+            return False
+
+        job.running = True
+        try:
+            if job.exclusive and self.db is not None:
+                async with self.db.job_lock(JOBS_LOCK_NAMESPACE, job.lock_key, job.name,
+                                            job.min_interval, force) as due:
+                    if not due:
+                        # Задачу выполняет или уже выполнил в этом периоде
+                        # другой экземпляр бота
+                        job.stats.skipped += 1
+                        return False
+                    if await self._run(job):
+                        await self.db.record_job_run(job.name)
+            else:
+                await self._run(job)
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.stats.failures += 1
+            job.stats.last_error = str(e)
+            logging.error(f"Ошибка блокировки или отметки запуска задачи {job.name}: {e}")
+            return False
+        finally:
+            job.running = False
+
+    async def _run(self, job: Job) -> bool:
+        """Выполнение задачи с таймаутом. True - задача завершилась без ошибок"""
+        stats = job.stats
+        stats.last_run_at = datetime.now()
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(job.func(), timeout=job.timeout)
+            stats.last_error = None
+            if result is not None:
+                logging.info(f"Задача {job.name} выполнена: {result}")
+            return True
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            stats.last_error = f"timeout {job.timeout}s"
+            logging.error(f"Задача {job.name} превысила таймаут {job.timeout} с")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats.failures += 1
+            stats.last_error = str(e)
+            logging.error(f"Ошибка выполнения задачи {job.name}: {e}")
+        finally:
+            duration = time.perf_counter() - started
+            stats.runs += 1
+            stats.last_duration = duration
+            stats.total_duration += duration
+            stats.max_duration = max(stats.max_duration, duration)
+        return False
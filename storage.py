@@ -0,0 +1,422 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class IntegrityError(Exception):
+    """Нарушение ограничения целостности (уникальный или внешний ключ)"""
+
+
+class Storage:
+    """Интерфейс хранилища данных бота.
+
+    Реализации: db.Database (Postgres через asyncpg) и memory_db.MemoryDatabase
+    (в памяти процесса, для тестов и бенчмарков). Семантика методов
+    одинакова: upsert-ы, каскадное удаление, возвращаемые поля.
+    """
+
+    # Похожие роли ищутся по индексу pg_trgm (find_similar_roles)
+    has_trgm = False
+
+    @property
+    def is_connected(self) -> bool:
+        raise NotImplementedError
+
+    async def connect(self) -> bool:
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def ping(self, timeout: float) -> bool:
+        """Хранилище отвечает на запрос за timeout секунд"""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def job_lock(self, namespace: int, key: int, name: str,
+                       min_interval: float, force: bool = False):
+        """True - задача не выполняется другим экземпляром и с ее последнего
+        успешного запуска прошло не меньше min_interval секунд (или force)"""
+        raise NotImplementedError
+        yield
+
+    async def record_job_run(self, name: str):
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Изменения методов, вызванных внутри блока, фиксируются вместе
+        (или не фиксируются, если блок завершился исключением)"""
+        raise NotImplementedError
+        yield
+
+    async def connect_dedicated(self, purpose: str):
+        """Отдельное соединение (LISTEN, аренда лидера) или None, если хранилище
+        живет в одном процессе и координация не нужна"""
+        raise NotImplementedError
+
+    # Эмодзи (у пользователя свой эмодзи в каждом сообществе)
+    async def save_emoji(self, group_id: int, user_id: int, emoji: str):
+        raise NotImplementedError
+
+    async def get_emoji(self, group_id: int, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    async def get_all_emojis(self, user_id: int = None) -> Dict[Tuple[int, int], str]:
+        """Эмодзи по (group_id, user_id): все или одного пользователя"""
+        raise NotImplementedError
+
+    async def remove_emoji(self, group_id: int, user_id: int):
+        raise NotImplementedError
+
+    async def get_used_emojis(self, group_id: int) -> List[str]:
+        raise NotImplementedError
+
+    # Данные пользователей в сообществах
+    async def save_user_data(self, group_id: int, user_id: int, role: str = None,
+                             custom_title: str = None):
+        raise NotImplementedError
+
+    async def get_user_data(self, group_id: int, user_id: int) -> Dict:
+        raise NotImplementedError
+
+    async def get_all_user_data(self, user_id: int = None) -> Dict[Tuple[int, int], Dict]:
+        """Данные по (group_id, user_id): все или одного пользователя"""
+        raise NotImplementedError
+
+    async def remove_user_data(self, group_id: int, user_id: int):
+        raise NotImplementedError
+
+    async def update_user_role(self, group_id: int, user_id: int, new_role: str):
+        raise NotImplementedError
+
+    # Реестр ролей сообществ (role_key - роль, нормализованная roles.normalize_role)
+    async def get_roles(self) -> List[Dict]:
+        raise NotImplementedError
+
+    async def get_role(self, role_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def take_role(self, group_id: int, role_key: str, role: str,
+                        user_id: int) -> Optional[Dict]:
+        """Занять роль в сообществе (прежняя роль пользователя там освобождается).
+        None - роль занята другим пользователем"""
+        raise NotImplementedError
+
+    async def release_roles(self, group_id: int, user_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def find_similar_roles(self, group_id: int, role_key: str, limit: int) -> List[Dict]:
+        raise NotImplementedError
+
+    # Викторины
+    async def save_quiz(self, quiz_id: int, chat_id: int, question: str, answers: List[str],
+                        correct_indices: List[int], creator_id: int):
+        raise NotImplementedError
+
+    async def get_quiz(self, quiz_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def get_all_active_quizzes(self) -> Dict[int, Dict]:
+        raise NotImplementedError
+
+    async def deactivate_quiz(self, quiz_id: int):
+        raise NotImplementedError
+
+    async def delete_quiz(self, quiz_id: int):
+        raise NotImplementedError
+
+    async def save_quiz_answer(self, quiz_id: int, user_id: int, answer_index: int):
+        raise NotImplementedError
+
+    async def get_quiz_participants(self, quiz_id: int) -> Dict[int, int]:
+        raise NotImplementedError
+
+    # История пребывания в группе
+    async def record_user_join(self, group_id: int, user_id: int, joined_at: datetime = None):
+        raise NotImplementedError
+
+    async def record_user_leave(self, group_id: int, user_id: int, left_at: datetime = None):
+        raise NotImplementedError
+
+    async def get_user_history(self, user_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def get_user_join_periods(self, user_id: int) -> List[Tuple[str, str]]:
+        raise NotImplementedError
+
+    async def get_members_at(self, moment: datetime) -> List[int]:
+        raise NotImplementedError
+
+    async def get_membership_churn(self, start: datetime, end: datetime) -> List[Dict]:
+        raise NotImplementedError
+
+    # Игра "Жених"
+    async def create_bride_game(self, group_id: int, creator_id: int) -> int:
+        raise NotImplementedError
+
+    async def join_bride_game(self, game_id: int, user_id: int) -> bool:
+        raise NotImplementedError
+
+    async def get_bride_game(self, game_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def get_active_bride_game(self, group_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def add_bride_game_participant(self, game_id: int, user_id: int, number: int = None,
+                                         is_bride: bool = False):
+        raise NotImplementedError
+
+    async def get_bride_rounds(self, game_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def get_bride_participants(self, game_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def start_bride_game(self, game_id: int, bride_id: int):
+        raise NotImplementedError
+
+    async def create_bride_round(self, game_id: int, round_number: int, question: str) -> int:
+        raise NotImplementedError
+
+    async def save_bride_answer(self, round_id: int, user_id: int, answer: str):
+        raise NotImplementedError
+
+    async def get_bride_answers(self, round_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def vote_out_participant(self, game_id: int, user_id: int, round_id: int):
+        raise NotImplementedError
+
+    async def finish_bride_game(self, game_id: int):
+        raise NotImplementedError
+
+    async def get_current_bride_round(self, game_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def get_recent_bride_questions(self, limit: int = 500) -> List[str]:
+        raise NotImplementedError
+
+    # Сессии набора в игру "Жених"
+    async def create_bride_session(self, creator_id: int, group_id: int) -> int:
+        raise NotImplementedError
+
+    async def join_bride_session(self, session_id: int, user_id: int) -> Optional[int]:
+        """Число участников после вступления или None (уже в наборе / набор закрыт)"""
+        raise NotImplementedError
+
+    async def get_bride_session_participants(self, session_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def eliminate_bride_participant(self, session_id: int, user_number: int):
+        raise NotImplementedError
+
+    async def delete_bride_session(self, session_id: int):
+        raise NotImplementedError
+
+    async def start_bride_session(self, session_id: int):
+        raise NotImplementedError
+
+    async def get_active_bride_session(self, group_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    # Заявки
+    async def save_pending_application(self, user_id: int, role: str, group_id: int):
+        raise NotImplementedError
+
+    async def delete_old_applications(self) -> int:
+        raise NotImplementedError
+
+    # Очереди ожидания места в группах: заявки pending_applications с
+    # waitlisted_at, у каждой группы (group_id заявки) своя очередь
+    async def join_waitlist(self, user_id: int, role: str, group_id: int):
+        raise NotImplementedError
+
+    async def leave_waitlist(self, user_id: int, group_id: int):
+        raise NotImplementedError
+
+    async def pop_waitlist(self, group_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def get_application_role(self, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    async def save_application(self, user_id: int, role: str, group_id: int):
+        raise NotImplementedError
+
+    async def save_application_internal(self, user_id: int, role: str):
+        raise NotImplementedError
+
+    async def get_application(self, user_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def update_application_role(self, user_id: int, new_role: str):
+        raise NotImplementedError
+
+    async def delete_application(self, user_id: int):
+        raise NotImplementedError
+
+    async def cleanup_expired_applications(self) -> int:
+        raise NotImplementedError
+
+    # История женихов
+    async def get_bride_history(self, user_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def update_bride_history(self, user_id: int):
+        raise NotImplementedError
+
+    async def reset_bride_status(self, user_id: int):
+        raise NotImplementedError
+
+    async def can_be_bride(self, user_id: int) -> bool:
+        """Проверка, может ли пользователь быть женихом"""
+        history = await self.get_bride_history(user_id)
+        if history:
+            # Получаем значения с проверкой на None
+            was_bride_count = history.get('was_bride_count', 0) or 0
+            games_since_bride = history.get('games_since_bride', 0) or 0
+
+            # Если пользователь был женихом и прошло меньше 2 игр - не может быть женихом
+            if was_bride_count > 0 and games_since_bride < 2:
+                return False
+            # Если прошло 2 или больше игр - может быть женихом
+            return True
+        else:
+            # Пользователь еще не был женихом
+            return True
+
+    async def get_eligible_bride_candidates(self, participants_ids: list) -> list:
+        """Получение списка подходящих кандидатов в женихи (абсолютно случайно, но с учетом истории)"""
+        eligible = []
+        for user_id in participants_ids:
+            if await self.can_be_bride(user_id):
+                eligible.append(user_id)
+
+        # Если все уже были женихами недавно, сбрасываем счетчики и возвращаем всех
+        if not eligible:
+            # Сбрасываем счетчики для всех участников
+            for user_id in participants_ids:
+                await self.reset_bride_status(user_id)
+            eligible = participants_ids
+
+        return eligible
+
+    async def mark_as_bride(self, user_id: int):
+        """Отмечает пользователя как бывшего жениха"""
+        await self.update_bride_history(user_id)
+
+    # Служебные сообщения игры
+    async def save_pinned_message(self, game_id: int, round_id: int, message_id: int,
+                                  message_type: str):
+        raise NotImplementedError
+
+    async def get_pinned_message(self, round_id: int, message_type: str) -> int:
+        raise NotImplementedError
+
+    async def get_game_pinned_messages(self, game_id: int) -> List[int]:
+        raise NotImplementedError
+
+    async def delete_game_pinned_messages(self, game_id: int):
+        raise NotImplementedError
+
+    async def save_round_status_message(self, round_id: int, creator_id: int, message_id: int):
+        raise NotImplementedError
+
+    async def get_round_status_message(self, round_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def delete_round_status_message(self, round_id: int):
+        raise NotImplementedError
+
+    async def get_participant_answer_status(self, round_id: int, user_id: int) -> bool:
+        raise NotImplementedError
+
+    async def get_all_participants_status(self, game_id: int, round_id: int) -> Dict[int, bool]:
+        raise NotImplementedError
+
+    # Сообщества
+    async def get_groups(self) -> List[Dict]:
+        raise NotImplementedError
+
+    async def get_group(self, group_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def save_group(self, group_id: int, group_link: str, admin_ids: List[int],
+                         list_admin_ids: List[int] = (), title: str = None):
+        raise NotImplementedError
+
+    async def deactivate_group(self, group_id: int):
+        raise NotImplementedError
+
+    # Очередь апдейтов
+    async def enqueue_updates(self, updates: List[Tuple[int, int, str]]) -> int:
+        raise NotImplementedError
+
+    async def claim_updates(self, worker_id: str, limit: int,
+                            claim_timeout: float) -> List[Dict]:
+        raise NotImplementedError
+
+    async def complete_updates(self, update_ids: List[int]):
+        raise NotImplementedError
+
+    # Состояния FSM
+    async def get_fsm(self, key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def set_fsm_state(self, key: str, state: Optional[str]):
+        raise NotImplementedError
+
+    async def set_fsm_data(self, key: str, data: Dict):
+        raise NotImplementedError
+
+    # Восстановление состояния при запуске
+    async def get_recovery_state(self, group_id: int) -> Dict:
+        raise NotImplementedError
+
+    async def save_participant_status_snapshot(self, round_id: int,
+                                               participant_statuses: Dict[int, bool]):
+        raise NotImplementedError
+
+    async def get_participant_status_snapshot(self, round_id: int) -> Dict[int, bool]:
+        raise NotImplementedError
+
+    async def cleanup_finished_game_state(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    # Хранение истории
+    async def archive_finished_games(self, older_than_days: int, batch_size: int = 100,
+                                     exporter=None) -> int:
+        raise NotImplementedError
+
+    async def get_table_sizes(self) -> List[Dict]:
+        raise NotImplementedError
+
+    # Уведомления админам
+    async def create_admin_notice(self, user_id: int, kind: str, text: str) -> int:
+        raise NotImplementedError
+
+    async def save_admin_notice_copies(self, notice_id: Optional[int],
+                                       copies: List[Tuple[int, int, Optional[str]]],
+                                       user_id: int, kind: str):
+        raise NotImplementedError
+
+    async def find_admin_notice_message(self, admin_chat_id: int, message_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def get_admin_notice(self, notice_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    async def update_admin_notice_status(self, notice_id: int, status: str):
+        raise NotImplementedError
+
+    async def cleanup_admin_notices(self, older_than_days: int = 30) -> int:
+        raise NotImplementedError
+
+    # Статистика
+    async def get_stats_summary(self, group_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    async def backfill_stats(self) -> int:
+        raise NotImplementedError
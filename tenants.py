@@ -0,0 +1,161 @@
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.enums import ChatType
+from aiogram.types import TelegramObject
+
+from admin_notices import LRUCache
+
+# Сколько пользователей помнить для определения сообщества в личных чатах
+TENANT_AFFINITY_SIZE = int(os.environ.get('TENANT_AFFINITY_SIZE', '50000'))
+
+
+class Tenant:
+    """Настройки одного сообщества (группы), которое обслуживает бот"""
+    __slots__ = ('group_id', 'group_link', 'admin_ids', 'list_admin_ids', 'title',
+                 '_admins')
+
+    def __init__(self, group_id: int, group_link: str, admin_ids: Iterable[int],
+                 list_admin_ids: Iterable[int] = (), title: Optional[str] = None):
+        self.group_id = group_id
+        self.group_link = group_link
+        self.admin_ids = tuple(admin_ids)
+        self.list_admin_ids = tuple(list_admin_ids)
+        self.title = title
+        self._admins = frozenset(self.admin_ids)
+
+    @classmethod
+    def from_row(cls, row: Dict) -> 'Tenant':
+        return cls(row['group_id'], row['group_link'], row['admin_ids'] or (),
+                   row['list_admin_ids'] or (), row.get('title'))
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self._admins
+
+    def __repr__(self):
+        return f"Tenant({self.group_id}, {self.title or self.group_link!r})"
+
+
+class TenantRegistry:
+    """Сообщества из таблицы groups, закэшированные в памяти.
+
+    Сообщество определяется за O(1): в группе - по chat_id, в личном чате -
+    по админу или по группе, в которой пользователь был замечен последним.
+    Остальные личные чаты относятся к сообществу по умолчанию (из
+    переменных окружения). После изменения строки в groups нужно вызвать
+    invalidate(group_id).
+    """
+
+    def __init__(self, database, default: Tenant,
+                 affinity_size: int = TENANT_AFFINITY_SIZE):
+        self.db = database
+        self.default = default
+        self._by_group: Dict[int, Tenant] = {default.group_id: default}
+        self._by_admin: Dict[int, Tenant] = {}
+        self._affinity = LRUCache(affinity_size)
+        self._reindex()
+
+    def __len__(self):
+        return len(self._by_group)
+
+    def __iter__(self):
+        return iter(list(self._by_group.values()))
+
+    def get(self, group_id: int) -> Optional[Tenant]:
+        return self._by_group.get(group_id)
+
+    def is_admin(self, user_id: int) -> bool:
+        """Админ хотя бы одного сообщества"""
+        return user_id in self._by_admin
+
+    def for_admin(self, user_id: int) -> Optional[Tenant]:
+        return self._by_admin.get(user_id)
+
+    def remember(self, user_id: int, group_id: int):
+        """Пользователь действовал в группе: его личные сообщения относятся к ней"""
+        self._affinity.put(user_id, group_id)
+
+    def resolve(self, chat_id: Optional[int], chat_type: Optional[str],
+                user_id: Optional[int]) -> Optional[Tenant]:
+        """Сообщество для апдейта или None, если группа не подключена"""
+        if chat_type in (ChatType.GROUP, ChatType.SUPERGROUP, ChatType.CHANNEL):
+            return self._by_group.get(chat_id)
+        if user_id is not None:
+            tenant = self._by_admin.get(user_id)
+            if tenant is not None:
+                return tenant
+            group_id = self._affinity.get(user_id)
+            if group_id is not None:
+                tenant = self._by_group.get(group_id)
+                if tenant is not None:
+                    return tenant
+        return self.default
+
+    async def load(self):
+        """Загрузка всех сообществ. Сообщество по умолчанию создается в groups,
+        если его там еще нет; если есть - настройки берутся из таблицы."""
+        rows = await self.db.get_groups()
+        by_group = {row['group_id']: Tenant.from_row(row) for row in rows}
+        if self.default.group_id in by_group:
+            self.default = by_group[self.default.group_id]
+        else:
+            await self.db.save_group(self.default.group_id, self.default.group_link,
+                                     self.default.admin_ids, self.default.list_admin_ids,
+                                     self.default.title)
+            by_group[self.default.group_id] = self.default
+        self._by_group = by_group
+        self._reindex()
+        logging.info(f"Загружено сообществ: {len(self._by_group)}")
+
+    async def invalidate(self, group_id: int):
+        """Перечитывает одно сообщество после изменения в таблице groups"""
+        row = await self.db.get_group(group_id)
+        if row is None:
+            # Сообщество по умолчанию не отключается: на него падают личные чаты
+            if group_id != self.default.group_id:
+                self._by_group.pop(group_id, None)
+        else:
+            tenant = Tenant.from_row(row)
+            self._by_group[group_id] = tenant
+            if group_id == self.default.group_id:
+                self.default = tenant
+        self._reindex()
+
+    def _reindex(self):
+        by_admin = {}
+        # Админ нескольких сообществ в личном чате работает с первым из них,
+        # а сообщество по умолчанию имеет приоритет
+        for tenant in [self.default] + [t for t in self._by_group.values()
+                                        if t is not self.default]:
+            for admin_id in tenant.admin_ids:
+                by_admin.setdefault(admin_id, tenant)
+        self._by_admin = by_admin
+
+
+class TenantMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: кладет сообщество в data['tenant'].
+
+    Апдейты из групп, которых нет в таблице groups, не обрабатываются.
+    """
+
+    def __init__(self, registry: TenantRegistry):
+        self.registry = registry
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        chat = data.get('event_chat')
+        user = data.get('event_from_user')
+        chat_id = chat.id if chat else None
+        chat_type = chat.type if chat else None
+        user_id = user.id if user else None
+
+        tenant = self.registry.resolve(chat_id, chat_type, user_id)
+        if tenant is None:
+            logging.debug(f"Апдейт из неподключенной группы {chat_id} пропущен")
+            return None
+        if chat_type != ChatType.PRIVATE and user_id is not None and chat_id is not None:
+            self.registry.remember(user_id, chat_id)
+        data['tenant'] = tenant
+        return await handler(event, data)
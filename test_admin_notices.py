@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+
+from admin_notices import AdminNotifier
+from memory_db import MemoryDatabase
+
+
+class StubBot:
+    """Бот, запоминающий отредактированные сообщения"""
+
+    def __init__(self):
+        self.message_id = 0
+        self.edited = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.message_id += 1
+        return SimpleNamespace(message_id=self.message_id)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str):
+        self.edited.append((chat_id, message_id))
+
+
+def test_close_flushes_pending_edits():
+    async def scenario():
+        bot = StubBot()
+        notifier = AdminNotifier(bot, MemoryDatabase(), (1, 2), edit_delay=60)
+        notice_id = await notifier.publish("Заявка", 10, 'application')
+        await notifier.mark_handled(notice_id, "принято")
+
+        # Закрытие не ждет задержку редактирования, но и не теряет его
+        await asyncio.wait_for(notifier.close(), 1)
+        assert sorted(bot.edited) == [(1, 1), (2, 2)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,33 @@
+import asyncio
+
+from db import Database
+
+
+class StubConnection:
+    """Соединение asyncpg с заданным PID серверного процесса"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.termination_listeners = []
+
+    def get_server_pid(self) -> int:
+        return self.pid
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+
+def test_init_connection_registers_server_pid():
+    database = Database()
+    hooked = []
+    database.connection_hooks.append(hooked.append)
+    conn = StubConnection(4242)
+
+    # connect() передает метод в init пула
+    asyncio.run(database._init_connection(conn))
+
+    assert database.server_pids == {4242}
+    assert hooked == [conn]
+    # Закрытое соединение больше не считается своим для шины инвалидации
+    conn.termination_listeners[0](conn)
+    assert database.server_pids == set()
@@ -0,0 +1,37 @@
+import asyncio
+
+from members import MemberDirectory
+from memory_db import MemoryDatabase
+
+GROUP_ID = -100
+OTHER_GROUP_ID = -200
+
+
+def test_members_are_kept_per_group():
+    async def scenario():
+        db = MemoryDatabase()
+        await db.save_user_data(GROUP_ID, 1, role='Зеле', custom_title='Зеле')
+        await db.save_emoji(GROUP_ID, 1, '🔥')
+        directory = MemberDirectory(db)
+        await directory.load()
+
+        await directory.save_user_data(OTHER_GROUP_ID, 1, role='Кэйа')
+        await directory.save_emoji(OTHER_GROUP_ID, 1, '🌊')
+        assert await directory.get_user_data(GROUP_ID, 1) == {'role': 'Зеле',
+                                                               'custom_title': 'Зеле'}
+        assert await directory.get_used_emojis(OTHER_GROUP_ID) == ['🌊']
+
+        # Выход из одного сообщества не удаляет данные в другом
+        await directory.remove_user_data(GROUP_ID, 1)
+        await directory.remove_emoji(GROUP_ID, 1)
+        assert await directory.get(GROUP_ID, 1) is None
+        assert await directory.get_emoji(OTHER_GROUP_ID, 1) == '🌊'
+
+        # Изменение другим процессом: пользователь перечитывается во всех сообществах
+        await db.save_emoji(GROUP_ID, 1, '⭐️')
+        await directory.invalidate(1)
+        assert await directory.get_emoji(GROUP_ID, 1) == '⭐️'
+        assert await directory.get_user_data(OTHER_GROUP_ID, 1) == {'role': 'Кэйа',
+                                                                     'custom_title': None}
+
+    asyncio.run(scenario())
@@ -0,0 +1,55 @@
+import asyncio
+
+from memory_db import MemoryDatabase
+from roles import RoleRegistry
+
+GROUP_ID = -100
+OTHER_GROUP_ID = -200
+
+
+def test_roles_are_taken_per_group():
+    async def scenario():
+        db = MemoryDatabase()
+        registry = RoleRegistry(db)
+        await registry.load()
+
+        assert await registry.take(GROUP_ID, 'Зеле', 1)
+        # Та же роль в другом сообществе свободна
+        assert (await registry.check(OTHER_GROUP_ID, 'зеле', 2)).holder is None
+        assert await registry.take(OTHER_GROUP_ID, 'Зеле', 2)
+        assert not await registry.take(GROUP_ID, 'Зеле', 2)
+
+        # Выход из одного сообщества не освобождает роль в другом
+        assert await registry.release(GROUP_ID, 1) == ['Зеле']
+        assert registry.free_roles(GROUP_ID) == ['Зеле']
+        assert registry.free_roles(OTHER_GROUP_ID) == []
+        assert registry.holder(OTHER_GROUP_ID, 'Зеле') == 2
+
+        # После перезагрузки реестр тот же
+        reloaded = RoleRegistry(db)
+        await reloaded.load()
+        assert reloaded.free_roles(GROUP_ID) == ['Зеле']
+        assert reloaded.role_of(OTHER_GROUP_ID, 2) == 'Зеле'
+
+    asyncio.run(scenario())
+
+
+class NoSimilarQueryDatabase(MemoryDatabase):
+    """Хранилище без pg_trgm: запрос похожих ролей к нему - ошибка"""
+
+    async def find_similar_roles(self, group_id: int, role_key: str, limit: int):
+        raise AssertionError("без pg_trgm похожие роли ищутся в памяти")
+
+
+def test_similar_roles_without_trgm_use_registry():
+    async def scenario():
+        db = NoSimilarQueryDatabase()
+        registry = RoleRegistry(db)
+        await registry.take(GROUP_ID, 'Зеле', 1)
+        await registry.take(OTHER_GROUP_ID, 'Зелле', 2)
+
+        check = await registry.check(GROUP_ID, 'Зелe', 3)
+        assert check.similar_taken() == ['Зеле']
+        assert (await registry.check(OTHER_GROUP_ID, 'Кэйа', 3)).similar == []
+
+    asyncio.run(scenario())
@@ -0,0 +1,78 @@
+import asyncio
+
+from memory_db import MemoryDatabase
+from waitlist import Waitlist
+
+GROUP_ID = -100
+
+
+class StubBot:
+    """Бот с заданным числом участников; запоминает, кому отправлена ссылка"""
+
+    def __init__(self, member_count: int):
+        self.member_count = member_count
+        self.sent = []
+
+    async def get_chat_member_count(self, chat_id: int) -> int:
+        return self.member_count
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent.append(chat_id)
+
+
+async def apply_with_media(db: MemoryDatabase, waitlist: Waitlist, user_id: int, role: str,
+                           group_id: int = GROUP_ID):
+    """Как age_verify_any_handler: заявка сохраняется всегда, в очередь - только в полную группу"""
+    await db.save_pending_application(user_id, role, group_id)
+    if await waitlist.is_full(group_id):
+        await db.join_waitlist(user_id, role, group_id)
+
+
+def test_application_with_room_is_not_offered_seat():
+    async def scenario():
+        db = MemoryDatabase()
+        bot = StubBot(member_count=10)
+        waitlist = Waitlist(db, bot, limit=10, ttl=3600)
+
+        # Число участников запрашивается при первом /start
+        assert await waitlist.is_full(GROUP_ID)
+        assert await waitlist.left(GROUP_ID)
+        # Место есть: заявка подана, но в очередь не встает
+        await apply_with_media(db, waitlist, 1, 'Зеле')
+        await waitlist.joined(GROUP_ID, 2)
+        # Группа снова заполнена: эта заявка ждет в очереди
+        await apply_with_media(db, waitlist, 3, 'Кэйа')
+
+        assert await waitlist.left(GROUP_ID)
+        offered = await waitlist.offer_seat(GROUP_ID, 'https://t.me/+group')
+        assert offered['user_id'] == 3
+        assert bot.sent == [3]
+        assert await waitlist.offer_seat(GROUP_ID, 'https://t.me/+group') is None
+        assert bot.sent == [3]
+        # Заявки остаются в таблице после извлечения из очереди
+        assert await db.get_application_role(1) == 'Зеле'
+        assert await db.get_application_role(3) == 'Кэйа'
+
+    asyncio.run(scenario())
+
+
+def test_seat_is_offered_from_own_group_queue():
+    async def scenario():
+        db = MemoryDatabase()
+        bot = StubBot(member_count=10)
+        waitlist = Waitlist(db, bot, limit=10, ttl=3600)
+        other_group = -200
+
+        # Первым в очередь встает заявитель другой группы
+        await apply_with_media(db, waitlist, 1, 'Зеле', group_id=other_group)
+        await apply_with_media(db, waitlist, 2, 'Кэйа')
+
+        assert await waitlist.left(GROUP_ID)
+        offered = await waitlist.offer_seat(GROUP_ID, 'https://t.me/+group')
+        assert offered['user_id'] == 2
+        assert await waitlist.offer_seat(GROUP_ID, 'https://t.me/+group') is None
+        # Заявка другой группы осталась в ее очереди
+        offered = await waitlist.offer_seat(other_group, 'https://t.me/+other')
+        assert offered['user_id'] == 1
+
+    asyncio.run(scenario())
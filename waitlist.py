@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from metrics import Counter, registry
+
+# Сколько участников вмещает группа
+GROUP_MEMBER_LIMIT = int(os.environ.get('GROUP_MEMBER_LIMIT', '50'))
+# Через сколько секунд число участников перечитывается из Telegram, с
+# (апдейты chat_member могли прийти в другой процесс или потеряться)
+MEMBER_COUNT_TTL = float(os.environ.get('MEMBER_COUNT_TTL', '3600'))
+
+waitlist_offers = registry.register(Counter(
+    'bot_waitlist_offers_total', 'Места, предложенные из очереди ожидания', ('result',)))
+
+
+def seat_offer_text(group_link: str) -> str:
+    return (f"🎉 <b>В группе освободилось место!</b>\n\n"
+            f"Ваша заявка первая в очереди. Перейдите по "
+            f"<a href=\"{group_link}\"><b>ссылке (нажать)</b></a>, чтобы вступить.")
+
+
+class MemberCount:
+    __slots__ = ('value', 'fetched_at')
+
+    def __init__(self, value: int):
+        self.value = value
+        self.fetched_at = time.monotonic()
+
+
+class Waitlist:
+    """Очередь ожидания для заполненной группы.
+
+    Очередь группы - заявки pending_applications, поданные, когда группа
+    была заполнена (waitlisted_at, group_id): первым место получает
+    тот, кто раньше встал в очередь этой группы. Заявки, поданные при свободных местах, в очередь не
+    попадают. Извлеченная заявка остается в таблице. Число участников группы
+    запрашивается у Telegram один раз за MEMBER_COUNT_TTL и между запросами
+    ведется по апдейтам chat_member (joined/left). Когда после выхода
+    участника в группе есть место, первая заявка извлекается из очереди
+    (в базе, так что одну заявку не получат два процесса) и пользователю
+    отправляется ссылка на вступление.
+    """
+
+    def __init__(self, database, bot: Bot, limit: int = GROUP_MEMBER_LIMIT,
+                 ttl: float = MEMBER_COUNT_TTL):
+        self.db = database
+        self.bot = bot
+        self.limit = limit
+        self.ttl = ttl
+        self._counts: Dict[int, MemberCount] = {}
+        # Запросы числа участников в процессе: одновременные /start ждут один
+        self._fetching: Dict[int, asyncio.Future] = {}
+
+    async def member_count(self, group_id: int) -> int:
+        entry = self._counts.get(group_id)
+        if entry is not None and time.monotonic() - entry.fetched_at <= self.ttl:
+            return entry.value
+        fetching = self._fetching.get(group_id)
+        if fetching is None:
+            fetching = asyncio.ensure_future(self._fetch(group_id))
+            self._fetching[group_id] = fetching
+        return await asyncio.shield(fetching)
+
+    async def _fetch(self, group_id: int) -> int:
+        try:
+            entry = MemberCount(await self.bot.get_chat_member_count(group_id))
+            self._counts[group_id] = entry
+            return entry.value
+        finally:
+            del self._fetching[group_id]
+
+    async def is_full(self, group_id: int) -> bool:
+        return await self.member_count(group_id) >= self.limit
+
+    async def joined(self, group_id: int, user_id: int):
+        """Участник вступил: его заявка больше не ждет места"""
+        self._adjust(group_id, 1)
+        await self.db.leave_waitlist(user_id, group_id)
+
+    async def left(self, group_id: int) -> bool:
+        """Участник вышел. True - в группе есть место"""
+        self._adjust(group_id, -1)
+        return not await self.is_full(group_id)
+
+    async def offer_seat(self, group_id: int, group_link: str) -> Optional[Dict]:
+        """Первая заявка из очереди группы получает ссылку на вступление.
+
+        Пользователи, заблокировавшие бота, пропускаются (их заявки уже
+        извлечены). None - очередь пуста.
+        """
+        while True:
+            row = await self.db.pop_waitlist(group_id)
+            if row is None:
+                return None
+            try:
+                await self.bot.send_message(row['user_id'], seat_offer_text(group_link),
+                                            disable_web_page_preview=True)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                waitlist_offers.labels('unreachable').inc()
+                logging.info(f"Заявка {row['user_id']} из очереди пропущена: {e}")
+                continue
+            waitlist_offers.labels('sent').inc()
+            return row
+
+    def _adjust(self, group_id: int, delta: int):
+        entry = self._counts.get(group_id)
+        if entry is not None:
+            entry.value = max(entry.value + delta, 0)
@@ -0,0 +1,174 @@
+import asyncio
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as CounterDict
+from datetime import datetime
+from typing import Optional
+
+from metrics import Counter, registry
+
+loop_stalls = registry.register(Counter(
+    'bot_event_loop_stalls_total', 'Блокировки цикла событий дольше порога'))
+
+# Порог блокировки цикла событий в мс (0 - сторож выключен)
+LOOP_WATCHDOG_MS = int(os.environ.get('LOOP_WATCHDOG_MS', '0'))
+# Порог медленного колбэка для отладочного режима asyncio в мс (0 - выключено)
+LOOP_SLOW_CALLBACK_MS = int(os.environ.get('LOOP_SLOW_CALLBACK_MS', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_MODES = ('pstats', 'collapsed')
+
+
+def _format_frame_stack(frame) -> str:
+    return ''.join(traceback.format_stack(frame))
+
+
+def enable_slow_callback_log(threshold: float):
+    """Отладочный режим asyncio: в лог пишутся колбэки дольше порога"""
+    loop = asyncio.get_running_loop()
+    loop.slow_callback_duration = threshold
+    loop.set_debug(True)
+    logging.getLogger('asyncio').setLevel(logging.WARNING)
+
+
+class LoopWatchdog:
+    """Обнаружение блокировок цикла событий.
+
+    Корутина-пульс обновляет отметку времени, отдельный поток проверяет её и
+    при превышении порога пишет в лог стек потока цикла и текущую задачу.
+    """
+
+    def __init__(self, threshold: float, interval: float = None):
+        self.threshold = threshold
+        self.interval = interval or min(threshold / 2, 0.1)
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog",
+                                        daemon=True)
+        self._thread.start()
+        logging.info(f"Сторож цикла событий запущен, порог {self.threshold * 1000:.0f} мс")
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            # Одна запись в лог на одну блокировку
+            reported_beat = beat
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            task = None
+            try:
+                task = asyncio.current_task(self._loop)
+            except RuntimeError:
+                pass
+            task_name = task.get_name() if task else 'нет'
+            coro = task.get_coro() if task else None
+            logging.warning(
+                f"Цикл событий заблокирован на {stalled * 1000:.0f} мс "
+                f"(задача: {task_name}, корутина: {getattr(coro, '__qualname__', coro)})\n"
+                f"{_format_frame_stack(frame) if frame else 'стек недоступен'}")
+
+
+class SamplingProfiler:
+    """Профилирование по команде админа.
+
+    pstats - cProfile в потоке цикла событий, collapsed - выборка стеков
+    потока цикла из отдельного потока (формат для flamegraph).
+    """
+
+    def __init__(self, output_dir: str = PROFILE_DIR, sample_interval: float = 0.005):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.mode: Optional[str] = None
+        self.started_at: Optional[datetime] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._samples: CounterDict = CounterDict()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def start(self, mode: str = 'pstats'):
+        """Запуск профилирования (вызывается из потока цикла событий)"""
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+        if mode == 'pstats':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif mode == 'collapsed':
+            self._samples.clear()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._sample, args=(threading.get_ident(),),
+                name="sampling-profiler", daemon=True)
+            self._thread.start()
+        else:
+            raise ValueError(f"Неизвестный режим профилирования: {mode}")
+        self.mode = mode
+        self.started_at = datetime.now()
+
+    async def stop(self) -> str:
+        """Остановка профилирования, возвращает путь к файлу с результатом"""
+        if not self.running:
+            raise RuntimeError("Профилирование не запущено")
+        mode, self.mode = self.mode, None
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = self.started_at.strftime('%Y%m%d-%H%M%S')
+        if mode == 'pstats':
+            self._profile.disable()
+            path = os.path.join(self.output_dir, f"profile-{stamp}.pstats")
+            await asyncio.to_thread(self._profile.dump_stats, path)
+            self._profile = None
+        else:
+            self._stop.set()
+            await asyncio.to_thread(self._thread.join)
+            path = os.path.join(self.output_dir, f"profile-{stamp}.collapsed")
+            await asyncio.to_thread(self._write_collapsed, path)
+        return path
+
+    def _sample(self, thread_id: int):
+        while not self._stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self._samples[';'.join(reversed(stack))] += 1
+
+    def _write_collapsed(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self._samples.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.types import Update
+
+from metrics import Counter, Histogram, registry
+
+# Режим процесса: single - polling и обработка в одном процессе,
+# ingest - только прием апдейтов в updates_queue, worker - только обработка
+BOT_MODES = ('single', 'ingest', 'worker')
+BOT_MODE = os.environ.get('BOT_MODE', 'single')
+if BOT_MODE not in BOT_MODES:
+    raise ValueError(f"Неизвестный режим BOT_MODE: {BOT_MODE}")
+# Сколько апдейтов воркер обрабатывает одновременно (из разных чатов)
+QUEUE_CONCURRENCY = int(os.environ.get('QUEUE_CONCURRENCY', '32'))
+# Как часто воркер проверяет очередь, если уведомление о новых апдейтах не пришло, с
+QUEUE_POLL_INTERVAL = float(os.environ.get('QUEUE_POLL_INTERVAL', '1'))
+# Через сколько секунд апдейт упавшего воркера можно взять снова
+QUEUE_CLAIM_TIMEOUT = float(os.environ.get('QUEUE_CLAIM_TIMEOUT', '60'))
+# После скольких попыток апдейт пропускается
+QUEUE_MAX_ATTEMPTS = int(os.environ.get('QUEUE_MAX_ATTEMPTS', '3'))
+INGEST_POLLING_TIMEOUT = 30
+
+queue_ingested = registry.register(Counter(
+    'bot_queue_ingested_total', 'Апдейты, записанные в updates_queue'))
+queue_processed = registry.register(Counter(
+    'bot_queue_processed_total', 'Апдейты, обработанные воркерами', ('result',)))
+queue_wait = registry.register(Histogram(
+    'bot_queue_wait_seconds', 'Время от записи апдейта в очередь до начала обработки',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+
+
+def partition_key(update: Update) -> int:
+    """Ключ порядка: апдейты одного чата обрабатываются строго по очереди"""
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat_id is not None:
+        return context.chat_id
+    if context.user_id is not None:
+        return context.user_id
+    return 0
+
+
+def serialize_update(update: Update) -> str:
+    return update.model_dump_json(exclude_unset=True, by_alias=True)
+
+
+class UpdateIngest:
+    """Прием апдейтов через getUpdates с записью в updates_queue.
+
+    Смещение getUpdates сдвигается только после записи пачки в базу:
+    при ошибке базы Telegram отдаст те же апдейты еще раз, повторы
+    отбрасываются по update_id.
+    """
+
+    def __init__(self, database, bot: Bot, allowed_updates: List[str],
+                 on_received: Optional[Callable[[int], Any]] = None,
+                 polling_timeout: int = INGEST_POLLING_TIMEOUT):
+        self.db = database
+        self.bot = bot
+        self.allowed_updates = allowed_updates
+        self.on_received = on_received
+        self.polling_timeout = polling_timeout
+
+    async def run(self):
+        offset = None
+        delay = 1.0
+        logging.info("Прием апдейтов в очередь запущен")
+        while True:
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset, timeout=self.polling_timeout,
+                    allowed_updates=self.allowed_updates)
+                if updates:
+                    await self.enqueue(updates)
+                    offset = updates[-1].update_id + 1
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка приема апдейтов: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def enqueue(self, updates: List[Update]):
+        await self.db.enqueue_updates([
+            (update.update_id, partition_key(update), serialize_update(update))
+            for update in updates])
+        queue_ingested.inc(len(updates))
+        if self.on_received:
+            self.on_received(updates[-1].update_id)
+
+
+class QueueWorker:
+    """Обработка апдейтов из updates_queue через dp.feed_update.
+
+    Воркеров может быть сколько угодно (процессы и контейнеры). Берется
+    только первый необработанный апдейт каждого чата (FOR UPDATE SKIP
+    LOCKED), поэтому апдейты одного чата идут по порядку, а разных чатов -
+    параллельно. Обработанные апдейты удаляются пачкой на следующей
+    итерации. Апдейт воркера, который упал, берется снова через
+    QUEUE_CLAIM_TIMEOUT секунд.
+    """
+
+    def __init__(self, database, dp: Dispatcher, bot: Bot,
+                 worker_id: Optional[str] = None,
+                 concurrency: int = QUEUE_CONCURRENCY,
+                 poll_interval: float = QUEUE_POLL_INTERVAL,
+                 claim_timeout: float = QUEUE_CLAIM_TIMEOUT,
+                 on_processed: Optional[Callable[[int, bool], Any]] = None):
+        self.db = database
+        self.dp = dp
+        self.bot = bot
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.on_processed = on_processed
+        self._in_flight = set()
+        self._done: List[int] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._listener = None
+
+    def wake(self):
+        """Новые апдейты в очереди (уведомление от приема)"""
+        self._wakeup.set()
+
+    def stop(self):
+        """Перестать брать апдейты; run() вернется после обработки начатых"""
+        self._stopping = True
+        self._wakeup.set()
+
+    async def run(self, channel: Optional[str] = None):
+        if channel:
+            self._listener = await self.db.connect_dedicated('worker')
+            if self._listener is not None:
+                await self._listener.add_listener(channel, lambda *_: self.wake())
+        logging.info(f"Воркер очереди {self.worker_id} запущен")
+        try:
+            while not self._stopping or self._in_flight:
+                # Сигналы, пришедшие после сброса, не теряются: ожидание ниже сразу вернется
+                self._wakeup.clear()
+                await self._flush()
+                free = 0 if self._stopping else self.concurrency - len(self._in_flight)
+                rows = []
+                if free > 0:
+                    rows = await self.db.claim_updates(self.worker_id, free,
+                                                       self.claim_timeout)
+                for row in rows:
+                    task = asyncio.create_task(self._process(row))
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+                if rows:
+                    # Даем начатым обработкам продвинуться до следующего захвата
+                    await asyncio.sleep(0)
+                    continue
+                waiters = set(self._in_flight)
+                waiters.add(asyncio.ensure_future(self._wakeup.wait()))
+                _, pending = await asyncio.wait(waiters, timeout=self.poll_interval,
+                                                return_when=asyncio.FIRST_COMPLETED)
+                for waiter in pending - self._in_flight:
+                    waiter.cancel()
+            await self._flush()
+        finally:
+            if self._listener is not None:
+                await self._listener.close()
+                self._listener = None
+
+    async def _flush(self):
+        if not self._done:
+            return
+        done, self._done = self._done, []
+        try:
+            await self.db.complete_updates(done)
+        except Exception as e:
+            # Апдейты снова станут доступны через claim_timeout; вернем их в список
+            self._done.extend(done)
+            logging.error(f"Ошибка удаления обработанных апдейтов: {e}")
+
+    async def _process(self, row: Dict):
+        update_id = row['update_id']
+        error = False
+        queue_wait.observe(row['wait'])
+        try:
+            if row['attempts'] > QUEUE_MAX_ATTEMPTS:
+                queue_processed.labels('dropped').inc()
+                logging.error(f"Апдейт {update_id} пропущен после {QUEUE_MAX_ATTEMPTS} попыток")
+            else:
+                update = Update.model_validate_json(row['payload'], context={'bot': self.bot})
+                await self.dp.feed_update(self.bot, update)
+                queue_processed.labels('ok').inc()
+        except Exception as e:
+            error = True
+            queue_processed.labels('error').inc()
+            logging.error(f"Ошибка обработки апдейта {update_id} из очереди: {e}")
+        finally:
+            self._done.append(update_id)
+            # Следующий апдейт этого чата станет доступен после удаления текущего
+            self._wakeup.set()
+            if self.on_processed:
+                self.on_processed(update_id, error)
+
+
+class DatabaseFSMStorage(BaseStorage):
+    """Состояния FSM в базе: диалог пользователя может продолжить любой воркер"""
+
+    def __init__(self, database):
+        self.db = database
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.thread_id:
+            parts.append(str(key.thread_id))
+        if key.destiny != 'default':
+            parts.append(key.destiny)
+        return ':'.join(parts)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        await self.db.set_fsm_state(self._key(key),
+                                    state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self.db.get_fsm(self._key(key))
+        return row['state'] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.db.set_fsm_data(self._key(key), data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self.db.get_fsm(self._key(key))
+        return dict(row['data']) if row else {}
+
+    async def close(self) -> None:
+        pass